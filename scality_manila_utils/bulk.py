@@ -0,0 +1,118 @@
+# Copyright (c) 2015 Scality
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Run commands concurrently with asyncio, see
+:py:func:`scality_manila_utils.utils.run_many`.
+
+This module requires Python 3.5 or later.
+"""
+
+import asyncio
+import logging
+import sys
+import time
+
+from scality_manila_utils import utils
+from scality_manila_utils.exceptions import (CommandTimeoutException,
+                                             EnvironmentException)
+
+log = logging.getLogger(__name__)
+
+
+async def _read(stream, cmd):
+    chunks = []
+    size = 0
+    while True:
+        data = await stream.read(64 * 1024)
+        if not data:
+            return b''.join(chunks)
+
+        size += len(data)
+        if size > utils.COMMAND_MAX_OUTPUT:
+            raise EnvironmentError(
+                "Command {0!r} wrote more than {1:d} bytes".format(
+                    cmd, utils.COMMAND_MAX_OUTPUT))
+        chunks.append(data)
+
+
+async def _run(semaphore, cmd, timeout):
+    async with semaphore:
+        deadline = utils.command_deadline(timeout)
+        process = await asyncio.create_subprocess_exec(
+            *utils.resolve_command(cmd), stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE, start_new_session=True
+        )
+        try:
+            stdout, stderr, returncode = await asyncio.wait_for(
+                asyncio.gather(_read(process.stdout, cmd),
+                               _read(process.stderr, cmd), process.wait()),
+                max(deadline - time.monotonic(), 0)
+            )
+        except asyncio.TimeoutError:
+            utils.kill_process_group(process.pid)
+            await process.wait()
+            raise CommandTimeoutException(
+                "Command {0!r} timed out".format(cmd))
+        except BaseException:
+            utils.kill_process_group(process.pid)
+            await process.wait()
+            raise
+
+        return utils.CommandResult(cmd, returncode, stdout, stderr, None)
+
+
+async def _run_or_fail(semaphore, cmd, timeout):
+    try:
+        return await _run(semaphore, cmd, timeout)
+    except (EnvironmentError, EnvironmentException) as e:
+        log.debug("Command %r failed: %s", cmd, e)
+        return utils.CommandResult(cmd, None, b'', b'', e)
+
+
+async def run_all(cmds, concurrency, timeout=None):
+    """
+    Run commands, at most `concurrency` at a time.
+
+    :param cmds: the commands with arguments to execute
+    :type cmds: iterable of iterables of `str`
+    :param concurrency: maximum number of commands running at once
+    :type concurrency: int
+    :param timeout: time in seconds each command may run for
+    :type timeout: int
+    :returns: list of :py:class:`scality_manila_utils.utils.CommandResult`
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    return list(await asyncio.gather(*[
+        _run_or_fail(semaphore, list(cmd), timeout) for cmd in cmds
+    ]))
+
+
+def run_many(cmds, concurrency, timeout=None):
+    """
+    Run commands from a new event loop, see :py:func:`run_all`.
+
+    Before Python 3.8, the child watcher only reaps the subprocesses of the
+    loop it is attached to, and waiting for one blocks otherwise. The loop
+    is thus made the current one, and the watcher attached to it.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        if sys.version_info < (3, 8):
+            asyncio.get_child_watcher().attach_loop(loop)
+        return loop.run_until_complete(run_all(cmds, concurrency, timeout))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
@@ -16,6 +16,8 @@
 from __future__ import print_function
 import argparse
 import grp
+import io
+import json
 import logging
 import logging.handlers
 import os
@@ -25,6 +27,7 @@ import sys
 import scality_manila_utils
 import scality_manila_utils.nfs_helper
 import scality_manila_utils.smb_helper
+import scality_manila_utils.utils
 
 log = logging.getLogger(__name__)
 
@@ -92,6 +95,20 @@ def drop_privileges():
         raise RuntimeError(msg)
 
 
+def json_file(path):
+    """
+    Load a json document, for use as an argument type.
+
+    :param path: path to the document, or `-` for the standard input
+    :type path: string
+    """
+    if path == '-':
+        return json.load(sys.stdin)
+
+    with io.open(path, 'rt') as f:
+        return json.load(f)
+
+
 def main(args=None):
     setup_logger()
 
@@ -110,6 +127,24 @@ def main(args=None):
         '--debug', help='Set debug log level', action='store_true',
         default=False
     )
+    parser.add_argument(
+        '--check-ttl', type=int, default=30, metavar='SECONDS',
+        help='Skip the environment checks for this long after they succeeded'
+    )
+    parser.add_argument(
+        '--force-check', action='store_true', default=False,
+        help='Check the environment even if it was recently checked'
+    )
+    parser.add_argument(
+        '--durability', default='strict',
+        choices=scality_manila_utils.utils.DURABILITY_LEVELS,
+        help='How hard to flush the files written to disk, relaxed is only '
+             'meant for scratch environments'
+    )
+    parser.add_argument(
+        '--timeout', type=int, default=None, metavar='SECONDS',
+        help='Abort the commands run that are still running after this long'
+    )
 
     protocol_parsers = parser.add_subparsers()
     nfs_parser = protocol_parsers.add_parser(
@@ -136,6 +171,11 @@ def main(args=None):
         help='SOFS directory that holds the SMB shares',
         default='/ring/fs'
     )
+    smb_parser.add_argument(
+        '--collapse-hosts', action='store_true', default=False,
+        help='Write the hosts allowed on a share as the fewest networks '
+             'covering them, the hosts granted access are kept aside'
+    )
 
     nfs_subparsers = nfs_parser.add_subparsers()
     smb_subparsers = smb_parser.add_subparsers()
@@ -168,6 +208,10 @@ def main(args=None):
         parser_get.add_argument(
             'export_name', help='Filesystem to get information about'
         )
+        parser_get.add_argument(
+            '--fingerprint', action='store_true', default=False,
+            help='Output the clients along with the export fingerprint'
+        )
         parser_get.set_defaults(func=getattr(helper, 'get_export'))
 
         help = description = \
@@ -194,12 +238,22 @@ def main(args=None):
         parser_grant.add_argument(
             'host', help='IP address or network to grant access for'
         )
+        parser_grant.add_argument(
+            '--if-match', metavar='FINGERPRINT', default=None,
+            help='Only grant access if the export fingerprint matches, and '
+                 'output the new fingerprint'
+        )
         parser_grant.set_defaults(func=getattr(helper, 'grant_access'))
 
         if helper == scality_manila_utils.nfs_helper:
             parser_grant.add_argument(
                 'options', help='Export options', nargs='*'
             )
+            parser_grant.add_argument(
+                '--journal', action='store_true', default=False,
+                help='Record the grant in the exports journal, it is applied '
+                     'on the next journal compaction or reload'
+            )
 
         help = description = 'Revoke access from an existing filesystem'
         if helper == scality_manila_utils.nfs_helper:
@@ -215,20 +269,73 @@ def main(args=None):
         parser_revoke.add_argument(
             'host', help='IP address or network to revoke access for'
         )
+        parser_revoke.add_argument(
+            '--if-match', metavar='FINGERPRINT', default=None,
+            help='Only revoke access if the export fingerprint matches, and '
+                 'output the new fingerprint'
+        )
         parser_revoke.set_defaults(func=getattr(helper, 'revoke_access'))
 
+        if helper == scality_manila_utils.nfs_helper:
+            parser_revoke.add_argument(
+                '--journal', action='store_true', default=False,
+                help='Record the revocation in the exports journal, it is '
+                     'applied on the next journal compaction or reload'
+            )
+
+    help = description = \
+        'Compact the exports journal into the exports file and reexport'
+    parser_reload = nfs_subparsers.add_parser(
+        'reload', description=description, help=help
+    )
+    parser_reload.set_defaults(
+        func=scality_manila_utils.nfs_helper.reload_exports
+    )
+
+    help = description = 'Check the consistency of the exports file'
+    parser_validate = nfs_subparsers.add_parser(
+        'validate', description=description, help=help
+    )
+    parser_validate.set_defaults(
+        func=scality_manila_utils.nfs_helper.validate_exports
+    )
+
+    help = description = 'Grant and revoke access to many shares at once'
+    parser_batch = smb_subparsers.add_parser(
+        'batch', description=description, help=help
+    )
+    parser_batch.add_argument(
+        'requests', type=json_file, nargs='?', default='-',
+        help='Json list of [share, host, action] requests, where the action '
+             'is either grant or revoke, - to read them from the standard '
+             'input'
+    )
+    parser_batch.set_defaults(
+        func=scality_manila_utils.smb_helper.batch_access
+    )
+
     parsed_args = parser.parse_args(args)
 
     # Set debug level if requested
     if parsed_args.debug:
         logging.root.setLevel(logging.DEBUG)
 
+    scality_manila_utils.utils.configure_environment_checks(
+        parsed_args.check_ttl, force=parsed_args.force_check
+    )
+    scality_manila_utils.utils.set_deadline(parsed_args.timeout)
+    scality_manila_utils.utils.set_durability(parsed_args.durability)
+    scality_manila_utils.smb_helper.set_collapse_hosts(
+        getattr(parsed_args, 'collapse_hosts', False)
+    )
+
     # Drop any elevated permissions
     drop_privileges()
 
     command_args = dict(
         (k, v) for k, v in vars(parsed_args).items()
-        if k not in ('func', 'debug')
+        if k not in ('func', 'debug', 'check_ttl', 'force_check', 'timeout',
+                     'durability', 'collapse_hosts')
     )
 
     formatted_args = ", ".join(
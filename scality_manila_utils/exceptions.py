@@ -49,3 +49,18 @@ class ExportHasGrantsException(ExportException):
 class ExportAlreadyExists(ExportException):
     """Raised when an export already exists."""
     EXIT_CODE = 14
+
+
+class ExportReloadException(ExportException):
+    """Raised when the exports could not be reloaded by every sfused."""
+    EXIT_CODE = 15
+
+
+class FingerprintMismatchException(ExportException):
+    """Raised when an export changed since its fingerprint was taken."""
+    EXIT_CODE = 16
+
+
+class CommandTimeoutException(EnvironmentException):
+    """Raised when a command does not complete in time."""
+    EXIT_CODE = 17
@@ -13,9 +13,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import bisect
 import logging
 import re
+import socket
+import struct
 
+from scality_manila_utils import utils
 from scality_manila_utils.exceptions import (ExportException,
                                              DeserializationException,
                                              ClientExistsException,
@@ -23,6 +27,18 @@ from scality_manila_utils.exceptions import (ExportException,
 
 log = logging.getLogger(__name__)
 
+# Fingerprint of an export without any client, i.e. not in the table
+NO_CLIENTS_FINGERPRINT = utils.fingerprint(u'')
+
+# Options that can't be set together on a client
+CONFLICTING_OPTIONS = (
+    ('rw', 'ro'),
+    ('sync', 'async'),
+    ('secure', 'insecure'),
+    ('root_squash', 'no_root_squash'),
+    ('subtree_check', 'no_subtree_check'),
+)
+
 
 class ExportTable(object):
     """
@@ -36,10 +52,46 @@ class ExportTable(object):
         :type exports: iterable of
             :py:class:`scality_manila_utils.export.Export`
         """
-        self.exports = dict(
+        self._exports = _TrackedDict(
             (export.export_point, export)
             for export in exports
         )
+        # Export points in serialization order, kept up to date by
+        # `add_client` and `remove_client` once computed
+        self._sorted_points = None
+
+    @property
+    def exports(self):
+        """
+        The exports of the table, by export point.
+
+        Changes made to this mapping are tracked, so that the export points
+        get sorted again on the next serialization.
+        """
+        return self._exports
+
+    @exports.setter
+    def exports(self, exports):
+        self._exports = _TrackedDict(exports)
+
+    def _points_in_order(self):
+        """
+        Tell whether the sorted export points are up to date.
+
+        :rtype: boolean
+        """
+        return self._sorted_points is not None and not self._exports.dirty
+
+    def _export_points(self):
+        """
+        Get the export points in their canonical (sorted) order.
+
+        :returns: list of strings
+        """
+        if not self._points_in_order():
+            self._sorted_points = sorted(self._exports)
+            self._exports.dirty = False
+        return self._sorted_points
 
     def add_client(self, export_point, host, options=None):
         """
@@ -59,20 +111,22 @@ class ExportTable(object):
         else:
             export_options = frozenset(options)
 
-        if export_point not in self.exports:
+        export = self._exports.get(export_point)
+        if export is None:
+            in_order = self._points_in_order()
             export = Export(export_point, {host: export_options})
+            self._exports[export_point] = export
+            if in_order:
+                bisect.insort(self._sorted_points, export_point)
+                self._exports.dirty = False
             log.debug("Export created: %r", export)
         else:
-            clients = self.exports[export_point].clients
-            if host in clients:
+            if host in export.clients:
                 raise ClientExistsException("Client '{0:s}' is already "
                                             "defined".format(host))
-            clients[host] = export_options
-            export = Export(export_point, clients)
+            export.set_client(host, export_options)
             log.debug("Export updated: %r", export)
 
-        self.exports[export_point] = export
-
     def remove_client(self, export_point, host):
         """
         Remove access for a client to an export.
@@ -93,15 +147,17 @@ class ExportTable(object):
             raise ClientNotFoundException("'{0:s}' has no access defined for "
                                           "'{1:s}'".format(export_point, host))
 
-        clients = export.clients
-        # If there are still clients after removal,
-        # replace the export with an updated version
-        if len(clients) > 1:
-            del clients[host]
-            self.exports[export_point] = Export(export_point, clients)
+        # If there are still clients after removal, update the export
+        if len(export.clients) > 1:
+            export.remove_client(host)
         # Otherwise remove the export
         else:
-            del self.exports[export_point]
+            in_order = self._points_in_order()
+            del self._exports[export_point]
+            if in_order:
+                index = bisect.bisect_left(self._sorted_points, export_point)
+                del self._sorted_points[index]
+                self._exports.dirty = False
 
         log.debug("'%s' revoked from export '%s'", host, export_point)
 
@@ -138,12 +194,37 @@ class ExportTable(object):
         """
         Serialize the `ExportTable` to a string following /etc/exports format.
 
+        Exports are sorted by export point, so that the same table always
+        serializes to the same string.
+
         :returns: string representation of the exports
         """
         return '\n'.join(
-            export.serialize() for export in self.exports.values()
+            self.exports[export_point].serialize()
+            for export_point in self._export_points()
         ) + '\n'
 
+    def fingerprint(self):
+        """
+        Compute a fingerprint of the whole table.
+
+        :returns: hexadecimal digest, equal for equal tables
+        """
+        return utils.fingerprint(self.serialize())
+
+    def export_fingerprint(self, export_point):
+        """
+        Compute the fingerprint of a single export.
+
+        :param export_point: the export point
+        :type export_point: string (unicode)
+        :returns: fingerprint of the export, or
+            :py:data:`NO_CLIENTS_FINGERPRINT` if it has no clients
+        """
+        if export_point in self.exports:
+            return self.exports[export_point].fingerprint()
+        return NO_CLIENTS_FINGERPRINT
+
     def __eq__(self, other):
         if not isinstance(other, ExportTable):
             return NotImplemented
@@ -172,8 +253,12 @@ class ExportTable(object):
 class Export(object):
     """
     Represents an exported filesystem, i.e. a single line in /etc/exports.
+
+    Clients are serialized from a sorted list which is cached, and updated
+    in place by `set_client` and `remove_client`. Any other change to the
+    clients mapping invalidates it.
     """
-    __slots__ = ('export_point', 'clients')
+    __slots__ = ('export_point', '_clients', '_sorted_clients')
 
     # Naive pattern, matching anything similar to an ip, hostname with wildcard
     # combinations followed by optional mount options
@@ -181,6 +266,13 @@ class Export(object):
         r'^(?P<host>[a-z0-9*.-/]+)([(](?P<options>.+)[)])?$'
     )
 
+    # Options serialized first, in this order, the others follow sorted
+    LEADING_OPTIONS = dict((option, index) for index, option in
+                           enumerate(('rw', 'ro', 'sync', 'async')))
+
+    # Serialized option lists, by set of options
+    _option_lists = {}
+
     def __init__(self, export_point, clients):
         """
         :param export_point: the export point or filesystem
@@ -194,9 +286,69 @@ class Export(object):
 
         # Hosts, networks allowed to mount the filesystem and corresponding
         # export options
+        self.clients = clients
+
+    @property
+    def clients(self):
+        """
+        Mapping from hostname/network to the set of export options.
+        """
+        return self._clients
+
+    @clients.setter
+    def clients(self, clients):
         if not clients:
             raise ExportException('An export must have at least one client')
-        self.clients = clients
+        self._clients = _TrackedDict(clients)
+        self._sorted_clients = None
+
+    def _clients_in_order(self):
+        """
+        Tell whether the sorted clients are up to date.
+
+        :rtype: boolean
+        """
+        return self._sorted_clients is not None and not self._clients.dirty
+
+    def set_client(self, host, options):
+        """
+        Add a client to the export, or replace its options.
+
+        :param host: ip address, network or domain name
+        :type host: string (unicode)
+        :param options: export options
+        :type options: iterable of strings
+        """
+        options = frozenset(options)
+        in_order = self._clients_in_order()
+        replaced = host in self._clients
+        self._clients[host] = options
+        if in_order:
+            index = bisect.bisect_left(self._sorted_clients, (host,))
+            client = (host, self._option_list(options))
+            if replaced:
+                self._sorted_clients[index] = client
+            else:
+                self._sorted_clients.insert(index, client)
+            self._clients.dirty = False
+
+    def remove_client(self, host):
+        """
+        Remove a client from the export.
+
+        :param host: ip address, network or domain name
+        :type host: string (unicode)
+        :raises: KeyError if the host is not a client, and
+            :py:class:`ExportException` if it is the last one
+        """
+        if host in self._clients and len(self._clients) == 1:
+            raise ExportException('An export must have at least one client')
+        in_order = self._clients_in_order()
+        del self._clients[host]
+        if in_order:
+            index = bisect.bisect_left(self._sorted_clients, (host,))
+            del self._sorted_clients[index]
+            self._clients.dirty = False
 
     @classmethod
     def deserialize(cls, line):
@@ -235,17 +387,50 @@ class Export(object):
         clients = dict(map(client_extract, export_parts[1:]))
         return cls(export_point, clients)
 
+    @classmethod
+    def _option_key(cls, option):
+        rank = cls.LEADING_OPTIONS.get(option, len(cls.LEADING_OPTIONS))
+        return rank, option
+
+    @classmethod
+    def _option_list(cls, options):
+        """
+        Serialize a set of options, in canonical order.
+
+        :param options: export options
+        :type options: set of strings
+        :returns: the parenthesized options, or an empty string
+        """
+        options = frozenset(options)
+        try:
+            return cls._option_lists[options]
+        except KeyError:
+            option_list = ''
+            if options:
+                option_list = '({0:s})'.format(
+                    ','.join(sorted(options, key=cls._option_key))
+                )
+            cls._option_lists[options] = option_list
+            return option_list
+
     def serialize(self):
         """
         Serialize this `Export` to an /etc/exports representation.
 
+        Clients are sorted by host and their options put in canonical order,
+        see `LEADING_OPTIONS`.
+
         :returns: a string in /etc/exports format
         """
-        clients = ''
-        for host, options in self.clients.items():
-            clients += ' ' + host
-            if options:
-                clients += '({0:s})'.format(','.join(options))
+        if not self._clients_in_order():
+            self._sorted_clients = sorted(
+                (host, self._option_list(options))
+                for host, options in self._clients.items()
+            )
+            self._clients.dirty = False
+
+        clients = ''.join(' ' + host + option_list
+                          for host, option_list in self._sorted_clients)
 
         # Attempt to align clients by padding with space up to col32
         export_line = '{export_point:<32s} {clients:s}'.format(
@@ -254,6 +439,14 @@ class Export(object):
         )
         return export_line
 
+    def fingerprint(self):
+        """
+        Compute a fingerprint of this export and its clients.
+
+        :returns: hexadecimal digest, equal for equal exports
+        """
+        return utils.fingerprint(self.serialize())
+
     def __eq__(self, other):
         if not isinstance(other, Export):
             return NotImplemented
@@ -273,3 +466,313 @@ class Export(object):
         return "Export(export_point='{0:s}', clients={1!s})".format(
             self.export_point, self.clients
         )
+
+
+class _TrackedDict(dict):
+    """
+    A dict noting whether it has been changed, see `dirty`.
+    """
+    __slots__ = ('dirty',)
+
+    def __init__(self, *args, **kwargs):
+        super(_TrackedDict, self).__init__(*args, **kwargs)
+        self.dirty = True
+
+    def _changing(method):
+        def change(self, *args, **kwargs):
+            self.dirty = True
+            return method(self, *args, **kwargs)
+        change.__name__ = method.__name__
+        return change
+
+    __setitem__ = _changing(dict.__setitem__)
+    __delitem__ = _changing(dict.__delitem__)
+    clear = _changing(dict.clear)
+    pop = _changing(dict.pop)
+    popitem = _changing(dict.popitem)
+    setdefault = _changing(dict.setdefault)
+    update = _changing(dict.update)
+    del _changing
+
+
+def _host_key(host):
+    """
+    Get a canonical key for a client host.
+
+    IPv4 addresses and networks are keyed on their network address and
+    prefix length, so that `10.0.0.1` and `10.0.0.1/32` share the same key.
+    Other hosts (names, wildcards) are keyed on their lowercased name.
+
+    :param host: ip address, network or domain name
+    :type host: string (unicode)
+    :returns: hashable key
+    :raises: ValueError if the host looks like an invalid address or network
+    """
+    address, slash, prefix = host.partition('/')
+    if not slash and not address[-1:].isdigit():
+        return host.lower()
+
+    try:
+        packed = socket.inet_pton(socket.AF_INET, address)
+    except (socket.error, ValueError):
+        if slash or address.replace('.', '').isdigit():
+            raise ValueError("Invalid address '{0:s}'".format(host))
+        # A host name ending with digits
+        return host.lower()
+
+    if not slash:
+        prefix_length = 32
+    elif prefix.isdigit() and int(prefix) <= 32:
+        prefix_length = int(prefix)
+    else:
+        raise ValueError("Invalid network '{0:s}'".format(host))
+
+    mask = (0xffffffff << (32 - prefix_length)) & 0xffffffff
+    return struct.unpack('!I', packed)[0] & mask, prefix_length
+
+
+def _validate_clients(export_point, clients, line_number, error, host_keys,
+                      option_conflicts):
+    """
+    Check the clients of an export line one by one, reporting every error.
+
+    See :py:func:`validate`.
+    """
+    seen = {}
+    for client in clients:
+        host, paren, option_list = client.partition('(')
+        if Export.CLIENT_PATTERN.match(client) is None:
+            error('invalid_line', line_number,
+                  "Unable to parse client from {0:s}".format(client),
+                  export_point=export_point)
+            continue
+
+        try:
+            key = host_keys[host]
+        except KeyError:
+            try:
+                key = _host_key(host)
+            except ValueError:
+                key = None
+            host_keys[host] = key
+
+        if key is None:
+            error('invalid_host', line_number,
+                  "Invalid address or network '{0:s}'".format(host),
+                  export_point=export_point, host=host)
+        elif key in seen:
+            error('duplicate_client', line_number,
+                  "'{0:s}' is already a client of '{1:s}' as "
+                  "'{2:s}'".format(host, export_point, seen[key]),
+                  export_point=export_point, host=host)
+        else:
+            seen[key] = host
+
+        for first, second in _option_conflicts(option_list[:-1],
+                                               option_conflicts):
+            error('conflicting_options', line_number,
+                  "'{0:s}' and '{1:s}' both set for '{2:s}'".format(
+                      first, second, host),
+                  export_point=export_point, host=host)
+
+
+def _option_conflicts(option_list, option_conflicts):
+    """
+    Get the conflicting option pairs in a comma-separated option list.
+
+    :param option_list: options, e.g. `rw,sync`
+    :type option_list: string (unicode)
+    :param option_conflicts: cache of already checked option lists
+    :type option_conflicts: dict
+    :returns: list of conflicting option pairs
+    """
+    try:
+        return option_conflicts[option_list]
+    except KeyError:
+        options = frozenset(option_list.split(','))
+        conflicts = [pair for pair in CONFLICTING_OPTIONS
+                     if options.issuperset(pair)]
+        option_conflicts[option_list] = conflicts
+        return conflicts
+
+
+# Patterns used to check a whole export line at once, see `_is_clean`
+_OCTET = r'(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])'
+_PREFIX = r'(?:/(?:3[0-2]|[12]?[0-9]))?'
+_IPV4 = r'{0:s}[.]{0:s}[.]{0:s}[.]{0:s}{1:s}'.format(_OCTET, _PREFIX)
+_IPV4_LINE = re.compile(r'{0:s}(?: {0:s})*$'.format(_IPV4))
+# Characters of the hosts accepted by `Export.CLIENT_PATTERN`, and spaces
+_NOT_HOSTS_LINE = re.compile(r'[^a-z0-9*./ ]')
+
+# Size of the pieces of a line matched at once, matching very long strings
+# against a repeated pattern being much slower
+_CHUNK_SIZE = 4096
+
+
+def _chunks(line, size=_CHUNK_SIZE):
+    """
+    Split a line of space-separated words into pieces of about `size`.
+
+    :param line: words separated by one space
+    :type line: string (unicode)
+    :returns: generator of strings, splitting the line on spaces
+    """
+    start = 0
+    while True:
+        end = line.find(' ', start + size)
+        if end < 0:
+            yield line[start:]
+            return
+        yield line[start:end]
+        start = end + 1
+
+
+def _distinct_addresses(hosts_line, client_count):
+    """
+    Check that the IPv4 addresses and networks of a line are distinct.
+
+    `/32` suffixes are dropped in bulk, so that addresses and single host
+    networks compare as strings. Only the remaining networks are keyed one
+    by one, as they can only clash with networks of the same length.
+
+    :param hosts_line: valid addresses and networks, separated by one space
+    :type hosts_line: string (unicode)
+    :param client_count: number of clients on the line
+    :type client_count: int
+    :rtype: boolean
+    """
+    if '/' in hosts_line:
+        hosts_line = hosts_line.replace('/32', '')
+    hosts = hosts_line.split(' ')
+    if len(set(hosts)) != client_count:
+        return False
+
+    if '/' not in hosts_line:
+        return True
+    networks = [host for host in hosts if '/' in host]
+    return len(set(map(_host_key, networks))) == len(networks)
+
+
+def _is_clean(clients, client_count, option_conflicts):
+    """
+    Check the clients of an export line as a whole.
+
+    This is only conclusive for lines made of distinct IPv4 addresses and
+    networks or of distinct host names, all with or all without options,
+    and without conflicting options. Hosts and options must also be
+    accepted by `Export.CLIENT_PATTERN`, so that the line can be
+    deserialized. Any other line must be checked client by client.
+
+    :param clients: the clients of an export line, separated by one space
+    :type clients: string (unicode)
+    :param client_count: number of clients on the line
+    :type client_count: int
+    :rtype: boolean
+    """
+    parentheses = clients.count('(')
+    if parentheses == 0:
+        hosts_line = clients
+        option_lists = ()
+    elif (parentheses != client_count or not clients.endswith(')') or
+            clients.count(') ') != client_count - 1):
+        return False
+    else:
+        # Clients usually share the same options, which can be dropped at
+        # once: 'h1(o) h2(o)' gives 'h1 h2'
+        options = clients[clients.index('('):clients.index(')') + 1]
+        if clients.count(options) == client_count:
+            hosts_line = clients.replace(options, '')
+            option_lists = (options[1:-1],)
+        else:
+            # 'h1(o1) h2(o2)' gives ['h1', 'o1', ' h2', 'o2', '']
+            parts = clients.replace(')', '(').split('(')
+            hosts_line = ''.join(parts[0::2])
+            option_lists = set(parts[1::2])
+        if '' in option_lists:
+            return False
+
+    if hosts_line.count(' ') != client_count - 1:
+        return False
+
+    if hosts_line[:1].isdigit():
+        if not (all(_IPV4_LINE.match(chunk) for chunk in _chunks(hosts_line))
+                and _distinct_addresses(hosts_line, client_count)):
+            return False
+    else:
+        hosts = hosts_line.split(' ')
+        if (_NOT_HOSTS_LINE.search(hosts_line) is not None or
+                '/' in hosts_line or '' in hosts or
+                len(set(hosts)) != client_count or
+                any(host[-1:].isdigit() for host in hosts)):
+            return False
+
+    return not any(_option_conflicts(option_list, option_conflicts)
+                   for option_list in option_lists)
+
+
+def validate(export_content):
+    """
+    Check the consistency of the contents of an /etc/exports file.
+
+    All the lines are checked in a single pass, detecting:
+     - lines that can't be parsed (`invalid_line`)
+     - export points defined more than once (`duplicate_export`)
+     - malformed addresses and networks (`invalid_host`)
+     - clients defined more than once for an export, including under
+       equivalent notations (`duplicate_client`)
+     - conflicting options such as `rw` and `ro` (`conflicting_options`)
+
+    Lines made of IPv4 addresses and networks, or of host names, are
+    checked as a whole with regular expressions and sets. Only mixed lines,
+    or lines where a problem is spotted, are checked client by client.
+
+    :param export_content: exports file contents split into a list of
+        strings
+    :type export_content: iterable of strings
+    :returns: a report `dict` with the number of exports and clients, the
+        list of errors found, and whether the contents are valid
+    """
+    errors = []
+    export_lines = {}
+    host_keys = {}
+    option_conflicts = {}
+    client_count = 0
+
+    def error(kind, line_number, message, **details):
+        details.update(error=kind, line=line_number, message=message)
+        errors.append(details)
+
+    for line_number, line in enumerate(export_content, 1):
+        export_parts = line.partition('#')[0].split(None, 1)
+        if not export_parts:
+            continue
+
+        export_point = export_parts[0]
+        if len(export_parts) < 2:
+            error('invalid_line', line_number,
+                  "'{0:s}' is not a valid export line".format(line.strip()))
+            continue
+
+        if export_point in export_lines:
+            error('duplicate_export', line_number,
+                  "'{0:s}' is already exported on line {1:d}".format(
+                      export_point, export_lines[export_point]),
+                  export_point=export_point)
+        else:
+            export_lines[export_point] = line_number
+
+        clients = export_parts[1].rstrip()
+        if '  ' in clients or '\t' in clients:
+            clients = ' '.join(clients.split())
+        count = clients.count(' ') + 1
+        client_count += count
+        if not _is_clean(clients, count, option_conflicts):
+            _validate_clients(export_point, clients.split(), line_number,
+                              error, host_keys, option_conflicts)
+
+    return {
+        'valid': not errors,
+        'exports': len(export_lines),
+        'clients': client_count,
+        'errors': errors,
+    }
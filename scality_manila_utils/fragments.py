@@ -0,0 +1,353 @@
+# Copyright (c) 2015 Scality
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+One file per export point, assembled into the exports file.
+"""
+
+import contextlib
+import errno
+import io
+import json
+import logging
+import os
+import os.path
+
+try:
+    from urllib import quote, unquote
+except ImportError:
+    from urllib.parse import quote, unquote
+
+from scality_manila_utils import utils
+from scality_manila_utils.exceptions import FingerprintMismatchException
+from scality_manila_utils.export import Export
+
+log = logging.getLogger(__name__)
+
+
+class ExportFragments(object):
+    """
+    A directory holding one exports line per file.
+
+    Fragments are named after their quoted export point. Names starting with
+    a dot are reserved for locks and for the assembly cache, which maps each
+    fragment to its last seen (inode, mtime, size) and line so that unchanged
+    fragments are not read again.
+    """
+    CACHE = '.cache'
+
+    def __init__(self, directory):
+        """
+        :param directory: path to the fragments directory
+        :type directory: string (unicode)
+        """
+        self.directory = directory
+
+    @classmethod
+    def for_exports(cls, exports_file):
+        """
+        Get the fragments directory (`exports.d`) next to an exports file.
+
+        :param exports_file: path to the nfs exports file
+        :type exports_file: string (unicode)
+        :returns: :py:class:`scality_manila_utils.fragments.ExportFragments`
+        """
+        directory = os.path.join(os.path.dirname(exports_file), 'exports.d')
+        return cls(directory)
+
+    def enabled(self):
+        """
+        Fragments are used as soon as the directory exists.
+
+        :rtype: boolean
+        """
+        return os.path.isdir(self.directory)
+
+    def initialized(self):
+        """
+        Check whether the fragments have been assembled at least once.
+
+        :rtype: boolean
+        """
+        return os.path.exists(os.path.join(self.directory, self.CACHE))
+
+    def _path(self, export_point):
+        return os.path.join(self.directory, quote(export_point, safe=''))
+
+    def lock(self, export_point):
+        """
+        Lock serializing changes to a single fragment.
+
+        :param export_point: export point of the fragment
+        :type export_point: string (unicode)
+        """
+        name = '.{0:s}.lock'.format(quote(export_point, safe=''))
+        return utils.file_lock(os.path.join(self.directory, name))
+
+    @contextlib.contextmanager
+    def _locked(self, export_points):
+        # Always taken in the same order, so that two holders can't deadlock
+        held = []
+        try:
+            for export_point in sorted(export_points):
+                lock = self.lock(export_point)
+                lock.__enter__()
+                held.append(lock)
+            yield
+        finally:
+            for lock in reversed(held):
+                lock.__exit__(None, None, None)
+
+    def read(self, export_point):
+        """
+        Read the export held by a fragment.
+
+        :param export_point: export point of the fragment
+        :type export_point: string (unicode)
+        :returns: :py:class:`scality_manila_utils.export.Export`, or `None`
+            if there is no such fragment
+        """
+        try:
+            with io.open(self._path(export_point), 'rt') as f:
+                line = f.read()
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+
+        return Export.deserialize(line)
+
+    def _line(self, export_point):
+        export = self.read(export_point)
+        return None if export is None else export.serialize()
+
+    def write(self, export_point, export):
+        """
+        Write or remove a fragment.
+
+        Must be called with root privileges.
+
+        :param export_point: export point of the fragment
+        :type export_point: string (unicode)
+        :param export: the export, or `None` to remove the fragment
+        :type export: :py:class:`scality_manila_utils.export.Export`
+        """
+        path = self._path(export_point)
+        if export is not None:
+            utils.safe_write(export.serialize() + '\n', path)
+            return
+
+        try:
+            os.unlink(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        utils.fsync_path(self.directory)
+
+    def split(self, exports, seen=None, commit=None):
+        """
+        Write a fragment for each export of a table.
+
+        Fragments of export points that are not in the table are removed.
+        Fragments are changed under their own lock, see :py:meth:`lock`,
+        without waiting for the exports lock, so a fragment may have been
+        changed since the table was read. Given the exports the table was
+        read from, such a newer fragment is kept if the table holds the
+        same export as when it was read, and the split fails before
+        anything is written if both changed it.
+
+        Must be called with root privileges.
+
+        :param exports: the exports to split
+        :type exports: :py:class:`scality_manila_utils.export.ExportTable`
+        :param seen: the exports the table was read from, `None` to
+            overwrite every fragment
+        :type seen: :py:class:`scality_manila_utils.export.ExportTable`
+        :param commit: called with the exports assembled from the new
+            fragments, and the files to write along with them, see
+            :py:meth:`assemble`. The changed fragments are put back if it
+            raises.
+        :type commit: callable
+        :returns: the changed fragments, mapping each export point to its
+            previous and new lines, see :py:meth:`restore`
+        :raises: :py:class:`FingerprintMismatchException` if an export was
+            changed both in the table and in its fragment
+        """
+        def line_of(table, export_point):
+            export = table.exports.get(export_point)
+            return None if export is None else export.serialize()
+
+        export_points = set(unquote(name) for name in self._names())
+        export_points.update(exports.exports)
+        candidates = [export_point for export_point in export_points
+                      if self._line(export_point) !=
+                      line_of(exports, export_point)]
+
+        changes = {}
+        with self._locked(candidates):
+            for export_point in candidates:
+                current = self._line(export_point)
+                line = line_of(exports, export_point)
+                if current == line:
+                    continue
+                if seen is not None:
+                    previous = line_of(seen, export_point)
+                    if current != previous and line == previous:
+                        log.debug("Keeping newer fragment of '%s'",
+                                  export_point)
+                        continue
+                    if current != previous:
+                        raise FingerprintMismatchException(
+                            "Export '{0:s}' was changed concurrently".format(
+                                export_point))
+                changes[export_point] = (current, line)
+
+            lines = dict((export_point, line)
+                         for export_point, (_, line) in changes.items())
+            if commit is None:
+                self._commit(lines)
+            else:
+                try:
+                    # Removed first, a crash then drops them from the
+                    # exports file as intended
+                    self._commit(dict((export_point, None)
+                                      for export_point, line in lines.items()
+                                      if line is None))
+                    serialized, files = self._assemble(lines)
+                    commit(serialized, files)
+                except Exception:
+                    self._restore(changes)
+                    raise
+
+        return changes
+
+    def restore(self, changes):
+        """
+        Put back the fragments changed by :py:meth:`split`.
+
+        Fragments changed again since are left alone. Must be called with
+        root privileges.
+
+        :param changes: the changes returned by :py:meth:`split`
+        :type changes: dict
+        """
+        with self._locked(changes):
+            self._restore(changes)
+
+    def _restore(self, changes):
+        self._commit(dict(
+            (export_point, previous)
+            for export_point, (previous, line) in changes.items()
+            if self._line(export_point) == line
+        ))
+
+    def _commit(self, lines):
+        # Fragments written are committed together, then removed ones go
+        utils.commit_files(
+            (self._path(export_point), line + '\n')
+            for export_point, line in lines.items() if line is not None
+        )
+        removed = [export_point for export_point, line in lines.items()
+                   if line is None]
+        for export_point in removed:
+            try:
+                os.unlink(self._path(export_point))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+        if removed:
+            utils.fsync_path(self.directory)
+
+    def _names(self):
+        return [name for name in os.listdir(self.directory)
+                if not name.startswith('.')]
+
+    def _load_cache(self):
+        try:
+            with io.open(os.path.join(self.directory, self.CACHE), 'rt') as f:
+                return json.load(f)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        except ValueError:
+            log.warning("Ignoring corrupt fragments cache in '%s'",
+                        self.directory)
+        return {}
+
+    def assemble(self, commit=None):
+        """
+        Concatenate all the fragments in /etc/exports format.
+
+        Must be called with root privileges, as it updates the cache.
+
+        :param commit: called with the assembled exports, and the files to
+            write along with them, see
+            :py:func:`scality_manila_utils.utils.commit_files`, instead of
+            writing the cache
+        :type commit: callable
+        :returns: string representation of the exports, if `commit` isn't
+            given
+        """
+        serialized, files = self._assemble({})
+        if commit is not None:
+            commit(serialized, files)
+            return None
+
+        utils.commit_files(files)
+        return serialized
+
+    def _assemble(self, pending):
+        # Fragments about to be written are taken from `pending`, and left
+        # out of the cache since their (inode, mtime, size) isn't known yet
+        cache = self._load_cache()
+        updated = {}
+        lines = []
+        files = []
+        names = set(self._names())
+        names.update(quote(export_point, safe='') for export_point in pending)
+        # Same order as `ExportTable.serialize`
+        for name in sorted(names, key=unquote):
+            path = os.path.join(self.directory, name)
+            if unquote(name) in pending:
+                line = pending[unquote(name)]
+                if line is not None:
+                    files.append((path, line + '\n'))
+                    lines.append(line)
+                continue
+
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+
+            key = [st.st_ino, getattr(st, 'st_mtime_ns', st.st_mtime),
+                   st.st_size]
+            cached = cache.get(name)
+            if cached is not None and cached[0] == key:
+                line = cached[1]
+            else:
+                with io.open(path, 'rt') as f:
+                    line = f.read().strip()
+
+            updated[name] = [key, line]
+            if line:
+                lines.append(line)
+
+        if updated != cache or not self.initialized():
+            files.append((os.path.join(self.directory, self.CACHE),
+                          json.dumps(updated), 0o600))
+
+        return '\n'.join(lines) + '\n', files
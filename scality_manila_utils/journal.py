@@ -0,0 +1,184 @@
+# Copyright (c) 2015 Scality
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Append-only journal of client changes made on top of an exports file.
+"""
+
+import errno
+import io
+import logging
+import os
+import time
+
+from scality_manila_utils import utils
+from scality_manila_utils.exceptions import DeserializationException
+
+log = logging.getLogger(__name__)
+
+
+class ExportJournal(object):
+    """
+    Journal of client grants and revocations, one record per line::
+
+        +<TAB><timestamp><TAB><export point><TAB><host><TAB><options>
+        -<TAB><timestamp><TAB><export point><TAB><host>
+
+    Replaying a record is idempotent, so replaying a journal on top of an
+    exports file that already includes some of its records is harmless.
+    """
+    ADD = '+'
+    REMOVE = '-'
+
+    def __init__(self, path):
+        """
+        :param path: path to the journal file
+        :type path: string (unicode)
+        """
+        self.path = path
+
+    @classmethod
+    def for_exports(cls, exports_file):
+        """
+        Get the journal kept next to an exports file.
+
+        :param exports_file: path to the nfs exports file
+        :type exports_file: string (unicode)
+        :returns: :py:class:`scality_manila_utils.journal.ExportJournal`
+        """
+        return cls(exports_file + '.journal')
+
+    def _append(self, fields):
+        record = u'\t'.join(fields) + u'\n'
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                     0o644)
+        try:
+            os.write(fd, record.encode('utf-8'))
+            utils.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def add_client(self, export_point, host, options=None):
+        """
+        Record that a client is granted access to an export.
+
+        :param export_point: exported filesystem
+        :type export_point: string (unicode)
+        :param host: ip address, network or domain name
+        :type host: string (unicode)
+        :param options: sequence of nfs options (optional)
+        :type options: iterable of strings
+        """
+        self._append((self.ADD, str(int(time.time())), export_point, host,
+                      ','.join(options or ())))
+
+    def remove_client(self, export_point, host):
+        """
+        Record that access for a client to an export is revoked.
+
+        :param export_point: exported filesystem
+        :type export_point: string (unicode)
+        :param host: ip address, network or domain name
+        :type host: string (unicode)
+        """
+        self._append((self.REMOVE, str(int(time.time())), export_point,
+                      host))
+
+    def _records(self):
+        try:
+            with io.open(self.path, 'rt') as f:
+                lines = f.read().splitlines()
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return []
+
+        records = []
+        for line in lines:
+            if not line:
+                continue
+            fields = line.split('\t')
+            if fields[0] == self.ADD and len(fields) == 5:
+                records.append(fields)
+            elif fields[0] == self.REMOVE and len(fields) == 4:
+                records.append(fields)
+            else:
+                msg = "Invalid journal record '{0:s}'".format(line)
+                raise DeserializationException(msg)
+
+        return records
+
+    def replay(self, exports):
+        """
+        Apply the journaled changes to an exports table.
+
+        :param exports: table to update in place
+        :type exports: :py:class:`scality_manila_utils.export.ExportTable`
+        :returns: number of replayed records
+        """
+        records = self._records()
+        for record in records:
+            action, _, export_point, host = record[:4]
+            granted = (export_point in exports and
+                       host in exports[export_point].clients)
+            if granted:
+                exports.remove_client(export_point, host)
+            if action == self.ADD:
+                options = record[4].split(',') if record[4] else None
+                exports.add_client(export_point, host, options)
+
+        if records:
+            log.debug("Replayed %d records from '%s'", len(records),
+                      self.path)
+        return len(records)
+
+    def needs_compaction(self, max_size, max_age):
+        """
+        Check whether the journal is due for compaction.
+
+        :param max_size: size in bytes above which to compact
+        :type max_size: int
+        :param max_age: age in seconds of the oldest record above which to
+            compact
+        :type max_age: int
+        :rtype: boolean
+        """
+        try:
+            size = os.stat(self.path).st_size
+            with io.open(self.path, 'rt') as f:
+                first = f.readline()
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+
+        if size >= max_size:
+            return True
+
+        try:
+            oldest = int(first.split('\t')[1])
+        except (IndexError, ValueError):
+            return True
+
+        return time.time() - oldest >= max_age
+
+    def discard(self):
+        """
+        Remove the journal once its records are in the exports file.
+        """
+        try:
+            os.unlink(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
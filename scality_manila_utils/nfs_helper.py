@@ -18,6 +18,7 @@ Collection of functions for
  - Management of client permissions on export locations
 """
 
+import errno
 import functools
 import io
 import json
@@ -27,26 +28,39 @@ import os.path
 import signal
 
 from scality_manila_utils import utils
-from scality_manila_utils.export import ExportTable
+from scality_manila_utils.export import Export, ExportTable, validate
+from scality_manila_utils.fragments import ExportFragments
+from scality_manila_utils.journal import ExportJournal
 from scality_manila_utils.exceptions import (EnvironmentException,
                                              ExportException,
                                              ExportNotFoundException,
-                                             ExportHasGrantsException)
+                                             ExportHasGrantsException,
+                                             ExportReloadException)
 
 log = logging.getLogger(__name__)
 
+# A journal is compacted into the exports file once it reaches this size (in
+# bytes) or once its oldest record is this old (in seconds)
+JOURNAL_MAX_SIZE = 64 * 1024
+JOURNAL_MAX_AGE = 300
+
 
 def _get_defined_exports(exports_file):
     """
     Retrieve all defined exports from the nfs exports config file.
 
+    Changes recorded in the journal since the last compaction are replayed
+    on top of the exports file.
+
     :param exports_file: path to nfs exports file
     :type exports_file: string (unicode)
     :returns: py:class:`scality_manila_utils.exports.ExportTable`
         with the exports read from file
     """
-    with io.open(exports_file, 'rt') as exports_file:
-        exports = ExportTable.deserialize(exports_file)
+    with io.open(exports_file, 'rt') as f:
+        exports = ExportTable.deserialize(f)
+
+    ExportJournal.for_exports(exports_file).replay(exports)
     return exports
 
 
@@ -67,23 +81,413 @@ def _get_export_points(root_export):
             return os.listdir(root)
 
 
+def _backup_exports(exports_file):
+    """
+    Keep the current exports file around as a hard link.
+
+    :param exports_file: path to the nfs exports file
+    :type exports_file: string (unicode)
+    :returns: path to the backup, or `None` if there was nothing to back up
+    """
+    backup = exports_file + '.bak'
+    try:
+        os.unlink(backup)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+    try:
+        os.link(exports_file, backup)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+
+    return backup
+
+
+def _restore_exports(exports_file, backup):
+    """
+    Put back an exports file saved by :py:func:`_backup_exports`.
+
+    :param exports_file: path to the nfs exports file
+    :type exports_file: string (unicode)
+    :param backup: path to the backup, or `None` if there was no exports file
+    :type backup: string (unicode)
+    """
+    if backup is None:
+        os.unlink(exports_file)
+    else:
+        os.rename(backup, exports_file)
+    utils.fsync_path(os.path.dirname(exports_file))
+
+
+def _signal_pids(pids, sig):
+    """
+    Send a signal to each of the given processes.
+
+    :param pids: pids to signal
+    :type pids: iterable of int
+    :param sig: signal to send
+    :type sig: int
+    :returns: list of the pids that could not be signaled, not counting the
+        ones that exited in the meantime
+    """
+    failed = []
+    for pid in pids:
+        log.debug('Sending signal %d to pid %d', sig, pid)
+        try:
+            os.kill(pid, sig)
+        except OSError as e:
+            if e.errno == errno.ESRCH:
+                # It reads the exports file anew when it is restarted
+                log.warning('Pid %d exited before being signaled', pid)
+                continue
+            log.error('Unable to signal pid %d: %s', pid, e)
+            failed.append(pid)
+
+    return failed
+
+
+def _write_exports(exports_file, serialized_exports, files=()):
+    """
+    Write the exports file and reload sfused.
+
+    The previous exports file is kept as a hard link until every sfused has
+    been told to reload. If any of them can't be signaled, the previous file
+    is renamed back in place and the reload is requested again.
+
+    :param exports_file: path to the nfs exports file
+    :type exports_file: string (unicode)
+    :param serialized_exports: exports in /etc/exports format
+    :type serialized_exports: string (unicode)
+    :param files: other files to commit along with the exports file, which
+        is moved in place last, see :py:func:`utils.commit_files`
+    :type files: iterable
+    :raises: :py:class:`scality_manila_utils.exceptions.ExportReloadException`
+        if sfused could not be reloaded
+    """
+    sfused_pids = utils.find_pids('sfused')
+
+    with utils.elevated_privileges():
+        backup = _backup_exports(exports_file)
+        try:
+            utils.commit_files(list(files) +
+                               [(exports_file, serialized_exports)])
+        except Exception:
+            if backup is not None:
+                os.unlink(backup)
+            raise
+
+        failed = _signal_pids(sfused_pids, signal.SIGHUP)
+        if failed:
+            log.error("Restoring previous exports in '%s'", exports_file)
+            _restore_exports(exports_file, backup)
+            signaled = [pid for pid in sfused_pids if pid not in failed]
+            _signal_pids(signaled, signal.SIGHUP)
+            raise ExportReloadException("Unable to reload sfused "
+                                        "(pids {0!r})".format(failed))
+
+        if backup is not None:
+            os.unlink(backup)
+
+
 def _reexport(exports_file, exports):
     """
     Export all defined filesystems.
 
+    See :py:func:`_write_exports` for the handling of reload failures. Once
+    reloaded, the journal is discarded.
+
+    When fragments are enabled, the table is split into fragments, see
+    :py:meth:`scality_manila_utils.fragments.ExportFragments.split`, and the
+    exports file assembled from them, so that fragments changed since the
+    table was read from the exports file are kept. The changed fragments
+    are committed along with the exports file, and put back if sfused can't
+    be reloaded. Must be called with the exports lock.
+
     :param exports_file: path to the nfs exports file
     :type exports_file: string (unicode)
     :param exports: table of exports to re-export
     :type exports: :py:class:`scality_manila_utils.export.ExportTable`
     """
-    serialized_exports = exports.serialize()
-    sfused_pids = utils.find_pids('sfused')
+    fragments = ExportFragments.for_exports(exports_file)
+    if not fragments.enabled():
+        _write_exports(exports_file, exports.serialize())
+    else:
+        seen = None
+        if fragments.initialized():
+            # The exports file only changes under the exports lock, it
+            # still holds what the table was read from
+            with io.open(exports_file, 'rt') as f:
+                seen = ExportTable.deserialize(f)
+
+        with utils.elevated_privileges():
+            fragments.split(exports, seen, commit=functools.partial(
+                _write_exports, exports_file))
 
     with utils.elevated_privileges():
-        utils.safe_write(serialized_exports, exports_file)
-        for pid in sfused_pids:
-            log.debug('Killing sfused pid %d', pid)
-            os.kill(pid, signal.SIGHUP)
+        # The journal, if any, has been folded into the exports written
+        ExportJournal.for_exports(exports_file).discard()
+
+
+def _exports_lock(exports_file):
+    """
+    Lock serializing changes to an exports file and its journal.
+
+    :param exports_file: path to the nfs exports file
+    :type exports_file: string (unicode)
+    """
+    return utils.file_lock(exports_file + '.lock')
+
+
+def _journal_change(exports_file, exports, action, *args):
+    """
+    Record a client change in the journal instead of rewriting the exports.
+
+    The journal is compacted into the exports file, and sfused reloaded, once
+    it grows past `JOURNAL_MAX_SIZE` or `JOURNAL_MAX_AGE`.
+
+    :param exports_file: path to the nfs exports file
+    :type exports_file: string (unicode)
+    :param exports: the exports, including the change
+    :type exports: :py:class:`scality_manila_utils.export.ExportTable`
+    :param action: `add_client` or `remove_client`
+    :type action: string
+    """
+    journal = ExportJournal.for_exports(exports_file)
+    with utils.elevated_privileges():
+        getattr(journal, action)(*args)
+
+    if journal.needs_compaction(JOURNAL_MAX_SIZE, JOURNAL_MAX_AGE):
+        log.info("Compacting journal of '%s'", exports_file)
+        _reexport(exports_file, exports)
+
+
+def _compact_due_journal(exports_file):
+    """
+    Compact the journal if it is due, without waiting for the next change.
+
+    Reads replay the journal, so a journaled change is reported before it
+    reaches sfused. Compacting due journals on reads as well bounds how long
+    that lasts to `JOURNAL_MAX_AGE`, as long as the exports are read.
+
+    :param exports_file: path to the nfs exports file
+    :type exports_file: string (unicode)
+    """
+    journal = ExportJournal.for_exports(exports_file)
+    if not journal.needs_compaction(JOURNAL_MAX_SIZE, JOURNAL_MAX_AGE):
+        return
+
+    with _exports_lock(exports_file):
+        # It may have been compacted while waiting for the lock
+        if journal.needs_compaction(JOURNAL_MAX_SIZE, JOURNAL_MAX_AGE):
+            log.info("Compacting journal of '%s'", exports_file)
+            _reexport(exports_file, _get_defined_exports(exports_file))
+
+
+def _update_fragment(exports_file, export_point, if_match, action, *args):
+    """
+    Change the clients of a single export through its fragment.
+
+    Only the fragment of the export is rewritten, under its own lock, so
+    that changes to different exports don't wait for each other. The
+    exports file is then assembled from the fragments, committed along with
+    the assembly cache, and sfused reloaded under the exports lock. Full
+    rewrites of the exports keep fragments changed meanwhile, see
+    :py:func:`_reexport`.
+
+    :param exports_file: path to the nfs exports file
+    :type exports_file: string (unicode)
+    :param export_point: export to change
+    :type export_point: string (unicode)
+    :param if_match: expected fingerprint of the export, if any
+    :type if_match: string
+    :param action: `add_client` or `remove_client`
+    :type action: string
+    :returns: the fingerprint of the export after the change
+    """
+    fragments = ExportFragments.for_exports(exports_file)
+
+    if not fragments.initialized():
+        with _exports_lock(exports_file):
+            # It may have been split while waiting for the lock
+            if not fragments.initialized():
+                log.info("Splitting '%s' into fragments", exports_file)
+                _reexport(exports_file, _get_defined_exports(exports_file))
+
+    with fragments.lock(export_point):
+        previous = fragments.read(export_point)
+        exports = ExportTable([])
+        if previous is not None:
+            # The table updates clients in place, keep `previous` intact
+            exports.exports[export_point] = Export(export_point,
+                                                   dict(previous.clients))
+        utils.check_fingerprint(export_point,
+                                exports.export_fingerprint(export_point),
+                                if_match)
+        getattr(exports, action)(export_point, *args)
+        export = exports.exports.get(export_point)
+
+        with utils.elevated_privileges():
+            fragments.write(export_point, export)
+
+    try:
+        with _exports_lock(exports_file):
+            with utils.elevated_privileges():
+                fragments.assemble(commit=functools.partial(
+                    _write_exports, exports_file))
+    except Exception:
+        with fragments.lock(export_point):
+            # Unless it was changed again since
+            if fragments.read(export_point) == export:
+                with utils.elevated_privileges():
+                    fragments.write(export_point, previous)
+        raise
+
+    return exports.export_fingerprint(export_point)
+
+
+def _change_clients(exports_file, export_point, if_match, journal, action,
+                    *args):
+    """
+    Add or remove a client of an export.
+
+    :param exports_file: path to the nfs exports file
+    :type exports_file: string (unicode)
+    :param export_point: export to change
+    :type export_point: string (unicode)
+    :param if_match: expected fingerprint of the export, if any
+    :type if_match: string
+    :param journal: record the change in the journal, see
+        :py:func:`_journal_change`. Ignored when the exports are split into
+        fragments, see :py:func:`_update_fragment`.
+    :type journal: boolean
+    :param action: `add_client` or `remove_client`
+    :type action: string
+    :returns: the fingerprint of the export after the change
+    """
+    if ExportFragments.for_exports(exports_file).enabled():
+        return _update_fragment(exports_file, export_point, if_match, action,
+                                *args)
+
+    with _exports_lock(exports_file):
+        exports = _get_defined_exports(exports_file)
+        utils.check_fingerprint(export_point,
+                                exports.export_fingerprint(export_point),
+                                if_match)
+        getattr(exports, action)(export_point, *args)
+
+        if journal:
+            _journal_change(exports_file, exports, action, export_point,
+                            *args)
+        else:
+            _reexport(exports_file, exports)
+
+    return exports.export_fingerprint(export_point)
+
+
+class ExportsTransaction(object):
+    """
+    A group of client changes written and reloaded at once.
+
+    Usage::
+
+        transaction = ExportsTransaction(exports_file)
+        transaction.begin()
+        transaction.add_client('/share', '10.0.0.1', ['rw'])
+        transaction.remove_client('/other', '10.0.0.2')
+        transaction.commit()
+
+    It can also be used as a context manager, committing on a clean exit.
+    The exports lock is held from `begin` until `commit` or `abort`.
+    """
+    def __init__(self, exports_file):
+        """
+        :param exports_file: path to the nfs exports file
+        :type exports_file: string (unicode)
+        """
+        self.exports_file = exports_file
+        self.exports = None
+        self.operations = []
+        self._lock = None
+
+    def begin(self):
+        """
+        Read the current exports to start a transaction on.
+        """
+        self._lock = _exports_lock(self.exports_file)
+        self._lock.__enter__()
+        try:
+            self.exports = _get_defined_exports(self.exports_file)
+        except Exception:
+            self._release()
+            raise
+
+        self.operations = []
+        return self
+
+    def _release(self):
+        if self._lock is not None:
+            self._lock.__exit__(None, None, None)
+            self._lock = None
+
+    def _check_begun(self):
+        if self.exports is None:
+            raise ExportException('Transaction has not begun')
+
+    def add_client(self, export_point, host, options=None):
+        """
+        Export a filesystem to a client within the transaction.
+
+        See :py:meth:`scality_manila_utils.export.ExportTable.add_client`.
+        """
+        self._check_begun()
+        self.exports.add_client(export_point, host, options)
+        self.operations.append(('add', export_point, host))
+
+    def remove_client(self, export_point, host):
+        """
+        Remove access for a client to an export within the transaction.
+
+        See :py:meth:`scality_manila_utils.export.ExportTable.remove_client`.
+        """
+        self._check_begun()
+        self.exports.remove_client(export_point, host)
+        self.operations.append(('remove', export_point, host))
+
+    def commit(self):
+        """
+        Write and reload the exports if anything changed.
+
+        On failure the previous exports file is restored, see
+        :py:func:`_reexport`.
+        """
+        self._check_begun()
+        try:
+            if self.operations:
+                log.debug("Committing %d operations on '%s'",
+                          len(self.operations), self.exports_file)
+                _reexport(self.exports_file, self.exports)
+        finally:
+            self.abort()
+
+    def abort(self):
+        """
+        Drop every pending operation.
+        """
+        self.exports = None
+        self.operations = []
+        self._release()
+
+    def __enter__(self):
+        return self.begin()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
 
 
 def verify_environment(exports_file, *args, **kwargs):
@@ -108,13 +512,31 @@ def verify_environment(exports_file, *args, **kwargs):
         utils.process_check(binary)
 
 
+def _environment_dependencies(exports_file, *args, **kwargs):
+    """
+    State that the result of `verify_environment` depends on.
+
+    :param exports_file: path to the nfs exports file
+    :type exports_file: string (unicode)
+    :returns: list, see :py:func:`scality_manila_utils.utils.verify_once`
+    """
+    dependencies = [exports_file, os.path.exists(exports_file),
+                    os.getenv('PATH')]
+    dependencies.extend(utils.known_process(process)
+                        for process in ('rpcbind', 'sfused'))
+    return dependencies
+
+
 def ensure_environment(f):
     """
     Decorator function which verifies that expected services are running etc.
     """
     @functools.wraps(f)
     def wrapper(*args, **kwargs):
-        verify_environment(*args, **kwargs)
+        utils.verify_once(
+            'nfs', functools.partial(verify_environment, *args, **kwargs),
+            functools.partial(_environment_dependencies, *args, **kwargs)
+        )
         return f(*args, **kwargs)
 
     return wrapper
@@ -189,7 +611,8 @@ def wipe_export(root_export, exports_file, export_name):
 
 
 @ensure_environment
-def grant_access(root_export, exports_file, export_name, host, options):
+def grant_access(root_export, exports_file, export_name, host, options,
+                 journal=False, if_match=None):
     """
     Grant access for a host to an export.
 
@@ -204,20 +627,30 @@ def grant_access(root_export, exports_file, export_name, host, options):
     :type host: string (unicode)
     :param options: sequence of nfs options
     :type options: iterable of strings (unicode)
+    :param journal: record the grant in the journal rather than rewriting
+        the exports file, see :py:func:`_journal_change`. The grant is
+        reported by `get_export` right away, but is only effective once the
+        journal is compacted. Ignored when the exports are split into
+        fragments.
+    :type journal: boolean
+    :param if_match: only grant access if the export fingerprint is this one
+    :type if_match: string
+    :returns: the new fingerprint of the export when `if_match` is given
     """
     if export_name not in _get_export_points(root_export):
         raise ExportNotFoundException("No export point found for "
                                       "'{0:s}'".format(export_name))
 
     export_point = os.path.join('/', export_name)
-    exports = _get_defined_exports(exports_file)
-
-    exports.add_client(export_point, host, options)
-    _reexport(exports_file, exports)
+    fingerprint = _change_clients(exports_file, export_point, if_match,
+                                  journal, 'add_client', host, options)
+    if if_match is not None:
+        return fingerprint
 
 
 @ensure_environment
-def revoke_access(root_export, exports_file, export_name, host):
+def revoke_access(root_export, exports_file, export_name, host,
+                  journal=False, if_match=None):
     """
     Revoke access for a host to an export.
 
@@ -230,22 +663,64 @@ def revoke_access(root_export, exports_file, export_name, host):
     :type export_name: string (unicode)
     :param host: host to revoke access for
     :type host: string (unicode)
+    :param journal: record the revocation in the journal rather than
+        rewriting the exports file, see :py:func:`_journal_change`. The
+        revocation is reported by `get_export` right away, but is only
+        effective once the journal is compacted. Ignored when the exports
+        are split into fragments.
+    :type journal: boolean
+    :param if_match: only revoke access if the export fingerprint is this one
+    :type if_match: string
+    :returns: the new fingerprint of the export when `if_match` is given
     """
     if export_name not in _get_export_points(root_export):
         raise ExportNotFoundException("Export '{0:s}' not found".format(
                                       export_name))
 
     export_point = os.path.join('/', export_name)
-    exports = _get_defined_exports(exports_file)
-    exports.remove_client(export_point, host)
-    _reexport(exports_file, exports)
+    fingerprint = _change_clients(exports_file, export_point, if_match,
+                                  journal, 'remove_client', host)
+    if if_match is not None:
+        return fingerprint
 
 
 @ensure_environment
-def get_export(root_export, exports_file, export_name):
+def reload_exports(exports_file, *args, **kwargs):
+    """
+    Compact the journal into the exports file and reload sfused.
+
+    :param exports_file: path to the nfs exports file
+    :type exports_file: string (unicode)
+    """
+    with _exports_lock(exports_file):
+        exports = _get_defined_exports(exports_file)
+        _reexport(exports_file, exports)
+
+
+def validate_exports(exports_file, *args, **kwargs):
+    """
+    Check the consistency of the exports file.
+
+    See :py:func:`scality_manila_utils.export.validate`.
+
+    :param exports_file: path to the nfs exports file
+    :type exports_file: string (unicode)
+    :returns: string with the validation report in json format
+    """
+    with io.open(exports_file, 'rt') as f:
+        report = validate(f)
+
+    return json.dumps(report, sort_keys=True)
+
+
+@ensure_environment
+def get_export(root_export, exports_file, export_name, fingerprint=False):
     """
     Retrieve client details of an export.
 
+    A journal that is due for compaction is compacted first, see
+    :py:func:`_compact_due_journal`.
+
     :param root_export: nfs root export which holds the export points exposed
         through manila
     :type root_export: string (unicode)
@@ -253,8 +728,14 @@ def get_export(root_export, exports_file, export_name):
     :type exports_file: string (unicode)
     :param export_name: name of export
     :type export_name: string (unicode)
-    :returns: string with export client details in json format
+    :param fingerprint: also return the fingerprint of the export, to be
+        given to a conditional grant or revoke
+    :type fingerprint: boolean
+    :returns: string with export client details in json format, along with
+        the export fingerprint if requested
     """
+    _compact_due_journal(exports_file)
+
     export_point = os.path.join('/', export_name)
     exports = _get_defined_exports(exports_file)
     if export_point in exports:
@@ -270,4 +751,9 @@ def get_export(root_export, exports_file, export_name):
         raise ExportNotFoundException("Export '{0:s}' not found".format(
                                       export_name))
 
+    if fingerprint:
+        return json.dumps({
+            'clients': clients,
+            'fingerprint': exports.export_fingerprint(export_point),
+        })
     return json.dumps(clients)
@@ -18,42 +18,54 @@ Collection of functions for
  - Management of client permissions on export locations
 """
 
+import collections
+import contextlib
 import errno
 import functools
 import io
 import json
 import logging
 import os
-import subprocess
+import tempfile
 import time
 
 try:
-    import ConfigParser as configparser
+    import ipaddress
 except ImportError:
-    import configparser
+    # Python 2 without the ipaddress backport
+    ipaddress = None
 
+try:
+    from urllib import quote
+except ImportError:
+    from urllib.parse import quote
 
-from scality_manila_utils import utils
+from scality_manila_utils import smbconf, utils
 from scality_manila_utils.exceptions import (ClientExistsException,
                                              ClientNotFoundException,
+                                             DeserializationException,
                                              EnvironmentException,
                                              ExportException,
-                                             ExportAlreadyExists,
                                              ExportNotFoundException,
                                              ExportHasGrantsException)
 
 log = logging.getLogger(__name__)
 
+SMB_CONF = '/etc/samba/smb.conf'
+
+# Database of the Samba registry, changed by every write to the registry
+REGISTRY_TDB = '/var/lib/samba/registry.tdb'
+
+# Parsed shares of the registry, along with the identity of the database
+REGISTRY_CACHE_FILE = '/run/scality-manila-utils.smb-registry'
 
-# From http://prosseek.blogspot.fr/2012/10/
-# reading-ini-file-into-dictionary-in.html
-class SmbConfParser(configparser.ConfigParser):
-    def as_dict(self):
-        d = dict(self._sections)
-        for k in d:
-            d[k] = dict(self._defaults, **d[k])
-            d[k].pop('__name__', None)
-        return d
+# Grants of the shares whose `hosts allow` is collapsed, one file per share
+SMB_GRANTS_DIR = '/var/lib/scality-manila-utils/smb-grants'
+
+# Locks serializing changes to the hosts allowed on each share
+SMB_LOCK_DIR = '/run/scality-manila-utils.smb-locks'
+
+_hosts_allow = {'collapse': False}
 
 
 def _get_defined_exports():
@@ -63,13 +75,130 @@ def _get_defined_exports():
         cmd = ['net', 'conf', 'list']
         msg = ("Something went wrong while dumping the Samba "
                "registry: stdout='{stdout}', stderr='{stderr}'")
-        stdout, stderr = utils.execute(cmd, msg)
+        # Parse the registry as it is dumped
+        return smbconf.parse(utils.execute_lines(cmd, msg))
+
+
+def _registry_stamp():
+    """
+    Identity of the Samba registry database, which changes on every write.
+
+    :returns: [path, inode, mtime, size], or `None` if the database can not
+        be found, e.g. when the registry is clustered
+    """
+    try:
+        st = os.stat(REGISTRY_TDB)
+    except OSError:
+        return None
+    return [REGISTRY_TDB, st.st_ino, getattr(st, 'st_mtime_ns', st.st_mtime),
+            st.st_size]
+
+
+def _refresh_registry_snapshot(stamp):
+    """
+    Dump the whole registry into its snapshot.
+
+    :param stamp: identity of the registry database, taken before the dump
+        so that a concurrent write leaves a snapshot which is refreshed next
+        time, see :py:func:`_registry_stamp`
+    :type stamp: list
+    :returns: dict mapping share names to their parameters
+    """
+    log.debug("Samba registry changed, refreshing its snapshot")
+    shares = dict((name, dict(parameters))
+                  for name, parameters in _get_defined_exports().items())
+    utils.save_state(REGISTRY_CACHE_FILE, {'stamp': stamp, 'shares': shares})
+    return shares
+
+
+def _registry_changed():
+    """
+    Discard the snapshot of the registry after writing to it.
+
+    The registry database changes anyway, but possibly within the
+    resolution of its modification time. Must be called with root
+    privileges.
+    """
+    utils.discard_state(REGISTRY_CACHE_FILE)
+
+
+def _share_exists(export_name):
+    """
+    Check whether a share is defined in the Samba registry.
+
+    Must be called with root privileges.
+
+    :param export_name: name of the share
+    :type export_name: string (unicode)
+    :rtype: boolean
+    """
+    cmd = ['net', 'conf', 'listshares']
+    msg = ("Something went wrong while listing the Samba shares: "
+           "stdout='{stdout}', stderr='{stderr}'")
+    return any(line == export_name for line in utils.execute_lines(cmd, msg))
+
+
+def _get_defined_export(export_name):
+    """
+    Retrieve a single export from the Samba registry.
+
+    The export is read from a snapshot of the registry, kept in
+    :py:data:`REGISTRY_CACHE_FILE` along with the identity of the registry
+    database it was taken from. When the snapshot is stale or missing, e.g.
+    right after a write, the share alone is read with `net conf showshare`
+    and kept in a partial snapshot. The whole registry is only dumped when
+    a share is missing from a partial snapshot which is still current, so
+    that a write followed by a read never dumps it. Shares are always read
+    with `net conf showshare` if the registry database can not be found.
+
+    :param export_name: name of the share
+    :type export_name: string (unicode)
+    :returns: the parameters of the share, or `None` if it is not defined
+    """
+    stamp = _registry_stamp()
+    if stamp is None:
+        return _show_share(export_name)
+
+    snapshot = utils.load_state(REGISTRY_CACHE_FILE)
+    if snapshot.get('stamp') != stamp:
+        # The stamp is taken before the read, see _refresh_registry_snapshot
+        export = _show_share(export_name)
+        utils.save_state(REGISTRY_CACHE_FILE, {
+            'stamp': stamp,
+            'shares': {export_name: export},
+            'partial': True,
+        })
+        return export
+
+    shares = snapshot['shares']
+    if export_name not in shares and snapshot.get('partial'):
+        shares = _refresh_registry_snapshot(stamp)
+    return shares.get(export_name)
+
+
+def _show_share(export_name):
+    """
+    Read a single export from the Samba registry itself.
 
-    config = SmbConfParser()
-    output = stdout.replace('\t', '')
-    config.readfp(io.StringIO(output))
+    :param export_name: name of the share
+    :type export_name: string (unicode)
+    :returns: the parameters of the share, or `None` if it is not defined
+    """
+    cmd = ['net', 'conf', 'showshare', export_name]
+    with utils.elevated_privileges():
+        returncode, stdout, stderr = utils.run(cmd)
+        stdout, stderr = stdout.decode(), stderr.decode()
+        if returncode != 0:
+            # Most likely because there is no such share
+            if not _share_exists(export_name):
+                return None
+            raise EnvironmentError(
+                "Something went wrong while reading the share {0:s} from "
+                "the Samba registry: stdout='{1:s}', stderr='{2:s}'".format(
+                    export_name, stdout, stderr))
 
-    return config.as_dict()
+    shares = smbconf.parse(stdout.splitlines())
+    return shares.get(export_name, next(iter(shares.values()), None))
 
 
 def verify_environment(root_export):
@@ -95,7 +224,7 @@ def verify_environment(root_export):
     for process in ('sfused', 'smbd'):
         utils.process_check(process)
 
-    with io.open('/etc/samba/smb.conf') as f:
+    with io.open(SMB_CONF) as f:
         # We can't use `for line in f` here because it seems unmockable...
         for line in f.readlines():
             if line.strip() == 'registry shares = yes':
@@ -107,60 +236,283 @@ def verify_environment(root_export):
             raise EnvironmentException(msg)
 
 
+def _environment_dependencies(root_export):
+    """
+    State that the result of `verify_environment` depends on.
+
+    :param root_export: SOFS directory which holds the export points exposed
+        through manila
+    :type root_export: string (unicode)
+    :returns: list, see :py:func:`scality_manila_utils.utils.verify_once`
+    """
+    dependencies = [root_export, os.getenv('PATH')]
+    for path in (root_export, SMB_CONF):
+        try:
+            st = os.stat(path)
+            dependencies.append([st.st_dev, st.st_ino, st.st_mtime])
+        except OSError:
+            dependencies.append(None)
+    dependencies.extend(utils.known_process(process)
+                        for process in ('sfused', 'smbd'))
+    return dependencies
+
+
 def ensure_environment(f):
     """
     Decorator function which verifies that expected services are running etc.
     """
     @functools.wraps(f)
     def wrapper(root_export, *args, **kwargs):
-        verify_environment(root_export)
+        utils.verify_once(
+            'smb', functools.partial(verify_environment, root_export),
+            functools.partial(_environment_dependencies, root_export)
+        )
         return f(root_export=root_export, *args, **kwargs)
 
     return wrapper
 
 
+def _export_not_found(export_name):
+    msg = "Share '{0:s}' not found in Samba registry.".format(export_name)
+    return ExportNotFoundException(msg)
+
+
 def ensure_export_exists(f):
     """
     Decorator function which verifies that a given export exists and pass
-    the `dict` of all defined exports to the decorated function.
+    the `dict` of its parameters to the decorated function.
     """
     @functools.wraps(f)
     def wrapper(export_name, *args, **kwargs):
-        exports = _get_defined_exports()
-        if export_name not in exports:
-            msg = "Share '{0:s}' not found in Samba registry.".format(
-                  export_name)
-            raise ExportNotFoundException(msg)
+        export = _get_defined_export(export_name)
+        if export is None:
+            raise _export_not_found(export_name)
 
-        return f(export_name=export_name, exports=exports, *args, **kwargs)
+        return f(export_name=export_name, export=export, *args, **kwargs)
 
     return wrapper
 
 
+def set_collapse_hosts(collapse):
+    """
+    Choose whether `hosts allow` is written collapsed.
+
+    When collapsed, addresses and networks are merged into the fewest
+    networks covering them, which keeps the registry value short and the
+    matching done by Samba on every connection cheap. The hosts actually
+    granted are then kept in :py:data:`SMB_GRANTS_DIR`.
+
+    :param collapse: write `hosts allow` collapsed
+    :type collapse: boolean
+    """
+    _hosts_allow['collapse'] = collapse
+
+
+def collapse_hosts(hosts):
+    """
+    Collapse addresses and networks into the fewest networks covering them.
+
+    Other hosts, e.g. host names, are kept as they are in front of the
+    networks. Nothing is collapsed without the `ipaddress` module.
+
+    :param hosts: hosts allowed on a share
+    :type hosts: iterable of `str`
+    :returns: list of hosts covering the same clients
+    """
+    hosts = list(hosts)
+    if ipaddress is None:
+        return hosts
+
+    collapsed = []
+    networks = {4: [], 6: []}
+    for host in hosts:
+        try:
+            network = ipaddress.ip_network(u'{0:s}'.format(host),
+                                           strict=False)
+        except ValueError:
+            collapsed.append(host)
+            continue
+        networks[network.version].append(network)
+
+    for version in (4, 6):
+        for network in ipaddress.collapse_addresses(networks[version]):
+            if network.prefixlen == network.max_prefixlen:
+                collapsed.append(str(network.network_address))
+            else:
+                collapsed.append(network.with_prefixlen)
+
+    return collapsed
+
+
+def _grants_path(export_name):
+    return os.path.join(SMB_GRANTS_DIR, quote(export_name, safe=''))
+
+
+def _get_grants(export_name, export):
+    """
+    Get the hosts granted access to a share.
+
+    The grants of a share written collapsed are read from its grants file,
+    as long as the registry still holds the `hosts allow` written along
+    with them. Otherwise `hosts allow` is the list of grants.
+
+    :param export_name: name of the share
+    :type export_name: string (unicode)
+    :param export: parameters of the share in the Samba registry
+    :type export: dictionary
+    :returns: list of hosts
+    """
+    hosts_allow = export['hosts allow']
+    grants = utils.load_state(_grants_path(export_name))
+    if grants.get('hosts allow') == hosts_allow:
+        return list(grants['grants'])
+    return hosts_allow.split()
+
+
+def _fingerprint(hosts_allow):
+    """
+    Compute the fingerprint of the access list of a share.
+
+    :param hosts_allow: hosts allowed on a share
+    :type hosts_allow: iterable of `str`
+    :returns: hexadecimal digest
+    """
+    return utils.fingerprint(u' '.join(sorted(hosts_allow)))
+
+
 @ensure_environment
 @ensure_export_exists
-def get_export(export_name, exports, *args, **kwargs):
+def get_export(export_name, export, fingerprint=False, *args, **kwargs):
     """
     Retrieve client details of an export.
 
     :param export_name: name of export
     :type export_name: string (unicode)
-    :param exports: all the defined shares in the Samba registry
-    :type exports: dictionary
-    :returns: string with export client details in json format
+    :param export: parameters of the share in the Samba registry
+    :type export: dictionary
+    :param fingerprint: also return the fingerprint of the export, to be
+        given to a conditional grant or revoke
+    :type fingerprint: boolean
+    :returns: string with export client details in json format, along with
+        the export fingerprint if requested
     """
 
-    export = exports[export_name]
-    clients = dict((host, ["rw"]) for host in export['hosts allow'].split())
+    hosts_allow = _get_grants(export_name, export)
+    clients = dict((host, ["rw"]) for host in hosts_allow)
 
+    if fingerprint:
+        return json.dumps({
+            'clients': clients,
+            'fingerprint': _fingerprint(hosts_allow),
+        })
     return json.dumps(clients)
 
 
+def _import_share(export_name, parameters):
+    """
+    Define a share in the Samba registry, in a single transaction.
+
+    An existing definition of the share is replaced. Must be called with
+    root privileges.
+
+    :param export_name: name of the share
+    :type export_name: string (unicode)
+    :param parameters: parameters of the share
+    :type parameters: iterable of (string, string)
+    """
+    definition = u'[{0:s}]\n'.format(export_name) + u''.join(
+        u'\t{0:s} = {1:s}\n'.format(param, value)
+        for param, value in parameters
+    )
+
+    with tempfile.NamedTemporaryFile(mode='wt', suffix='.conf') as f:
+        f.write(definition)
+        f.flush()
+        try:
+            utils.check_call(['net', 'conf', 'import', f.name, export_name])
+        finally:
+            _registry_changed()
+
+
+# Share parameters Samba stores under another name, with the opposite value
+_INVERTED_SYNONYMS = {
+    'writeable': 'read only',
+    'writable': 'read only',
+    'write ok': 'read only',
+}
+
+_BOOLEANS = {'yes': 'yes', 'true': 'yes', 'no': 'no', 'false': 'no'}
+
+
+def _canonical_parameter(param, value):
+    """
+    Get the name and value a share parameter is stored as by Samba.
+
+    :param param: name of the parameter
+    :type param: string (unicode)
+    :param value: value of the parameter
+    :type value: string (unicode)
+    :returns: (name, value) tuple
+    """
+    param = param.lower()
+    value = _BOOLEANS.get(value.lower(), value)
+    if param in _INVERTED_SYNONYMS:
+        param = _INVERTED_SYNONYMS[param]
+        value = {'yes': 'no', 'no': 'yes'}.get(value, value)
+    return param, value
+
+
+def _repair_share(export_name, current, parameters):
+    """
+    Bring the parameters of a defined share back to the expected ones.
+
+    Parameters are compared as Samba stores them, see
+    :py:func:`_canonical_parameter`, and only the ones that differ are
+    written. `hosts allow` is only written if it is missing, so that the
+    grants of the share are kept.
+    Must be called with root privileges.
+
+    :param export_name: name of the share
+    :type export_name: string (unicode)
+    :param current: parameters of the share in the Samba registry
+    :type current: dictionary
+    :param parameters: expected parameters of the share
+    :type parameters: iterable of (string, string)
+    """
+    defined = dict(_canonical_parameter(param, value)
+                   for param, value in current.items())
+    changes = collections.OrderedDict()
+    for param, value in parameters:
+        param, value = _canonical_parameter(param, value)
+        if (defined.get(param) != value and
+                (param != 'hosts allow' or param not in defined)):
+            changes[param] = value
+    changes = list(changes.items())
+    if not changes:
+        log.debug("Share '%s' is already defined as expected", export_name)
+        return
+
+    log.info("Repairing %s of share '%s'",
+             ', '.join(param for param, _ in changes), export_name)
+    try:
+        for param, value in changes:
+            cmd = ['net', 'conf', 'setparm', export_name, param, value]
+            msg = ("Something went wrong while setting '{0:s}' for share "
+                   "'{1:s}': stdout={{stdout}}, stderr={{stderr}}").format(
+                       param, export_name)
+            utils.execute(cmd, msg)
+    finally:
+        _registry_changed()
+
+
 @ensure_environment
 def add_export(root_export, export_name, *args, **kwargs):
     """
     Add an export.
 
+    Adding an export that is already defined brings its parameters back to
+    the expected ones, see :py:func:`_repair_share`.
+
     :param root_export: SOFS directory which holds the export points exposed
         through manila
     :type root_export: string (unicode)
@@ -168,25 +520,22 @@ def add_export(root_export, export_name, *args, **kwargs):
     :type export_name: string (unicode)
     """
 
-    if not export_name or '/' in export_name:
+    # The name is also a section header in the share definition
+    if not export_name or any(c in export_name for c in '/[]\n'):
         raise ExportException('Invalid export name')
 
     export_point = os.path.join(root_export, export_name)
 
-    create_cmd = [
-        'net', 'conf', 'addshare', export_name, export_point,
-        'writeable=y', 'guest_ok=y',
+    parameters = [
+        ('path', export_point),
+        ('writeable', 'yes'),
+        ('guest ok', 'yes'),
+        ('browseable', 'yes'),
+        ('create mask', '0755'),
+        ('hosts deny', '0.0.0.0/0'),  # deny all by default
+        ('hosts allow', '127.0.0.1'),
+        ('read only', 'no'),
     ]
-    parameters = {
-        'browseable': 'yes',
-        'create mask': '0755',
-        'hosts deny': '0.0.0.0/0',  # deny all by default
-        'hosts allow': '127.0.0.1',
-        'read only': 'no',
-    }
-
-    set_of_commands = [['net', 'conf', 'setparm', export_name,
-                        param, value] for param, value in parameters.items()]
 
     with utils.elevated_privileges():
         try:
@@ -200,56 +549,64 @@ def add_export(root_export, export_name, *args, **kwargs):
             else:
                 log.debug("The share/directory %s already exists on SOFS",
                           export_name)
-                exports = _get_defined_exports()
-                if export_name in exports:
-                    msg = ("Share '{0:s}' already defined in Samba "
-                           "registry.".format(export_name))
-                    raise ExportAlreadyExists(msg)
 
-        subprocess.check_call(create_cmd)
-        for cmd in set_of_commands:
-            subprocess.check_call(cmd)
+        with _share_lock(export_name):
+            # The share may have been defined by a previous attempt, even
+            # if its directory was removed since
+            current = _show_share(export_name)
+            if current is None:
+                _import_share(export_name, parameters)
+            else:
+                _repair_share(export_name, current, parameters)
 
 
 @ensure_environment
-@ensure_export_exists
-def wipe_export(root_export, export_name, exports):
+def wipe_export(root_export, export_name, *args, **kwargs):
     """
     Remove an export.
 
     The export point is not actually removed, but renamed with the prefix
-    "TRASH-".
+    "TRASH-". The share is read from the registry under its lock, so that
+    a host granted access concurrently is not missed.
 
     :param root_export: SOFS directory which holds the export points exposed
         through manila
     :type root_export: string (unicode)
     :param export_name: name of export to remove
     :type export_name: string (unicode)
-    :param exports: all the defined shares in the Samba registry
-    :type exports: dictionary
     """
 
-    export = exports[export_name]
     export_path = os.path.join(root_export, export_name)
 
-    # Wipe export if and only if no "external host" has access to it
-    if export['hosts allow'] not in ['', '127.0.0.1']:
-        raise ExportHasGrantsException('Unable to remove export with grants')
-
     # We need to introduce a "variable" part (i.e a date)
     # in case an export with the same name is deleted twice
     tombstone = u'TRASH-{0:s}-{1:s}'.format(export_name,
                                             time.strftime("%Y-%b-%d-%X-%Z"))
     tombstone_path = os.path.join(root_export, tombstone)
 
-    with utils.elevated_privileges():
-        log.info("Deleting the export '%s' from the Samba registry",
-                 export_name)
-        cmd = ['net', 'conf', 'delshare', export_name]
-        msg = ("Something went wrong while deleting the export {0:s}: "
-               "stdout={{stdout}}, stderr={{stderr}}").format(export_name)
-        utils.execute(cmd, msg)
+    with _share_lock(export_name):
+        export = _show_share(export_name)
+        if export is None:
+            raise _export_not_found(export_name)
+
+        # Wipe export if and only if no "external host" has access to it
+        if export['hosts allow'] not in ['', '127.0.0.1']:
+            raise ExportHasGrantsException('Unable to remove export with '
+                                           'grants')
+
+        with utils.elevated_privileges():
+            log.info("Deleting the export '%s' from the Samba registry",
+                     export_name)
+            cmd = ['net', 'conf', 'delshare', export_name]
+            msg = ("Something went wrong while deleting the export {0:s}: "
+                   "stdout={{stdout}}, stderr={{stderr}}").format(export_name)
+            try:
+                utils.execute(cmd, msg)
+            finally:
+                _registry_changed()
+            utils.discard_state(_grants_path(export_name))
 
+    with utils.elevated_privileges():
         log.info("Renaming export '%s' to '%s'", export_name, tombstone)
         try:
             os.rename(export_path, tombstone_path)
@@ -266,6 +623,43 @@ def wipe_export(root_export, export_name, exports):
         utils.fsync_path(root_export)
 
 
+def _prepare_hosts_allow(export_name, hosts_allow):
+    """
+    Get the command setting the `hosts allow` parameter of a share.
+
+    See :py:func:`set_collapse_hosts` for how it is written. The grants are
+    written first, they are ignored until the registry holds the value
+    written along with them. Must be called with root privileges.
+
+    :param export_name: name of the share
+    :type export_name: string (unicode)
+    :param hosts_allow: hosts allowed on this share
+    :type hosts_allow: iterable of `str`
+    :returns: the command, and the error message for :py:func:`utils.execute`
+    """
+    hosts_allow = list(hosts_allow)
+    collapse = _hosts_allow['collapse']
+    value = ' '.join(collapse_hosts(hosts_allow) if collapse else
+                     hosts_allow)
+    cmd = ['net', 'conf', 'setparm', export_name, 'hosts allow', value]
+    msg = ("Something went wrong while setting '{0!r}' as "
+           "the list of 'hosts allow' for share '{1:s}': stdout={{stdout}}, "
+           "stderr={{stderr}}").format(hosts_allow, export_name)
+
+    if collapse:
+        try:
+            os.makedirs(SMB_GRANTS_DIR)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+        grants = {'grants': hosts_allow, 'hosts allow': value}
+        utils.safe_write(json.dumps(grants), _grants_path(export_name))
+    else:
+        utils.discard_state(_grants_path(export_name))
+
+    return cmd, msg
+
+
 def _set_hosts_allow(export_name, hosts_allow):
     """
     Set the `hosts_allow` parameter for a given share.
@@ -275,20 +669,147 @@ def _set_hosts_allow(export_name, hosts_allow):
     :param hosts_allow: hosts allowed on this share
     :type hosts_allow: iterable of `str`
     """
+    with utils.elevated_privileges():
+        cmd, msg = _prepare_hosts_allow(export_name, hosts_allow)
+        try:
+            utils.execute(cmd, msg)
+        finally:
+            _registry_changed()
 
-    cmd = ['net', 'conf', 'setparm', export_name,
-           'hosts allow', ' '.join(hosts_allow)]
-    msg = ("Something went wrong while setting '{0!r}' as "
-           "the list of 'hosts allow' for share '{1:s}': stdout={{stdout}}, "
-           "stderr={{stderr}}").format(hosts_allow, export_name)
 
+def _set_hosts_allow_many(changes):
+    """
+    Set the `hosts allow` parameter of several shares at once.
+
+    The `net` commands are run concurrently, see :py:func:`utils.run_many`.
+    A share that can't be written does not stop the others.
+
+    :param changes: (share name, hosts allowed) pairs
+    :type changes: iterable of (string, iterable of `str`)
+    :returns: dict mapping the names of the shares that could not be
+        written to the exception raised
+    """
+    errors = {}
+    commands = []
+    with utils.elevated_privileges():
+        for export_name, hosts_allow in changes:
+            try:
+                cmd, msg = _prepare_hosts_allow(export_name, hosts_allow)
+            except EnvironmentError as e:
+                errors[export_name] = e
+            else:
+                commands.append((export_name, cmd, msg))
+
+        try:
+            results = utils.run_many([cmd for _, cmd, _ in commands])
+        finally:
+            _registry_changed()
+
+    for (export_name, _, msg), result in zip(commands, results):
+        if result.error is not None:
+            errors[export_name] = result.error
+        elif result.returncode != 0:
+            errors[export_name] = EnvironmentError(msg.format(
+                stdout=result.stdout.decode(), stderr=result.stderr.decode()))
+    return errors
+
+
+def _share_lock(export_name):
+    """
+    Lock serializing changes to the hosts allowed on a share.
+
+    :param export_name: name of the share
+    :type export_name: string (unicode)
+    """
     with utils.elevated_privileges():
-        utils.execute(cmd, msg)
+        try:
+            os.mkdir(SMB_LOCK_DIR, 0o700)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+    name = '{0:s}.lock'.format(quote(export_name, safe=''))
+    return utils.file_lock(os.path.join(SMB_LOCK_DIR, name))
+
+
+@contextlib.contextmanager
+def _share_locks(export_names):
+    """
+    Hold the locks of several shares, see :py:func:`_share_lock`.
+
+    They are always taken in the same order, so that two holders can't
+    deadlock.
+
+    :param export_names: names of the shares
+    :type export_names: iterable of string (unicode)
+    """
+    held = []
+    try:
+        for export_name in sorted(set(export_names)):
+            lock = _share_lock(export_name)
+            lock.__enter__()
+            held.append(lock)
+        yield
+    finally:
+        for lock in reversed(held):
+            lock.__exit__(None, None, None)
+
+
+def _read_hosts_allow(export_name):
+    """
+    Read the hosts allowed on a share from the registry itself.
+
+    :param export_name: name of the share
+    :type export_name: string (unicode)
+    :returns: list of hosts, see :py:func:`_get_grants`
+    """
+    export = _show_share(export_name)
+    if export is None:
+        raise _export_not_found(export_name)
+
+    return _get_grants(export_name, export)
+
+
+def _change_hosts_allow(export_name, change):
+    """
+    Change the hosts allowed on a share, without losing concurrent changes.
+
+    The share is read again from the registry under its lock, and written
+    before the lock is released.
+
+    :param export_name: name of the share
+    :type export_name: string (unicode)
+    :param change: changes the list of hosts it is given in place
+    :type change: callable
+    :returns: the return value of `change`
+    """
+    with _share_lock(export_name):
+        hosts_allow = _read_hosts_allow(export_name)
+        current = list(hosts_allow)
+        result = change(hosts_allow)
+        if hosts_allow != current:
+            _set_hosts_allow(export_name, hosts_allow)
+
+    return result
+
+
+def _add_host(export_name, hosts_allow, host):
+    if host in hosts_allow:
+        msg = "Host '{0:s}' already allowed on share '{1:s}'".format(
+            host, export_name)
+        raise ClientExistsException(msg)
+    hosts_allow.append(host)
+
+
+def _remove_host(export_name, hosts_allow, host):
+    if host not in hosts_allow:
+        raise ClientNotFoundException("'{0:s}' has no access defined on share "
+                                      "'{1:s}'".format(host, export_name))
+    hosts_allow.remove(host)
 
 
 @ensure_environment
-@ensure_export_exists
-def grant_access(export_name, host, exports, *args, **kwargs):
+def grant_access(export_name, host, if_match=None, *args, **kwargs):
     """
     Grant access for a host to an export.
 
@@ -296,24 +817,25 @@ def grant_access(export_name, host, exports, *args, **kwargs):
     :type export_name: string (unicode)
     :param host: host to grant access for
     :type host: string (unicode)
-    :param exports: all the defined shares in the Samba registry
-    :type exports: dictionary
+    :param if_match: only grant access if the export fingerprint is this one
+    :type if_match: string
+    :returns: the new fingerprint of the export when `if_match` is given
     """
 
-    hosts_allow = exports[export_name]['hosts allow'].split()
+    def grant(hosts_allow):
+        utils.check_fingerprint(export_name, _fingerprint(hosts_allow),
+                                if_match)
+        _add_host(export_name, hosts_allow, host)
+        return _fingerprint(hosts_allow)
 
-    if host in hosts_allow:
-        msg = "Host '{0:s}' already allowed on share '{1:s}'".format(
-            host, export_name)
-        raise ClientExistsException(msg)
+    fingerprint = _change_hosts_allow(export_name, grant)
 
-    hosts_allow.append(host)
-    _set_hosts_allow(export_name, hosts_allow)
+    if if_match is not None:
+        return fingerprint
 
 
 @ensure_environment
-@ensure_export_exists
-def revoke_access(export_name, host, exports, *args, **kwargs):
+def revoke_access(export_name, host, if_match=None, *args, **kwargs):
     """
     Revoke access for a host to an export.
 
@@ -321,15 +843,130 @@ def revoke_access(export_name, host, exports, *args, **kwargs):
     :type export_name: string (unicode)
     :param host: host to revoke access for
     :type host: string (unicode)
-    :param exports: all the defined shares in the Samba registry
-    :type exports: dictionary
+    :param if_match: only revoke access if the export fingerprint is this one
+    :type if_match: string
+    :returns: the new fingerprint of the export when `if_match` is given
     """
 
-    hosts_allow = exports[export_name]['hosts allow'].split()
+    def revoke(hosts_allow):
+        utils.check_fingerprint(export_name, _fingerprint(hosts_allow),
+                                if_match)
+        _remove_host(export_name, hosts_allow, host)
+        return _fingerprint(hosts_allow)
 
-    if host not in hosts_allow:
-        raise ClientNotFoundException("'{0:s}' has no access defined on share "
-                                      "'{1:s}'".format(host, export_name))
+    fingerprint = _change_hosts_allow(export_name, revoke)
 
-    hosts_allow.remove(host)
-    _set_hosts_allow(export_name, hosts_allow)
+    if if_match is not None:
+        return fingerprint
+
+
+BATCH_ACTIONS = ('grant', 'revoke')
+
+try:
+    _STRING_TYPES = (str, unicode)
+except NameError:
+    # Python 3
+    _STRING_TYPES = (str,)
+
+
+def _validate_batch(requests):
+    """
+    Check that every request of a batch is well formed.
+
+    :param requests: (share, host, action) requests
+    :type requests: list
+    :raises: :py:class:`scality_manila_utils.exceptions.ExportException` on
+        the first invalid request
+    """
+    if not isinstance(requests, list):
+        raise ExportException('A batch must be a list of requests')
+
+    for index, request in enumerate(requests):
+        valid = (isinstance(request, (list, tuple)) and len(request) == 3 and
+                 all(isinstance(field, _STRING_TYPES) for field in request))
+        if valid:
+            export_name, host, action = request
+            # Hosts are separated by spaces or commas in `hosts allow`
+            valid = (export_name and host and action in BATCH_ACTIONS and
+                     not any(c.isspace() or c == ',' for c in host))
+        if not valid:
+            raise ExportException("Invalid request #{0:d} in batch: "
+                                  "{1!r}".format(index, request))
+
+
+@ensure_environment
+def batch_access(root_export, requests, *args, **kwargs):
+    """
+    Grant and revoke access to many exports at once.
+
+    The whole batch is validated before anything is changed. Each share is
+    then read once, and its requests are applied in order. The shares whose
+    hosts changed are written concurrently, see
+    :py:func:`_set_hosts_allow_many`. The shares stay locked throughout.
+    A request that can not be applied, e.g. a revocation for a host that is
+    not allowed, fails on its own without failing the batch. So do the
+    requests of a share that can't be read or written, e.g. because `net`
+    timed out.
+
+    :param root_export: SOFS directory which holds the export points exposed
+        through manila
+    :type root_export: string (unicode)
+    :param requests: (share, host, action) requests, where the action is
+        either `grant` or `revoke`
+    :type requests: list
+    :returns: string with the result of each request in json format, in the
+        order of the requests
+    """
+    _validate_batch(requests)
+
+    results = [{'export_name': export_name, 'host': host, 'action': action}
+               for export_name, host, action in requests]
+    shares = collections.OrderedDict()
+    for result in results:
+        shares.setdefault(result['export_name'], []).append(result)
+
+    def fail(share_results, e):
+        exit_code = getattr(e, 'EXIT_CODE', 1)
+        for result in share_results:
+            if 'error' not in result:
+                result.update(error=str(e), exit_code=exit_code)
+
+    actions = {'grant': _add_host, 'revoke': _remove_host}
+    changes = []
+    applied = {}
+    with _share_locks(shares):
+        for export_name, share_results in shares.items():
+            try:
+                hosts_allow = _read_hosts_allow(export_name)
+            except (ExportException, EnvironmentException, EnvironmentError,
+                    DeserializationException) as e:
+                log.error("Unable to read share '%s': %s", export_name, e)
+                fail(share_results, e)
+                continue
+
+            current = list(hosts_allow)
+            applied[export_name] = []
+            for result in share_results:
+                try:
+                    actions[result['action']](export_name, hosts_allow,
+                                              result['host'])
+                except ExportException as e:
+                    result.update(error=str(e),
+                                  exit_code=getattr(e, 'EXIT_CODE', 1))
+                else:
+                    applied[export_name].append(result)
+            if hosts_allow != current:
+                changes.append((export_name, hosts_allow))
+
+        errors = _set_hosts_allow_many(changes) if changes else {}
+
+    for export_name, share_results in applied.items():
+        if export_name in errors:
+            e = errors[export_name]
+            log.error("Unable to update share '%s': %s", export_name, e)
+            fail(share_results, e)
+        else:
+            for result in share_results:
+                result['result'] = 'ok'
+
+    return json.dumps(results)
@@ -0,0 +1,82 @@
+# Copyright (c) 2015 Scality
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Parser for the Samba registry as dumped by `net conf list` and
+`net conf showshare`.
+"""
+
+try:
+    from collections import ChainMap
+except ImportError:
+    # Python 2
+    ChainMap = None
+
+from scality_manila_utils.exceptions import DeserializationException
+
+DEFAULT_SECTION = 'DEFAULT'
+COMMENT_PREFIXES = ('#', ';')
+
+
+def parse(lines):
+    """
+    Parse the output of `net conf` in a single pass.
+
+    Parameter names are lowercased and values are stripped, as with
+    :py:class:`ConfigParser.ConfigParser`. Parameters of the `DEFAULT`
+    section apply to every share, and are merged as a view over the share
+    parameters rather than copied into each of them.
+
+    :param lines: lines of output, e.g. as streamed by
+        :py:func:`scality_manila_utils.utils.execute_lines`
+    :type lines: iterable of `unicode`
+    :returns: dict mapping share names to their parameters
+    :raises: :py:class:`DeserializationException` on a parameter line
+        outside of any section, or without a value
+    """
+    defaults = {}
+    shares = {}
+    section = None
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith(COMMENT_PREFIXES):
+            continue
+
+        if line[0] == '[' and line[-1] == ']':
+            name = line[1:-1]
+            if name == DEFAULT_SECTION:
+                section = defaults
+            elif name in shares:
+                section = shares[name]
+            else:
+                section = shares[name] = {}
+            continue
+
+        key, separator, value = line.partition('=')
+        if not separator or section is None:
+            msg = "Invalid line in the Samba registry: '{0:s}'".format(line)
+            raise DeserializationException(msg)
+
+        section[key.strip().lower()] = value.strip()
+
+    if not defaults:
+        return shares
+    return dict((name, _merge(parameters, defaults))
+                for name, parameters in shares.items())
+
+
+def _merge(parameters, defaults):
+    if ChainMap is None:
+        return dict(defaults, **parameters)
+    return ChainMap(parameters, defaults)
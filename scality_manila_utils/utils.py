@@ -13,19 +13,89 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import contextlib
 import errno
+import fcntl
+import hashlib
 import io
+import json
 import logging
 import os
 import os.path
+import re
+import select
+import signal
+import stat
 import subprocess
 import tempfile
+import time
 
-from scality_manila_utils.exceptions import EnvironmentException
+from scality_manila_utils.exceptions import (CommandTimeoutException,
+                                             EnvironmentException,
+                                             FingerprintMismatchException)
 
 log = logging.getLogger(__name__)
 
+# Where procfs is mounted
+PROC_ROOT = '/proc'
+
+# Maximum length of the process names found in `/proc/<pid>/comm`
+TASK_COMM_LEN = 15
+
+# Pids found by `scan_processes`, by process name
+_process_cache = {}
+
+# Where the daemons checked by `process_check` may write their pid
+PIDFILES = {
+    'rpcbind': ('/run/rpcbind.pid', '/var/run/rpcbind.pid'),
+    'sfused': ('/run/sfused.pid', '/var/run/sfused.pid'),
+    'smbd': ('/run/samba/smbd.pid', '/var/run/samba/smbd.pid',
+             '/var/run/smbd.pid'),
+}
+
+# Pid and start time of the processes found by the previous checks
+PID_CACHE_FILE = '/run/scality-manila-utils.pids'
+
+# Absolute paths of the binaries found by `which`
+BINARY_CACHE_FILE = '/run/scality-manila-utils.binaries'
+
+_binary_cache = {}
+
+# Last successful environment verifications, see `verify_once`
+ENV_CACHE_FILE = '/run/scality-manila-utils.env'
+
+_env_checks = {'ttl': 0, 'force': False}
+
+# Time in seconds a command may run for, unless told otherwise
+COMMAND_TIMEOUT = 60
+
+# Output in bytes a command may write on stdout or on stderr
+COMMAND_MAX_OUTPUT = 64 * 1024 * 1024
+
+# Deadline of all the commands run, see `set_deadline`
+_deadline = {'at': None}
+
+_monotonic = getattr(time, 'monotonic', time.time)
+
+# Start commands with `posix_spawnp`, see `spawn`
+USE_POSIX_SPAWN = hasattr(os, 'posix_spawnp')
+
+# How hard writes try to survive a crash, see `set_durability`
+DURABILITY_LEVELS = ('strict', 'batch', 'relaxed')
+
+_durability = {'level': 'strict'}
+
+# Mount table of the current process
+MOUNTINFO = '/proc/self/mountinfo'
+
+# Mount sources found by `_mount_source` by device, for a given mountinfo
+MOUNT_CACHE_FILE = '/run/scality-manila-utils.mounts'
+
+_mount_cache = {}
+
+_MOUNT_PATH_ESCAPE = re.compile(r'\\([0-7]{3})')
+
 
 @contextlib.contextmanager
 def elevated_privileges():
@@ -55,6 +125,78 @@ def elevated_privileges():
             os.seteuid(previous_uid)
 
 
+@contextlib.contextmanager
+def file_lock(path):
+    """
+    Hold an exclusive lock on a file while in context.
+
+    The lock file is created with root privileges if it does not exist.
+
+    :param path: path to the lock file
+    :type path: string (unicode)
+    """
+    with elevated_privileges():
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+    try:
+        log.debug("Locking '%s'", path)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+
+    finally:
+        os.close(fd)
+
+
+def scan_processes(*processes):
+    """
+    Find the pids of several processes in a single pass over procfs.
+
+    Results are cached for the duration of the command, so that looking up
+    the same process again does not walk procfs again.
+
+    :param processes: process names
+    :type processes: strings
+    :returns: dictionary of process name to list of pids
+    """
+    missing = set(processes).difference(_process_cache)
+    if missing:
+        # Process names are truncated in `comm`
+        names = dict((process[:TASK_COMM_LEN], process)
+                     for process in missing)
+        found = dict((process, []) for process in missing)
+        for pid in os.listdir(PROC_ROOT):
+            if not pid.isdigit():
+                continue
+
+            comm_path = os.path.join(PROC_ROOT, pid, 'comm')
+            try:
+                with io.open(comm_path, 'rt') as f:
+                    process_name = f.read().rstrip('\n')
+            except IOError as e:
+                # Pass on processes that no longer exist
+                if e.errno not in (errno.ENOENT, errno.ESRCH):
+                    raise
+                continue
+
+            if process_name in names:
+                found[names[process_name]].append(int(pid))
+
+        for process, process_pids in found.items():
+            process_pids.sort()
+            log.debug("PIDs for '%s': %r", process, process_pids)
+        _process_cache.update(found)
+
+    return dict((process, list(_process_cache[process]))
+                for process in processes)
+
+
+def clear_process_cache():
+    """
+    Forget the pids found by :py:func:`scan_processes`.
+    """
+    _process_cache.clear()
+
+
 def find_pids(process):
     """
     Find pids by inspection of procfs.
@@ -63,23 +205,69 @@ def find_pids(process):
     :type process: string
     :returns: list of pids
     """
-    process_pids = []
-    pids = [f for f in os.listdir('/proc') if f.isdigit()]
-    for pid in pids:
-        status_path = os.path.join('/proc', pid, 'status')
-        try:
-            with io.open(status_path, 'rt') as f:
-                line = f.readline()
-                _, process_name = line.split()
-                if process_name == process:
-                    process_pids.append(int(pid))
-        except IOError as e:
-            # Pass on processes that no longer exist
-            if e.errno != errno.ENOENT:
-                raise
+    return scan_processes(process)[process]
+
 
-    log.debug("PIDs for '%s': %r", process, process_pids)
-    return process_pids
+def _is_executable(path):
+    try:
+        st = os.stat(path)
+    except OSError as e:
+        if e.errno not in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+            raise
+        return False
+    return stat.S_ISREG(st.st_mode) and bool(st.st_mode & 0o111)
+
+
+def which(binary, paths=None):
+    """
+    Find the absolute path of an executable.
+
+    The path found is saved, and only checked to still be executable by
+    the next lookups with the same search paths.
+
+    :param binary: name of binary
+    :type binary: string
+    :param paths: paths to search, defaults to the `PATH` environment
+        variable
+    :type paths: list of strings
+    :returns: absolute path of the binary, or `None` if it couldn't be found
+    """
+    if paths is None:
+        paths = os.getenv('PATH', os.defpath).split(os.pathsep)
+    paths = list(paths)
+
+    if not _binary_cache:
+        _binary_cache.update(load_state(BINARY_CACHE_FILE))
+    cached = _binary_cache.get(binary)
+    if cached is not None and cached[1] == paths:
+        if _is_executable(cached[0]):
+            return cached[0]
+
+    for path in paths:
+        candidate = os.path.abspath(os.path.join(path, binary))
+        if _is_executable(candidate):
+            _binary_cache[binary] = [candidate, paths]
+            save_state(BINARY_CACHE_FILE, _binary_cache)
+            return candidate
+
+    return None
+
+
+def resolve_command(cmd):
+    """
+    Replace the program of a command by its absolute path.
+
+    The command is left as is if the program couldn't be found, for the
+    error to be reported when running it.
+
+    :param cmd: the command with arguments
+    :type cmd: iterable of `str`
+    :rtype: list of `str`
+    """
+    cmd = list(cmd)
+    if cmd and not os.path.isabs(cmd[0]):
+        cmd[0] = which(cmd[0]) or cmd[0]
+    return cmd
 
 
 def binary_check(binary, paths):
@@ -93,15 +281,162 @@ def binary_check(binary, paths):
     :raises: :py:class:`scality_manila_utils.exceptions.EnvironmentException`
         if the binary couldn't be found
     """
-    for path in paths:
-        if os.path.exists(os.path.join(path, binary)):
-            return
+    if binary and which(binary, paths) is not None:
+        return
 
     log.error("No '%s' found in PATH (%s)", binary, ', '.join(paths))
     raise EnvironmentException("Unable to find '{0:s}', make sure it "
                                "is installed".format(binary))
 
 
+def process_identity(pid):
+    """
+    Identify a process by its name and start time.
+
+    Unlike the pid, the pair is not reused by another process.
+
+    :param pid: pid of the process
+    :type pid: int
+    :returns: (name, start time in clock ticks since boot), or `None` if
+        there is no such process
+    """
+    stat_path = os.path.join(PROC_ROOT, str(pid), 'stat')
+    try:
+        with io.open(stat_path, 'rt') as f:
+            contents = f.read()
+    except IOError as e:
+        if e.errno not in (errno.ENOENT, errno.ESRCH):
+            raise
+        return None
+
+    # The name is enclosed in parentheses, and may contain any character
+    name_end = contents.rindex(')')
+    name = contents[contents.index('(') + 1:name_end]
+    # The start time is the 22nd field, the name being the 2nd
+    fields = contents[name_end + 2:].split()
+    return name, int(fields[19])
+
+
+def _read_pidfile(path):
+    try:
+        with io.open(path, 'rt') as f:
+            return int(f.read().split()[0])
+    except (IOError, OSError) as e:
+        if e.errno not in (errno.ENOENT, errno.EACCES):
+            raise
+    except (IndexError, ValueError):
+        log.warning("Ignoring invalid pidfile '%s'", path)
+    return None
+
+
+def load_state(path):
+    """
+    Load a state file written by :py:func:`save_state`.
+
+    :param path: path to the state file
+    :type path: string
+    :returns: the saved state, or an empty dictionary
+    """
+    try:
+        with io.open(path, 'rt') as f:
+            return json.load(f)
+    except (IOError, OSError) as e:
+        if e.errno not in (errno.ENOENT, errno.EACCES):
+            raise
+    except ValueError:
+        log.warning("Ignoring corrupt state file '%s'", path)
+    return {}
+
+
+def save_state(path, state):
+    """
+    Save a state used to speed up the next commands.
+
+    Failures are only logged, as the state can always be found again.
+
+    :param path: path to the state file
+    :type path: string
+    :param state: json serializable state
+    :type state: dictionary
+    """
+    try:
+        with elevated_privileges():
+            safe_write(json.dumps(state), path)
+    except (IOError, OSError) as e:
+        log.debug("Unable to save state file '%s': %s", path, e)
+
+
+def discard_state(path):
+    """
+    Remove a state file, e.g. once what it describes is known to change.
+
+    Must be called with root privileges.
+
+    :param path: path to the state file
+    :type path: string
+    """
+    try:
+        os.unlink(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            log.debug("Unable to remove state file '%s': %s", path, e)
+
+
+def known_process(process):
+    """
+    Get the process found by the previous check, if it is still running.
+
+    :param process: process name
+    :type process: string
+    :returns: [pid, start time], or `None` if the process found by the
+        previous check is gone or there was no such check
+    """
+    cached = load_state(PID_CACHE_FILE).get(process)
+    if cached is not None:
+        identity = process_identity(cached[0])
+        if identity == (process[:TASK_COMM_LEN], cached[1]):
+            return cached
+    return None
+
+
+def find_running_pid(process):
+    """
+    Find the pid of a running process, without scanning procfs if possible.
+
+    The pid found by the previous check is tried first, then the pidfiles
+    listed in :py:data:`PIDFILES`. A candidate is only accepted if it has the
+    expected name (and start time, for the cached pid), so that a reused pid
+    is not mistaken for the process. On a miss, procfs is scanned for all the
+    processes of :py:data:`PIDFILES` at once.
+
+    :param process: process name
+    :type process: string
+    :returns: a pid, or `None` if the process isn't running
+    """
+    known = known_process(process)
+    if known is not None:
+        return known[0]
+
+    name = process[:TASK_COMM_LEN]
+    pid_cache = load_state(PID_CACHE_FILE)
+
+    candidates = [_read_pidfile(path) for path in PIDFILES.get(process, ())]
+    candidates = [pid for pid in candidates if pid is not None]
+    for pids in (candidates, None):
+        if pids is None:
+            log.debug("No known pid for '%s', scanning processes", process)
+            pids = scan_processes(process, *PIDFILES)[process]
+
+        for pid in pids:
+            identity = process_identity(pid)
+            if identity is not None and identity[0] == name:
+                pid_cache[process] = [pid, identity[1]]
+                save_state(PID_CACHE_FILE, pid_cache)
+                return pid
+
+    return None
+
+
 def process_check(process):
     """
     Check if a process is running.
@@ -111,14 +446,122 @@ def process_check(process):
     :raises: :py:class:`scality_manila_utils.exceptions.EnvironmentException`
         if the process isn't running
     """
-    process_pids = find_pids(process)
-    if not process_pids:
+    if find_running_pid(process) is None:
         log.error("'%s' is not running", process)
         raise EnvironmentException("Could not find '{0:s}' running, "
                                    "make sure it is "
                                    "started".format(process))
 
 
+def configure_environment_checks(ttl, force=False):
+    """
+    Set for how long a successful environment verification is trusted.
+
+    :param ttl: time in seconds, 0 to always verify the environment
+    :type ttl: int
+    :param force: verify the environment even if it was recently verified,
+        and trust the result for `ttl` seconds
+    :type force: boolean
+    """
+    _env_checks.update(ttl=ttl, force=force)
+
+
+def verify_once(name, verify, dependencies):
+    """
+    Verify the environment, unless it was successfully verified recently.
+
+    A verification is trusted for the time set by
+    :py:func:`configure_environment_checks`, and as long as the state it
+    depends on does not change.
+
+    :param name: name of the verification, e.g. the protocol
+    :type name: string
+    :param verify: performs the verification, raising on failure
+    :type verify: callable
+    :param dependencies: returns the state the verification depends on, as
+        a json serializable list, where `None` stands for an unknown state
+    :type dependencies: callable
+    """
+    ttl = _env_checks['ttl']
+    if ttl <= 0:
+        verify()
+        return
+
+    state = load_state(ENV_CACHE_FILE)
+    last = state.get(name)
+    if last is not None and not _env_checks['force']:
+        age = time.time() - last['time']
+        current = dependencies()
+        if (0 <= age < ttl and None not in current and
+                current == last['dependencies']):
+            log.debug("Environment verified %.1fs ago, skipping checks",
+                      age)
+            return
+
+    verify()
+    state[name] = {'time': time.time(), 'dependencies': dependencies()}
+    save_state(ENV_CACHE_FILE, state)
+
+
+def fingerprint(text):
+    """
+    Compute a stable fingerprint of a canonical representation.
+
+    :param text: canonical representation of what to fingerprint
+    :type text: string (unicode)
+    :returns: hexadecimal digest
+    """
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def check_fingerprint(name, current, expected):
+    """
+    Ensure that the fingerprint of an export is the expected one.
+
+    :param name: name of the export, for the error message
+    :type name: string (unicode)
+    :param current: current fingerprint of the export
+    :type current: string
+    :param expected: expected fingerprint, `None` to skip the check
+    :type expected: string
+    :raises: `FingerprintMismatchException` if the fingerprints differ
+    """
+    if expected is not None and current != expected:
+        msg = ("Export '{0:s}' has changed (fingerprint {1:s}, expected "
+               "{2:s})".format(name, current, expected))
+        raise FingerprintMismatchException(msg)
+
+
+def set_durability(level):
+    """
+    Choose how hard writes try to survive a crash.
+
+    - `strict`: each file written is on disk before the next one is
+      written,
+    - `batch`: files written together are flushed together, so that a group
+      of files costs a single flush of each file and of each directory,
+    - `relaxed`: nothing is flushed, files are only replaced atomically. For
+      scratch environments only, as a crash may lose the last changes.
+
+    :param level: one of :py:data:`DURABILITY_LEVELS`
+    :type level: string
+    """
+    if level not in DURABILITY_LEVELS:
+        raise ValueError("Unknown durability level '{0:s}'".format(level))
+    _durability['level'] = level
+
+
+def fsync(fd):
+    """
+    Flush a file to disk, unless durability is relaxed.
+
+    :param fd: file descriptor
+    :type fd: int
+    """
+    if _durability['level'] != 'relaxed':
+        os.fsync(fd)
+
+
 def fsync_path(path):
     """
     Fsync a directory.
@@ -126,6 +569,9 @@ def fsync_path(path):
     :param path: path to directory to fsync
     :type path: string (unicode)
     """
+    if _durability['level'] == 'relaxed':
+        return
+
     fd = None
     try:
         fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
@@ -135,6 +581,63 @@ def fsync_path(path):
             os.close(fd)
 
 
+def _write_temporary(text, path, permissions):
+    # Make sure that the temporary file lives on the same fs
+    log.debug("Writing '%s'", path)
+    target_dir, _ = os.path.split(path)
+    with tempfile.NamedTemporaryFile(mode='wt', dir=target_dir,
+                                     delete=False) as f:
+        try:
+            os.chmod(f.name, permissions)
+            f.write(text)
+            f.flush()
+            fsync(f.fileno())
+        except Exception:
+            os.unlink(f.name)
+            raise
+    return f.name
+
+
+def commit_files(files, permissions=0o644):
+    """
+    Write several files in a safe manner.
+
+    Each file is replaced atomically, see :py:func:`safe_write`. With the
+    `batch` durability level, all the files are written and flushed before
+    any is moved in place, and each directory is flushed once at the end.
+    Files are moved in place in the order given.
+
+    :param files: the paths to write to, and their content. A third item
+        overrides `permissions` for that file.
+    :type files: iterable of (string, string) or (string, string, int)
+    :param permissions: file permissions
+    :type permissions: int (octal)
+    """
+    files = [(f[0], f[1], f[2] if len(f) > 2 else permissions)
+             for f in files]
+    if _durability['level'] == 'strict':
+        for path, text, mode in files:
+            os.rename(_write_temporary(text, path, mode), path)
+            # fsync the directory holding the file just written and moved
+            fsync_path(os.path.dirname(path))
+        return
+
+    written = []
+    try:
+        for path, text, mode in files:
+            written.append((_write_temporary(text, path, mode), path))
+    except Exception:
+        for temporary, _ in written:
+            os.unlink(temporary)
+        raise
+
+    for temporary, path in written:
+        os.rename(temporary, path)
+    for directory in sorted(set(os.path.dirname(path)
+                                for path, _, _ in files)):
+        fsync_path(directory)
+
+
 def safe_write(text, path, permissions=0o644):
     """
     Write contents to file in a safe manner.
@@ -149,19 +652,7 @@ def safe_write(text, path, permissions=0o644):
     :param permissions: file permissions
     :type permissions: int (octal)
     """
-    # Make sure that the temporary file lives on the same fs
-    log.debug("Writing '%s'", path)
-    target_dir, _ = os.path.split(path)
-    with tempfile.NamedTemporaryFile(mode='wt', dir=target_dir,
-                                     delete=False) as f:
-        os.chmod(f.name, permissions)
-        f.write(text)
-        f.flush()
-        os.fsync(f.fileno())
-        os.rename(f.name, path)
-
-    # fsync the directory holding the file just written and moved
-    fsync_path(target_dir)
+    commit_files([(path, text)], permissions)
 
 
 @contextlib.contextmanager
@@ -173,12 +664,13 @@ def nfs_mount(export_path):
     :type export_path: string
     :returns: path to where the filesystem was mounted
     """
+    mount_point = tempfile.mkdtemp()
     try:
-        mount_point = tempfile.mkdtemp()
-        subprocess.check_call(['mount', export_path, mount_point])
+        check_call(['mount', export_path, mount_point])
         log.debug("Mounted nfs root '%s' at '%s'", export_path, mount_point)
-    except (OSError, subprocess.CalledProcessError):
+    except (OSError, subprocess.CalledProcessError, CommandTimeoutException):
         log.exception('Unable to mount NFS root')
+        _remove_mount_point(mount_point)
         raise
 
     try:
@@ -186,17 +678,84 @@ def nfs_mount(export_path):
 
     finally:
         try:
-            subprocess.check_call(['umount', mount_point])
-        except subprocess.CalledProcessError:
+            check_call(['umount', mount_point])
+        except (subprocess.CalledProcessError, CommandTimeoutException):
             log.exception('Unable to umount NFS root')
             raise
 
         log.debug('Unmounted nfs root')
+        _remove_mount_point(mount_point)
 
-        try:
-            os.rmdir(mount_point)
-        except OSError as e:
-            log.warning("Unable to clean up temporary NFS root: %s", e)
+
+def _remove_mount_point(mount_point):
+    try:
+        os.rmdir(mount_point)
+    except OSError as e:
+        log.warning("Unable to clean up temporary NFS root: %s", e)
+
+
+def _unescape_mount_path(path):
+    # Spaces, tabs, newlines and backslashes are escaped in octal
+    return _MOUNT_PATH_ESCAPE.sub(lambda m: chr(int(m.group(1), 8)), path)
+
+
+def _parse_mountinfo(mountinfo):
+    mounts = []
+    for line in mountinfo.splitlines():
+        # Optional fields come before the separator, hence the split
+        left, _, right = line.partition(' - ')
+        left, right = left.split(), right.split()
+        if len(left) < 5 or len(right) < 2:
+            continue
+        mounts.append((left[2], _unescape_mount_path(left[4]), right[1]))
+    return mounts
+
+
+def _mount_source(path):
+    """
+    Find the source of the filesystem holding a path.
+
+    Sources are saved by device in :py:data:`MOUNT_CACHE_FILE`, along with
+    the fingerprint of the mount table they were found in, so that the next
+    commands don't parse it again until it changes.
+
+    :param path: an absolute path
+    :type path: string
+    :returns: the source of the mount, as found in mountinfo
+    """
+    with io.open(MOUNTINFO, 'rt') as f:
+        mountinfo = f.read()
+
+    digest = fingerprint(mountinfo)
+    st_dev = os.stat(path).st_dev
+    # Json object keys are strings
+    key = str(st_dev)
+    if _mount_cache.get('digest') != digest:
+        state = load_state(MOUNT_CACHE_FILE)
+        if state.get('digest') != digest:
+            state = {'digest': digest, 'sources': {}}
+        _mount_cache.clear()
+        _mount_cache.update(state)
+
+    if key in _mount_cache['sources']:
+        return _mount_cache['sources'][key]
+
+    device = '{0:d}:{1:d}'.format(os.major(st_dev), os.minor(st_dev))
+    path = os.path.realpath(path)
+    source = None
+    longest = -1
+    for mount_device, mount_point, mount_source in _parse_mountinfo(mountinfo):
+        if mount_device != device or len(mount_point) <= longest:
+            continue
+        prefix = mount_point.rstrip('/') + '/'
+        if path == mount_point or path.startswith(prefix):
+            source = mount_source
+            longest = len(mount_point)
+
+    log.debug("Source of '%s' (device %s): %s", path, device, source)
+    _mount_cache['sources'][key] = source
+    save_state(MOUNT_CACHE_FILE, _mount_cache)
+    return source
 
 
 def is_stored_on_sofs(path):
@@ -207,21 +766,338 @@ def is_stored_on_sofs(path):
     :type path: string
     :rtype: boolean
     """
-    with elevated_privileges():
-        try:
-            output = subprocess.check_output(['df', '-P', path])
-        except subprocess.CalledProcessError:
-            log.exception("Unable to get fs type of '{0:s}'".format(path))
+    return _mount_source(path) == '/dev/fuse'
+
+
+def set_deadline(seconds):
+    """
+    Set a deadline for all the commands run from now on.
+
+    :param seconds: time left for the commands, `None` for no deadline
+    :type seconds: int
+    """
+    _deadline['at'] = None if seconds is None else _monotonic() + seconds
+
+
+class SpawnedProcess(object):
+    """
+    The parts of `subprocess.Popen` used by :py:func:`run`, for processes
+    started with `os.posix_spawnp`.
+    """
+
+    def __init__(self, pid, stdout, stderr):
+        self.pid = pid
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = None
+
+    def _wait(self, flags):
+        if self.returncode is None:
+            pid, status = os.waitpid(self.pid, flags)
+            if pid == self.pid:
+                if os.WIFSIGNALED(status):
+                    self.returncode = -os.WTERMSIG(status)
+                else:
+                    self.returncode = os.WEXITSTATUS(status)
+        return self.returncode
+
+    def poll(self):
+        return self._wait(os.WNOHANG)
+
+    def wait(self):
+        return self._wait(0)
+
+
+def spawn(cmd):
+    """
+    Start a command in a new session, with its stdout and stderr piped.
+
+    `os.posix_spawnp` is used where available, which lets the C library
+    start the process without copying the page tables of the caller, unlike
+    `fork`. Otherwise, `subprocess.Popen` is used.
+
+    :param cmd: the command with arguments to execute
+    :type cmd: iterable of `str` or a single `str`
+    :returns: :py:class:`SpawnedProcess` or `subprocess.Popen`
+    """
+    if isinstance(cmd, (list, tuple)):
+        cmd = resolve_command(cmd)
+    if not USE_POSIX_SPAWN or not isinstance(cmd, list):
+        return subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, preexec_fn=os.setsid)
+
+    # Pipes are not inherited, only their ends duplicated on stdout and
+    # stderr of the child
+    stdout_r, stdout_w = os.pipe()
+    stderr_r, stderr_w = os.pipe()
+    file_actions = [
+        (os.POSIX_SPAWN_DUP2, stdout_w, 1),
+        (os.POSIX_SPAWN_DUP2, stderr_w, 2),
+    ]
+    try:
+        pid = os.posix_spawnp(cmd[0], list(cmd), os.environ,
+                              file_actions=file_actions, setsid=True)
+    except Exception:
+        os.close(stdout_r)
+        os.close(stderr_r)
+        raise
+    finally:
+        os.close(stdout_w)
+        os.close(stderr_w)
+
+    return SpawnedProcess(pid, os.fdopen(stdout_r, 'rb', 0),
+                          os.fdopen(stderr_r, 'rb', 0))
+
+
+def command_deadline(timeout=None):
+    """
+    Compute when a command starting now has to be done.
+
+    :param timeout: see :py:func:`run`
+    :type timeout: int
+    :returns: deadline, in seconds of the monotonic clock
+    """
+    deadline = _monotonic() + (COMMAND_TIMEOUT if timeout is None
+                               else timeout)
+    if _deadline['at'] is not None:
+        deadline = min(deadline, _deadline['at'])
+    return deadline
+
+
+def kill_process_group(pid):
+    """
+    Kill the process group of a process started by :py:func:`spawn`.
+
+    :param pid: pid of the process
+    :type pid: int
+    """
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError as e:
+        if e.errno != errno.ESRCH:
             raise
 
-    # df will output a header, followed by the filesystem capacity usage
-    fsline = output.splitlines()[-1]
-    fstype = fsline.split()[0]
 
-    return fstype == '/dev/fuse'
+def _kill_process_group(process):
+    kill_process_group(process.pid)
+    process.wait()
+
+
+def _read_output(process, cmd, timeout, stdout_limit=None):
+    """
+    Read the output of a spawned process as it comes, until it exits.
+
+    The process group is killed if the process times out, writes more than
+    :py:data:`COMMAND_MAX_OUTPUT` bytes on stderr (or `stdout_limit` bytes
+    on stdout), or if the caller stops reading.
+
+    :param process: process started by :py:func:`spawn`
+    :param cmd: the command being run, for error messages
+    :param timeout: see :py:func:`run`
+    :type timeout: int
+    :param stdout_limit: bytes the process may write on stdout, `None` for
+        :py:data:`COMMAND_MAX_OUTPUT`, 0 for no limit
+    :type stdout_limit: int
+    :returns: generator of (is stdout, data)
+    """
+    deadline = command_deadline(timeout)
+    stdout_fd, stderr_fd = process.stdout.fileno(), process.stderr.fileno()
+    pipes = {stdout_fd: process.stdout, stderr_fd: process.stderr}
+    limits = {
+        stdout_fd: COMMAND_MAX_OUTPUT if stdout_limit is None
+        else stdout_limit,
+        stderr_fd: COMMAND_MAX_OUTPUT,
+    }
+    sizes = dict((fd, 0) for fd in pipes)
+    poller = select.poll()
+    for fd in pipes:
+        poller.register(fd, select.POLLIN)
+
+    delay = 0.0001
+    try:
+        while pipes or process.poll() is None:
+            remaining = deadline - _monotonic()
+            if remaining <= 0:
+                raise CommandTimeoutException(
+                    "Command {0!r} timed out".format(cmd))
+
+            if not pipes:
+                # Wait for the process to exit after closing its output,
+                # which is usually right away
+                time.sleep(min(remaining, delay))
+                delay = min(delay * 2, 0.05)
+                continue
+
+            for fd, _ in poller.poll(remaining * 1000):
+                data = os.read(fd, 64 * 1024)
+                if not data:
+                    poller.unregister(fd)
+                    pipes.pop(fd).close()
+                    continue
+
+                sizes[fd] += len(data)
+                if limits[fd] and sizes[fd] > limits[fd]:
+                    raise EnvironmentError(
+                        "Command {0!r} wrote more than {1:d} bytes".format(
+                            cmd, limits[fd]))
+                yield fd == stdout_fd, data
+
+    except BaseException:
+        # Including `GeneratorExit`, when the caller stops reading
+        _kill_process_group(process)
+        raise
+
+    finally:
+        for pipe in pipes.values():
+            pipe.close()
+
+
+def run(cmd, timeout=None):
+    """
+    Run a command and capture its output.
+
+    The command runs in its own process group, which is killed as a whole
+    if the command runs for longer than `timeout`, past the deadline set by
+    :py:func:`set_deadline`, or if it writes more than
+    :py:data:`COMMAND_MAX_OUTPUT` bytes.
+
+    :param cmd: the command with arguments to execute
+    :type cmd: iterable of `str` or a single `str`
+    :param timeout: time in seconds the command may run for, defaults to
+        :py:data:`COMMAND_TIMEOUT`
+    :type timeout: int
+    :returns: (return code, stdout, stderr), the output being bytes
+    :raises: :py:class:`scality_manila_utils.exceptions.\
+CommandTimeoutException` if the command timed out
+    """
+    process = spawn(cmd)
+    output = {True: [], False: []}
+    for is_stdout, data in _read_output(process, cmd, timeout):
+        output[is_stdout].append(data)
+
+    return (process.returncode, b''.join(output[True]),
+            b''.join(output[False]))
+
+
+def execute_lines(cmd, error_msg, timeout=None):
+    """
+    Execute a command, and iterate over its output lines as they come.
+
+    Unlike :py:func:`execute`, the output is not kept in memory, and is not
+    limited in size. Lines longer than :py:data:`COMMAND_MAX_OUTPUT` bytes
+    are refused. The command is killed if the iteration stops early.
+
+    :param cmd: the command with arguments to execute
+    :type cmd: iterable of `str` or a single `str`
+    :param error_msg: the exception message in case something went wrong,
+        see :py:func:`execute`. `{stdout}` is left empty.
+    :type error_msg: `str`
+    :param timeout: see :py:func:`run`
+    :type timeout: int
+    :returns: generator of `unicode` lines, without line endings
+    """
+    process = spawn(cmd)
+    stderr = []
+    pending = b''
+    output = _read_output(process, cmd, timeout, stdout_limit=0)
+    try:
+        for is_stdout, data in output:
+            if not is_stdout:
+                stderr.append(data)
+                continue
+
+            # UTF-8 encoded characters can't contain a newline byte
+            lines = (pending + data).split(b'\n')
+            pending = lines.pop()
+            if len(pending) > COMMAND_MAX_OUTPUT:
+                raise EnvironmentError(
+                    "Command {0!r} wrote a line longer than {1:d} "
+                    "bytes".format(cmd, COMMAND_MAX_OUTPUT))
+            for line in lines:
+                yield line.decode()
+
+    finally:
+        # Kills the command if it is still running
+        output.close()
+
+    if pending:
+        yield pending.decode()
+
+    if process.returncode != 0:
+        raise EnvironmentError(error_msg.format(
+            stdout='', stderr=b''.join(stderr).decode()))
+
+
+class CommandResult(collections.namedtuple(
+        'CommandResult', ('cmd', 'returncode', 'stdout', 'stderr', 'error'))):
+    """
+    Outcome of a command run by :py:func:`run_many`.
+
+    `error` is the exception raised if the command couldn't be run or timed
+    out, in which case `returncode` is `None`.
+    """
+    __slots__ = ()
+
+    @property
+    def succeeded(self):
+        return self.error is None and self.returncode == 0
 
 
-def execute(cmd, error_msg):
+def run_many(cmds, concurrency=8, timeout=None):
+    """
+    Run independent commands, several at a time.
+
+    Commands are run by an asyncio event loop where available, and one
+    after the other otherwise. A failing command does not stop the others.
+    Must not be called from a running event loop.
+
+    :param cmds: the commands with arguments to execute
+    :type cmds: iterable of iterables of `str`
+    :param concurrency: maximum number of commands running at once
+    :type concurrency: int
+    :param timeout: time in seconds each command may run for, see
+        :py:func:`run`
+    :type timeout: int
+    :returns: list of :py:class:`CommandResult`, in the order of `cmds`
+    """
+    try:
+        from scality_manila_utils import bulk
+    except (ImportError, SyntaxError):
+        # Python 2
+        bulk = None
+
+    if bulk is not None:
+        return bulk.run_many(cmds, concurrency, timeout)
+
+    results = []
+    for cmd in cmds:
+        try:
+            returncode, stdout, stderr = run(cmd, timeout)
+        except (EnvironmentError, EnvironmentException) as e:
+            results.append(CommandResult(cmd, None, b'', b'', e))
+        else:
+            results.append(CommandResult(cmd, returncode, stdout, stderr,
+                                         None))
+    return results
+
+
+def check_call(cmd, timeout=None):
+    """
+    Run a command, and check that it succeeded.
+
+    :param cmd: the command with arguments to execute
+    :type cmd: iterable of `str` or a single `str`
+    :param timeout: see :py:func:`run`
+    :type timeout: int
+    :raises: `subprocess.CalledProcessError` if the command failed
+    """
+    returncode, stdout, stderr = run(cmd, timeout)
+    if returncode != 0:
+        log.error("Command %r failed: %s", cmd, stderr.decode().strip())
+        raise subprocess.CalledProcessError(returncode, cmd, stdout)
+
+
+def execute(cmd, error_msg, timeout=None):
     """
     Utility function to execute a command
 
@@ -230,16 +1106,14 @@ def execute(cmd, error_msg):
     :param error_msg: the exception message in case something went wrong.
         `error_msg` must include the placeholders `{stdout}` and `{stderr}`
     :type error_msg: `str`
+    :param timeout: see :py:func:`run`
+    :type timeout: int
     :rtype: (`unicode`, `unicode`)
     """
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE)
-
-    # `subprocess.communicate` returns a byte stream
-    stdout, stderr = process.communicate()
+    returncode, stdout, stderr = run(cmd, timeout)
     stdout, stderr = stdout.decode(), stderr.decode()
 
-    if process.returncode != 0:
+    if returncode != 0:
         raise EnvironmentError(error_msg.format(stdout=stdout, stderr=stderr))
 
     return stdout, stderr
@@ -0,0 +1,177 @@
+# Copyright (c) 2015 Scality
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Latency of the smb commands against the fake `net` of `test.fake`, with a
+registry of 10, 1k and 10k shares.
+
+`--latency` adds time to every `net` command, e.g. to account for a slower
+registry::
+
+    python -m test.benchmark.bench_smb --shares 10 1000 --latency 5
+"""
+
+from __future__ import print_function
+import argparse
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import mock
+
+from scality_manila_utils import smb_helper, utils
+from test.fake import fake_net_environment
+
+
+def seed(directory, root_export, shares):
+    """Define shares in the registry with a single import."""
+    path = os.path.join(directory, 'seed.conf')
+    with io.open(path, 'wt') as f:
+        for i in range(shares):
+            export_point = os.path.join(root_export, 'share{0:d}'.format(i))
+            f.write(u'[share{0:d}]\n\tpath = {1:s}\n\thosts deny = 0.0.0.0/0\n'
+                    u'\thosts allow = 127.0.0.1\n'.format(i, export_point))
+    utils.check_call(['net', 'conf', 'import', path])
+
+
+def commands(root_export, shares, iterations):
+    """
+    Yield the name of each command, and a function running it for the
+    i-th iteration.
+    """
+    targets = ['share{0:d}'.format(i * shares // iterations)
+               for i in range(iterations)]
+
+    def each(f, names):
+        return lambda i: f(names[i])
+
+    def get_cold(export_name):
+        utils.discard_state(smb_helper.REGISTRY_CACHE_FILE)
+        smb_helper.get_export(export_name=export_name,
+                              root_export=root_export)
+
+    def get(export_name):
+        smb_helper.get_export(export_name=export_name,
+                              root_export=root_export)
+
+    def grant(export_name):
+        smb_helper.grant_access(export_name=export_name, host='10.0.0.1',
+                                root_export=root_export)
+
+    def revoke(export_name):
+        smb_helper.revoke_access(export_name=export_name, host='10.0.0.1',
+                                 root_export=root_export)
+
+    def batch(export_name):
+        requests = [[export_name, '10.1.0.{0:d}'.format(i), 'grant']
+                    for i in range(10)]
+        requests.extend([export_name, host, 'revoke']
+                        for _, host, _ in list(requests))
+        smb_helper.batch_access(root_export=root_export, requests=requests)
+
+    created = ['bench{0:d}'.format(i) for i in range(iterations)]
+
+    def create(export_name):
+        smb_helper.add_export(export_name=export_name,
+                              root_export=root_export)
+
+    def wipe(export_name):
+        smb_helper.wipe_export(export_name=export_name,
+                               root_export=root_export)
+
+    yield 'net conf list', lambda i: utils.run(['net', 'conf', 'list'])
+    yield 'get (no snapshot)', each(get_cold, targets)
+    yield 'get', each(get, targets)
+    yield 'grant', each(grant, targets)
+    yield 'revoke', each(revoke, targets)
+    yield 'batch (20 requests)', each(batch, targets)
+    yield 'create', each(create, created)
+    yield 'create (existing)', each(create, created)
+    yield 'wipe', each(wipe, created)
+
+
+def measure(root_export, shares, iterations):
+    results = []
+    for name, once in commands(root_export, shares, iterations):
+        start = time.time()
+        for i in range(iterations):
+            once(i)
+        results.append((name, (time.time() - start) / iterations))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--shares', type=int, nargs='+',
+                        default=[10, 1000, 10000])
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0, metavar='MS')
+    parser.add_argument('--json', action='store_true', default=False,
+                        help='Output the results in json format')
+    args = parser.parse_args()
+
+    table = {}
+    for shares in args.shares:
+        directory = tempfile.mkdtemp()
+        root_export = os.path.join(directory, 'sofs')
+        os.mkdir(root_export)
+        registry = os.path.join(directory, 'registry.json')
+        patches = [
+            mock.patch.dict(os.environ,
+                            fake_net_environment(registry, args.latency)),
+            mock.patch.object(utils, 'BINARY_CACHE_FILE',
+                              os.path.join(directory, 'binaries')),
+            mock.patch.dict(utils._binary_cache, clear=True),
+            mock.patch.object(smb_helper, 'verify_environment'),
+            mock.patch.object(smb_helper, 'REGISTRY_TDB', registry),
+            mock.patch.object(smb_helper, 'REGISTRY_CACHE_FILE',
+                              os.path.join(directory, 'snapshot')),
+            mock.patch.object(smb_helper, 'SMB_GRANTS_DIR',
+                              os.path.join(directory, 'grants')),
+            mock.patch.object(smb_helper, 'SMB_LOCK_DIR',
+                              os.path.join(directory, 'locks')),
+        ]
+        if os.geteuid() != 0:
+            patches.append(
+                mock.patch.object(utils, 'elevated_privileges'))
+
+        for patch in patches:
+            patch.start()
+        try:
+            seed(directory, root_export, shares)
+            table[shares] = measure(root_export, shares, args.iterations)
+        finally:
+            for patch in reversed(patches):
+                patch.stop()
+            shutil.rmtree(directory)
+
+    if args.json:
+        print(json.dumps(dict((shares, dict(results))
+                              for shares, results in table.items())))
+        return
+
+    print('{0:<22s}'.format('ms per command') + ''.join(
+        '{0:>14s}'.format('{0:d} shares'.format(shares))
+        for shares in args.shares))
+    for row, (name, _) in enumerate(table[args.shares[0]]):
+        print('{0:<22s}'.format(name) + ''.join(
+            '{0:14.1f}'.format(table[shares][row][1] * 1000)
+            for shares in args.shares))
+
+
+if __name__ == '__main__':
+    main()
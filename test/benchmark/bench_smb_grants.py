@@ -0,0 +1,116 @@
+# Copyright (c) 2015 Scality
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Throughput of concurrent `smb grant` on shares of an in-memory registry,
+and grants lost to concurrent writers.
+
+Reading and writing a share each take `--latency` milliseconds, as running
+`net conf` would. `--no-lock` shows the grants lost without the per-share
+lock::
+
+    python -m test.benchmark.bench_smb_grants --writers 50 --shares 1
+"""
+
+from __future__ import print_function
+import argparse
+import contextlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import mock
+
+from scality_manila_utils import smb_helper
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--writers', type=int, default=50)
+    parser.add_argument('--grants', type=int, default=10,
+                        help='Grants per writer')
+    parser.add_argument('--shares', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=1, metavar='MS')
+    parser.add_argument('--no-lock', action='store_true', default=False)
+    args = parser.parse_args()
+
+    latency = args.latency / 1000
+    exports = dict(('share{0:d}'.format(i), {'hosts allow': '127.0.0.1'})
+                   for i in range(args.shares))
+
+    def show_share(export_name):
+        time.sleep(latency)
+        return dict(exports[export_name])
+
+    def setparm(cmd, msg):
+        time.sleep(latency)
+        exports[cmd[3]][cmd[4]] = cmd[5]
+
+    def writer(index):
+        for i in range(args.grants):
+            export_name = 'share{0:d}'.format((index + i) % args.shares)
+            host = '10.{0:d}.{1:d}.{2:d}'.format(index // 256, index % 256,
+                                                 i)
+            smb_helper.grant_access(export_name=export_name, host=host,
+                                    root_export='/ring/fs')
+
+    directory = tempfile.mkdtemp()
+    patches = [
+        mock.patch.object(smb_helper, '_show_share', show_share),
+        mock.patch.object(smb_helper, 'verify_environment'),
+        mock.patch.object(smb_helper, 'SMB_LOCK_DIR',
+                          os.path.join(directory, 'locks')),
+        mock.patch.object(smb_helper, 'REGISTRY_CACHE_FILE',
+                          os.path.join(directory, 'registry.json')),
+        mock.patch('scality_manila_utils.utils.execute', setparm),
+        mock.patch('scality_manila_utils.utils.elevated_privileges'),
+    ]
+    if args.no_lock:
+        patches.append(mock.patch.object(
+            smb_helper, '_share_lock',
+            lambda export_name: contextlib.contextmanager(
+                lambda: (yield))()))
+
+    for patch in patches:
+        patch.start()
+    try:
+        threads = [threading.Thread(target=writer, args=(index,))
+                   for index in range(args.writers)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+    finally:
+        for patch in reversed(patches):
+            patch.stop()
+        shutil.rmtree(directory)
+
+    total = args.writers * args.grants
+    granted = sum(len(export['hosts allow'].split()) - 1
+                  for export in exports.values())
+    print('{0:d} writers, {1:d} grants on {2:d} shares, {3:.1f}ms '
+          'latency{4:s}'.format(args.writers, total, args.shares,
+                                args.latency,
+                                ', no lock' if args.no_lock else ''))
+    print('{0:<12s} {1:10.1f} grants/s'.format('throughput',
+                                               total / elapsed))
+    print('{0:<12s} {1:10d}'.format('lost grants', total - granted))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# Copyright (c) 2015 Scality
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Time to parse a `net conf list` dump with `smbconf.parse`, against the
+`ConfigParser` based parsing it replaces::
+
+    python -m test.benchmark.bench_smbconf --shares 10 1000 10000
+"""
+
+from __future__ import print_function
+import argparse
+import io
+import time
+
+try:
+    import ConfigParser as configparser
+except ImportError:
+    import configparser
+
+from scality_manila_utils import smbconf
+
+
+def net_conf_list(shares):
+    lines = [u'[global]', u'\tworkgroup = WORKGROUP', u'']
+    for i in range(shares):
+        lines.extend([
+            u'[share{0:d}]'.format(i),
+            u'\tpath = /ring/fs/share{0:d}'.format(i),
+            u'\twriteable = yes',
+            u'\tguest ok = yes',
+            u'\tbrowseable = yes',
+            u'\tcreate mask = 0755',
+            u'\thosts deny = 0.0.0.0/0',
+            u'\thosts allow = 127.0.0.1 10.0.{0:d}.0/24'.format(i % 256),
+            u'\tread only = no',
+            u'',
+        ])
+    return lines
+
+
+def configparser_parse(lines):
+    config = configparser.ConfigParser()
+    lines = (line.replace('\t', '') for line in lines)
+    if hasattr(config, 'read_file'):
+        config.read_file(lines)
+    else:
+        config.readfp(io.StringIO(u'\n'.join(lines)))
+    shares = dict(config._sections)
+    for name in shares:
+        shares[name] = dict(config._defaults, **shares[name])
+        shares[name].pop('__name__', None)
+    return shares
+
+
+def measure(f, lines, iterations):
+    f(lines)
+    start = time.time()
+    for _ in range(iterations):
+        f(iter(lines))
+    return (time.time() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--shares', type=int, nargs='+',
+                        default=[10, 1000, 10000])
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    candidates = [('ConfigParser', configparser_parse),
+                  ('smbconf.parse', smbconf.parse)]
+    for shares in args.shares:
+        lines = net_conf_list(shares)
+        print('{0:d} shares, {1:d} lines'.format(shares, len(lines)))
+        for name, f in candidates:
+            latency = measure(f, lines, args.iterations)
+            print('  {0:<16s} {1:10.3f} ms'.format(name, latency * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# Copyright (c) 2015 Scality
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Spawn latency of `utils.run`, with and without `posix_spawnp`, against a
+plain `subprocess.Popen`.
+
+The cost of `fork` grows with the memory of the caller, use `--heap` to
+run the benchmark from a process with a large heap::
+
+    python -m test.benchmark.bench_spawn --heap 1024
+"""
+
+from __future__ import print_function
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import mock
+
+from scality_manila_utils import utils
+
+
+def popen(cmd):
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, preexec_fn=os.setsid)
+    process.communicate()
+
+
+def run_with(use_posix_spawn):
+    def run(cmd):
+        with mock.patch.object(utils, 'USE_POSIX_SPAWN', use_posix_spawn):
+            utils.run(cmd)
+    return run
+
+
+def measure(f, cmd, iterations):
+    # Warm up, e.g. for `utils.which`
+    f(cmd)
+    start = time.time()
+    for _ in range(iterations):
+        f(cmd)
+    return (time.time() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--heap', type=int, default=0, metavar='MB',
+                        help='Memory to allocate before spawning')
+    parser.add_argument('--command', default='true')
+    args = parser.parse_args()
+
+    # Touch every page, for them to be mapped
+    heap = bytearray(args.heap * 1024 * 1024)
+    for i in range(0, len(heap), 4096):
+        heap[i] = 1
+
+    # Keep the binary cache of `utils.which` out of /run
+    directory = tempfile.mkdtemp()
+    patches = [
+        mock.patch.object(utils, 'BINARY_CACHE_FILE',
+                          os.path.join(directory, 'binaries')),
+        mock.patch.dict(utils._binary_cache, clear=True),
+    ]
+    for patch in patches:
+        patch.start()
+    try:
+        cmd = [utils.which(args.command) or args.command]
+        candidates = [('subprocess.Popen', popen),
+                      ('utils.run (Popen)', run_with(False))]
+        if hasattr(os, 'posix_spawnp'):
+            candidates.append(('utils.run (posix_spawnp)', run_with(True)))
+
+        print('{0:d} runs of {1:s}, {2:d}MB heap'.format(args.iterations,
+                                                         cmd[0], args.heap))
+        for name, f in candidates:
+            latency = measure(f, cmd, args.iterations)
+            print('{0:<28s} {1:8.3f} ms'.format(name, latency * 1000))
+    finally:
+        for patch in reversed(patches):
+            patch.stop()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
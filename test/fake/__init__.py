@@ -0,0 +1,39 @@
+# Copyright (c) 2015 Scality
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Stand-ins for the external commands run by scality_manila_utils.
+"""
+
+import os
+
+FAKE_BIN_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def fake_net_environment(registry, latency=0):
+    """
+    Environment putting the fake `net` first on `PATH`.
+
+    :param registry: path to the json file holding the registry
+    :type registry: string
+    :param latency: time in milliseconds each command takes
+    :type latency: float
+    :returns: environment variables to set
+    """
+    return {
+        'PATH': os.pathsep.join([FAKE_BIN_DIR,
+                                 os.getenv('PATH', os.defpath)]),
+        'FAKE_NET_REGISTRY': registry,
+        'FAKE_NET_LATENCY': str(latency),
+    }
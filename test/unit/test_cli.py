@@ -14,11 +14,14 @@
 # limitations under the License.
 
 import grp
+import json
 import mock
 import pwd
+import tempfile
 import unittest2 as unittest
 
 import scality_manila_utils.cli
+from scality_manila_utils.exceptions import FingerprintMismatchException
 
 
 class _BaseTestCLI(unittest.TestCase):
@@ -44,6 +47,20 @@ class _BaseTestCLI(unittest.TestCase):
         self.addCleanup(patcher.stop)
         self.helper = patcher.start()
 
+        patcher = mock.patch(
+            'scality_manila_utils.utils.configure_environment_checks'
+        )
+        self.addCleanup(patcher.stop)
+        self.configure_environment_checks = patcher.start()
+
+        patcher = mock.patch('scality_manila_utils.utils.set_deadline')
+        self.addCleanup(patcher.stop)
+        self.set_deadline = patcher.start()
+
+        patcher = mock.patch('scality_manila_utils.utils.set_durability')
+        self.addCleanup(patcher.stop)
+        self.set_durability = patcher.start()
+
     @mock.patch('scality_manila_utils.cli.drop_privileges')
     @mock.patch('os.getuid', return_value=0)
     def test_setup(self, getuid, drop_privileges):
@@ -89,7 +106,8 @@ class _BaseTestCLI(unittest.TestCase):
         expected_called_args = {
             'root_export': self.root_export,
             'export_name': export_name,
-            'host': host
+            'host': host,
+            'if_match': None,
         }
 
         if self._interface == 'nfs':
@@ -97,6 +115,7 @@ class _BaseTestCLI(unittest.TestCase):
             args += options
             expected_called_args['exports_file'] = self.exports_path
             expected_called_args['options'] = options
+            expected_called_args['journal'] = False
 
         scality_manila_utils.cli.main(args)
         self.helper.grant_access.assert_called_once_with(
@@ -114,11 +133,13 @@ class _BaseTestCLI(unittest.TestCase):
         expected_called_args = {
             'root_export': self.root_export,
             'export_name': export_name,
-            'host': host
+            'host': host,
+            'if_match': None,
         }
 
         if self._interface == 'nfs':
             expected_called_args['exports_file'] = self.exports_path
+            expected_called_args['journal'] = False
 
         self.helper.revoke_access.assert_called_once_with(
             **expected_called_args)
@@ -151,6 +172,7 @@ class _BaseTestCLI(unittest.TestCase):
         expected_called_args = {
             'root_export': self.root_export,
             'export_name': export_name,
+            'fingerprint': False,
         }
 
         if self._interface == 'nfs':
@@ -159,6 +181,75 @@ class _BaseTestCLI(unittest.TestCase):
         self.helper.get_export.assert_called_once_with(
             **expected_called_args)
 
+    @mock.patch('scality_manila_utils.cli.drop_privileges')
+    @mock.patch('os.getuid', return_value=0)
+    def test_environment_checks_options(self, getuid, drop_privileges):
+        scality_manila_utils.cli.main([self._interface, 'get', 'share'])
+        self.configure_environment_checks.assert_called_once_with(
+            30, force=False)
+
+        self.configure_environment_checks.reset_mock()
+        scality_manila_utils.cli.main(['--check-ttl', '0', '--force-check',
+                                       self._interface, 'get', 'share'])
+        self.configure_environment_checks.assert_called_once_with(
+            0, force=True)
+
+        # The options are not passed on to the helper
+        _, kwargs = self.helper.get_export.call_args
+        self.assertNotIn('check_ttl', kwargs)
+        self.assertNotIn('force_check', kwargs)
+
+    @mock.patch('scality_manila_utils.cli.drop_privileges')
+    @mock.patch('os.getuid', return_value=0)
+    def test_timeout_option(self, getuid, drop_privileges):
+        scality_manila_utils.cli.main([self._interface, 'get', 'share'])
+        self.set_deadline.assert_called_once_with(None)
+
+        self.set_deadline.reset_mock()
+        scality_manila_utils.cli.main(['--timeout', '10', self._interface,
+                                       'get', 'share'])
+        self.set_deadline.assert_called_once_with(10)
+        _, kwargs = self.helper.get_export.call_args
+        self.assertNotIn('timeout', kwargs)
+
+    @mock.patch('scality_manila_utils.cli.drop_privileges')
+    @mock.patch('os.getuid', return_value=0)
+    def test_durability_option(self, getuid, drop_privileges):
+        scality_manila_utils.cli.main([self._interface, 'get', 'share'])
+        self.set_durability.assert_called_once_with('strict')
+
+        self.set_durability.reset_mock()
+        scality_manila_utils.cli.main(['--durability', 'batch',
+                                       self._interface, 'get', 'share'])
+        self.set_durability.assert_called_once_with('batch')
+        _, kwargs = self.helper.get_export.call_args
+        self.assertNotIn('durability', kwargs)
+
+    @mock.patch('scality_manila_utils.cli.drop_privileges')
+    @mock.patch('os.getuid', return_value=0)
+    def test_invoke_conditional_grant(self, getuid, drop_privileges):
+        args = [self._interface, 'grant', '--if-match', 'abc', 'share',
+                '10.0.0.1']
+        scality_manila_utils.cli.main(args)
+
+        _, kwargs = self.helper.grant_access.call_args
+        self.assertEqual('abc', kwargs['if_match'])
+
+    @mock.patch('scality_manila_utils.cli.drop_privileges')
+    @mock.patch('os.getuid', return_value=0)
+    def test_fingerprint_mismatch_exit_code(self, getuid, drop_privileges):
+        exc = FingerprintMismatchException('mismatch')
+        self.helper.revoke_access.side_effect = exc
+
+        with mock.patch('sys.stderr'):
+            with self.assertRaises(SystemExit) as cm:
+                scality_manila_utils.cli.main([
+                    self._interface, 'revoke', '--if-match', 'abc', 'share',
+                    '10.0.0.1'
+                ])
+        self.assertEqual(FingerprintMismatchException.EXIT_CODE,
+                         cm.exception.code)
+
     @mock.patch('scality_manila_utils.cli.drop_privileges')
     @mock.patch('os.getuid', return_value=0)
     def test_invoke_wipe(self, getuid, drop_privileges):
@@ -215,6 +306,36 @@ class TestSMBCli(_BaseTestCLI):
         # Command line defaults
         self.root_export = '/ring/fs'
 
+    @mock.patch('scality_manila_utils.cli.drop_privileges')
+    @mock.patch('os.getuid', return_value=0)
+    def test_collapse_hosts_option(self, getuid, drop_privileges):
+        scality_manila_utils.cli.main(['smb', '--collapse-hosts', 'grant',
+                                       'share', '10.0.0.1'])
+
+        self.helper.set_collapse_hosts.assert_called_once_with(True)
+        self.helper.grant_access.assert_called_once_with(
+            root_export=self.root_export,
+            export_name='share',
+            host='10.0.0.1',
+            if_match=None
+        )
+
+    @mock.patch('scality_manila_utils.cli.drop_privileges')
+    @mock.patch('os.getuid', return_value=0)
+    def test_invoke_batch(self, getuid, drop_privileges):
+        self.helper.batch_access.__name__ = 'batch_access'
+        requests = [['share1', '10.0.0.1', 'grant'],
+                    ['share2', '10.0.0.2', 'revoke']]
+        with tempfile.NamedTemporaryFile(mode='wt') as f:
+            json.dump(requests, f)
+            f.flush()
+            scality_manila_utils.cli.main(['smb', 'batch', f.name])
+
+        self.helper.batch_access.assert_called_once_with(
+            root_export=self.root_export,
+            requests=requests
+        )
+
 
 class TestNFSCli(_BaseTestCLI):
 
@@ -228,3 +349,41 @@ class TestNFSCli(_BaseTestCLI):
         # Command line defaults
         self.root_export = '127.0.0.1:/'
         self.exports_path = '/etc/exports.conf'
+
+    @mock.patch('scality_manila_utils.cli.drop_privileges')
+    @mock.patch('os.getuid', return_value=0)
+    def test_invoke_grant_journal(self, getuid, drop_privileges):
+        args = ['nfs', 'grant', '--journal', 'share', '10.0.0.1', 'rw']
+        scality_manila_utils.cli.main(args)
+
+        self.helper.grant_access.assert_called_once_with(
+            root_export=self.root_export,
+            exports_file=self.exports_path,
+            export_name='share',
+            host='10.0.0.1',
+            options=['rw'],
+            journal=True,
+            if_match=None
+        )
+
+    @mock.patch('scality_manila_utils.cli.drop_privileges')
+    @mock.patch('os.getuid', return_value=0)
+    def test_invoke_reload(self, getuid, drop_privileges):
+        self.helper.reload_exports.__name__ = 'reload_exports'
+        scality_manila_utils.cli.main(['nfs', 'reload'])
+
+        self.helper.reload_exports.assert_called_once_with(
+            root_export=self.root_export,
+            exports_file=self.exports_path
+        )
+
+    @mock.patch('scality_manila_utils.cli.drop_privileges')
+    @mock.patch('os.getuid', return_value=0)
+    def test_invoke_validate(self, getuid, drop_privileges):
+        self.helper.validate_exports.__name__ = 'validate_exports'
+        scality_manila_utils.cli.main(['nfs', 'validate'])
+
+        self.helper.validate_exports.assert_called_once_with(
+            root_export=self.root_export,
+            exports_file=self.exports_path
+        )
@@ -21,9 +21,11 @@ except ImportError:
     pass
 
 import sys
+import time
 import unittest2 as unittest
 
-from scality_manila_utils.export import Export, ExportTable
+from scality_manila_utils.export import (Export, ExportTable,
+                                         NO_CLIENTS_FINGERPRINT, validate)
 from scality_manila_utils.exceptions import (DeserializationException,
                                              ExportException)
 
@@ -224,6 +226,22 @@ class TestExportSerialization(unittest.TestCase):
         for line, expected_export in zip(export_lines, expected_exports):
             self.assertEqual(Export.deserialize(line), expected_export)
 
+    def test_export_serialization_is_canonical(self):
+        options = ['no_root_squash', 'sync', 'rw', 'anonuid']
+        clients = [('db.local', options), ('10.0.0.0/24', ['ro']),
+                   ('*.internal', [])]
+
+        expected = '{0:<32s}  {1:s}'.format(
+            '/filesystem',
+            '*.internal 10.0.0.0/24(ro) '
+            'db.local(rw,sync,anonuid,no_root_squash)'
+        )
+        for order in (clients, list(reversed(clients))):
+            export = Export('/filesystem', dict(
+                (host, frozenset(opts)) for host, opts in order
+            ))
+            self.assertEqual(expected, export.serialize())
+
     def test_export_creation(self):
         export_point = '/'
         host = '192.168.0.0/24'
@@ -238,6 +256,31 @@ class TestExportSerialization(unittest.TestCase):
         with self.assertRaises(ExportException):
             Export(export_point, {})
 
+    def test_export_serialization_cache(self):
+        export = Export('/fs', {'10.0.0.2': frozenset(['rw'])})
+        self.assertEqual(['/fs', '10.0.0.2(rw)'], export.serialize().split())
+
+        # Changes through the export keep the sorted clients up to date
+        export.set_client('10.0.0.1', ['ro'])
+        export.set_client('10.0.0.3', [])
+        export.set_client('10.0.0.2', ['sync', 'rw'])
+        self.assertEqual(['10.0.0.1(ro)', '10.0.0.2(rw,sync)', '10.0.0.3'],
+                         export.serialize().split()[1:])
+        export.remove_client('10.0.0.1')
+        self.assertEqual(['10.0.0.2(rw,sync)', '10.0.0.3'],
+                         export.serialize().split()[1:])
+
+        # Direct changes to the clients invalidate the sorted clients
+        export.clients['10.0.0.0'] = frozenset(['ro'])
+        del export.clients['10.0.0.3']
+        self.assertEqual(['10.0.0.0(ro)', '10.0.0.2(rw,sync)'],
+                         export.serialize().split()[1:])
+        export.clients = {'10.0.0.9': frozenset()}
+        self.assertEqual(['10.0.0.9'], export.serialize().split()[1:])
+
+        with self.assertRaises(ExportException):
+            export.remove_client('10.0.0.9')
+
 
 class TestExportTable(unittest.TestCase):
     @unittest.skipIf(sys.version_info < (2, 7),
@@ -284,6 +327,70 @@ class TestExportTable(unittest.TestCase):
         export_table = ExportTable.deserialize(export_lines)
         self.assertEqual(expected_export_table, export_table)
 
+    def test_export_table_serialization_is_canonical(self):
+        export_table = ExportTable.deserialize([
+            '/p2 10.0.0.2(rw)',
+            '/p3 10.0.0.3(rw)',
+            '/p1 10.0.0.1(rw)',
+        ])
+        expected = ''.join(
+            '{0:<32s}  {1:s}\n'.format(export_point, client)
+            for export_point, client in (('/p1', '10.0.0.1(rw)'),
+                                         ('/p2', '10.0.0.2(rw)'),
+                                         ('/p3', '10.0.0.3(rw)'))
+        )
+        self.assertEqual(expected, export_table.serialize())
+
+        # The order is kept up to date through additions and removals
+        export_table.add_client('/p0', '10.0.0.0')
+        export_table.add_client('/p25', '10.0.0.25')
+        export_table.remove_client('/p2', '10.0.0.2')
+        self.assertEqual(['/p0', '/p1', '/p25', '/p3'], [
+            line.split()[0]
+            for line in export_table.serialize().splitlines()
+        ])
+        self.assertEqual(export_table._sorted_points,
+                         sorted(export_table.exports))
+
+        # Direct changes to the exports invalidate the order
+        del export_table.exports['/p0']
+        export_table.exports['/p4'] = Export('/p4', {'10.0.0.4': frozenset()})
+        self.assertEqual(['/p1', '/p25', '/p3', '/p4'], [
+            line.split()[0]
+            for line in export_table.serialize().splitlines()
+        ])
+        export_table.exports.update({
+            '/p12': Export('/p12', {'10.0.0.12': frozenset()}),
+        })
+        self.assertEqual(['/p1', '/p12', '/p25', '/p3', '/p4'], [
+            line.split()[0]
+            for line in export_table.serialize().splitlines()
+        ])
+        export_table.exports = {}
+        self.assertEqual('\n', export_table.serialize())
+
+    def test_export_fingerprint(self):
+        export_table = ExportTable.deserialize([
+            '/p1 10.0.0.1(rw,sync) 10.0.0.2(ro)',
+            '/p2 10.0.0.3(rw)',
+        ])
+        reordered = ExportTable.deserialize([
+            '/p2 10.0.0.3(rw)',
+            '/p1 10.0.0.2(ro) 10.0.0.1(sync,rw)',
+        ])
+        self.assertEqual(export_table.fingerprint(), reordered.fingerprint())
+        self.assertEqual(export_table.export_fingerprint('/p1'),
+                         reordered.export_fingerprint('/p1'))
+        self.assertEqual(NO_CLIENTS_FINGERPRINT,
+                         export_table.export_fingerprint('/p3'))
+
+        # Changing an export only changes its own fingerprint
+        p2 = export_table.export_fingerprint('/p2')
+        p1 = export_table.export_fingerprint('/p1')
+        export_table.add_client('/p1', '10.0.0.4', ['rw'])
+        self.assertNotEqual(p1, export_table.export_fingerprint('/p1'))
+        self.assertEqual(p2, export_table.export_fingerprint('/p2'))
+
     def test_empty_after_add_and_remove(self):
         export_point = '/data'
         host = 'db.local'
@@ -352,3 +459,140 @@ class TestExportTable(unittest.TestCase):
         # Removing it again should fail
         with self.assertRaises(ExportException):
             export_table.remove_client(export_point, host)
+
+
+class TestExportValidation(unittest.TestCase):
+    def assertErrors(self, expected, export_lines):
+        report = validate(export_lines)
+        errors = [(error['error'], error['line']) for error in
+                  report['errors']]
+        self.assertEqual(expected, errors)
+        self.assertEqual(not expected, report['valid'])
+
+    def test_valid(self):
+        export_lines = [
+            '# comment',
+            '',
+            '/p1     10.0.0.1(rw,sync) 10.0.0.2(rw) # trailing comment',
+            '/p2     10.0.0.0/24(ro) 192.168.1.0/24 host.local(rw)',
+            '/p3\tdb1 db2 *.internal',
+        ]
+        report = validate(export_lines)
+        self.assertEqual({
+            'valid': True,
+            'exports': 3,
+            'clients': 8,
+            'errors': [],
+        }, report)
+
+    def test_invalid_line(self):
+        self.assertErrors([('invalid_line', 1), ('invalid_line', 2)], [
+            '/p1',
+            '/p2 10.0.0.1(rw',
+        ])
+
+        # Lines that can't be deserialized are never valid
+        export_lines = [
+            '/a (rw)',
+            '/a h()',
+            '/a host-name(rw)',
+            '/a Host(rw)',
+        ]
+        for line in export_lines:
+            self.assertRaises(DeserializationException,
+                              ExportTable.deserialize, [line])
+            self.assertErrors([('invalid_line', 1)], [line])
+
+    def test_duplicate_export(self):
+        self.assertErrors([('duplicate_export', 3)], [
+            '/p1 10.0.0.1',
+            '/p2 10.0.0.1',
+            '/p1 10.0.0.2',
+        ])
+
+    def test_duplicate_client(self):
+        self.assertErrors([
+            ('duplicate_client', 1),
+            ('duplicate_client', 2),
+            ('duplicate_client', 3),
+        ], [
+            '/p1 10.0.0.1(rw) 10.0.0.1(ro)',
+            '/p2 10.0.0.1 10.0.0.1/32',
+            '/p3 10.0.0.0/24 10.0.0.7/24',
+        ])
+
+        # Whole lines of networks and of names are keyed as client by client
+        self.assertErrors([
+            ('duplicate_client', 1),
+            ('duplicate_client', 2),
+            ('duplicate_client', 3),
+        ], [
+            '/p1 10.0.0.1/32(rw) 10.0.0.2/32(rw) 10.0.0.1(rw)',
+            '/p2 10.0.0.0/24 10.0.1.0/24 10.0.0.128/24',
+            '/p3 db1.local db2.local db1.local',
+        ])
+        self.assertErrors([], [
+            '/p1 10.0.0.0/24 10.0.0.0/25 10.0.0.0 10.0.0.1/32',
+        ])
+
+    def test_invalid_host(self):
+        self.assertErrors([
+            ('invalid_host', 1),
+            ('invalid_host', 2),
+            ('invalid_host', 3),
+            ('invalid_host', 4),
+        ], [
+            '/p1 10.0.0.256',
+            '/p2 10.0.0.0/33',
+            '/p3 10.0.0/8',
+            '/p4 10.0.0.1 10.1',
+        ])
+
+        # Host names ending with digits are not addresses
+        self.assertErrors([], ['/p1 node1 node2.rack10'])
+
+    def test_conflicting_options(self):
+        self.assertErrors([
+            ('conflicting_options', 1),
+            ('conflicting_options', 2),
+            ('conflicting_options', 2),
+        ], [
+            '/p1 10.0.0.1(rw,ro) 10.0.0.2(rw)',
+            '/p2 host(sync,root_squash,async,no_root_squash)',
+        ])
+
+    def test_large_table(self):
+        export_lines = [
+            '/export{0:d} {1:s}'.format(export, ' '.join(
+                '10.{0:d}.{1:d}.{2:d}(rw,sync)'.format(export // 256,
+                                                       export % 256, client)
+                for client in range(1, 101)
+            ))
+            for export in range(1000)
+        ]
+
+        start = time.time()
+        report = validate(export_lines)
+        elapsed = time.time() - start
+
+        self.assertTrue(report['valid'])
+        self.assertEqual(100000, report['clients'])
+        self.assertLess(elapsed, 1)
+
+    def test_large_table_of_networks(self):
+        export_lines = [
+            '/export{0:d} {1:s}'.format(export, ' '.join(
+                '10.{0:d}.{1:d}.{2:d}/32(rw)'.format(export // 256,
+                                                     export % 256, client)
+                for client in range(250)
+            ))
+            for export in range(4000)
+        ]
+
+        start = time.time()
+        report = validate(export_lines)
+        elapsed = time.time() - start
+
+        self.assertTrue(report['valid'])
+        self.assertEqual(1000000, report['clients'])
+        self.assertLess(elapsed, 1)
@@ -0,0 +1,168 @@
+# Copyright (c) 2015 Scality
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import shutil
+import tempfile
+import unittest2 as unittest
+
+import mock
+
+from scality_manila_utils import utils
+from scality_manila_utils.exceptions import FingerprintMismatchException
+from scality_manila_utils.export import Export, ExportTable
+from scality_manila_utils.fragments import ExportFragments
+
+
+class TestExportFragments(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        exports_file = os.path.join(self.directory, 'exports.conf')
+        self.fragments = ExportFragments.for_exports(exports_file)
+
+    def test_enabled(self):
+        self.assertFalse(self.fragments.enabled())
+        os.mkdir(self.fragments.directory)
+        self.assertTrue(self.fragments.enabled())
+        self.assertFalse(self.fragments.initialized())
+
+    def test_read_write(self):
+        os.mkdir(self.fragments.directory)
+        export = Export('/some/share', {'10.0.0.1': frozenset(['rw'])})
+
+        self.assertIsNone(self.fragments.read('/some/share'))
+        self.fragments.write('/some/share', export)
+        self.assertEqual(export, self.fragments.read('/some/share'))
+        self.assertEqual(['%2Fsome%2Fshare'],
+                         os.listdir(self.fragments.directory))
+
+        self.fragments.write('/some/share', None)
+        self.assertIsNone(self.fragments.read('/some/share'))
+        self.assertEqual([], os.listdir(self.fragments.directory))
+
+    def test_split_and_assemble(self):
+        os.mkdir(self.fragments.directory)
+        exports = ExportTable([
+            Export('/p1', {'10.0.0.1': frozenset(['rw'])}),
+            Export('/p2', {'10.0.0.2': frozenset(['ro'])}),
+        ])
+        self.fragments.split(exports)
+
+        self.assertEqual(exports, ExportTable.deserialize(
+            self.fragments.assemble().splitlines()))
+        self.assertTrue(self.fragments.initialized())
+
+        # Exports missing from the table have their fragment removed
+        del exports.exports['/p1']
+        self.fragments.split(exports)
+        self.assertEqual(exports, ExportTable.deserialize(
+            self.fragments.assemble().splitlines()))
+
+    def test_split_keeps_newer_fragments(self):
+        os.mkdir(self.fragments.directory)
+        seen = ExportTable([
+            Export('/p1', {'h1': frozenset()}),
+            Export('/p2', {'h2': frozenset()}),
+        ])
+        self.fragments.split(seen)
+
+        # Fragments changed since the table was read
+        self.fragments.write('/p1', Export('/p1', {'h3': frozenset()}))
+        self.fragments.write('/p3', Export('/p3', {'h4': frozenset()}))
+
+        exports = ExportTable.deserialize(seen.serialize().splitlines())
+        exports.add_client('/p2', 'h5')
+        changes = self.fragments.split(exports, seen)
+        self.assertEqual(['/p2'], list(changes))
+        self.assertEqual(
+            ExportTable([
+                Export('/p1', {'h3': frozenset()}),
+                Export('/p2', {'h2': frozenset(), 'h5': frozenset()}),
+                Export('/p3', {'h4': frozenset()}),
+            ]),
+            ExportTable.deserialize(self.fragments.assemble().splitlines())
+        )
+
+        # The changes can be undone
+        self.fragments.restore(changes)
+        self.assertEqual(seen['/p2'], self.fragments.read('/p2'))
+
+        # An export changed both in the table and in its fragment
+        exports.add_client('/p1', 'h6')
+        self.assertRaises(FingerprintMismatchException, self.fragments.split,
+                          exports, seen)
+        self.assertEqual(Export('/p1', {'h3': frozenset()}),
+                         self.fragments.read('/p1'))
+        self.assertEqual(seen['/p2'], self.fragments.read('/p2'))
+
+    def test_split_and_commit(self):
+        os.mkdir(self.fragments.directory)
+        seen = ExportTable([
+            Export('/p1', {'h1': frozenset()}),
+            Export('/p2', {'h2': frozenset()}),
+        ])
+        self.fragments.split(seen)
+        self.fragments.assemble()
+
+        exports = ExportTable.deserialize(seen.serialize().splitlines())
+        exports.add_client('/p2', 'h3')
+        del exports.exports['/p1']
+        commit = mock.Mock(side_effect=lambda serialized, files: (
+            utils.commit_files(files)))
+        self.fragments.split(exports, seen, commit=commit)
+
+        # The changed fragments and the cache are committed with the
+        # assembled exports, removed fragments are already gone
+        serialized, files = commit.call_args[0]
+        self.assertEqual(exports, ExportTable.deserialize(
+            serialized.splitlines()))
+        self.assertEqual(['%2Fp2', ExportFragments.CACHE],
+                         [os.path.basename(f[0]) for f in files])
+        self.assertEqual(0o600, files[1][2])
+        self.assertIsNone(self.fragments.read('/p1'))
+        self.assertEqual(serialized, self.fragments.assemble())
+
+        # Fragments are put back if the commit fails
+        commit.side_effect = EnvironmentError
+        self.assertRaises(EnvironmentError, self.fragments.split, seen,
+                          exports, commit=commit)
+        self.assertEqual(exports, ExportTable.deserialize(
+            self.fragments.assemble().splitlines()))
+
+    def test_assemble_uses_cache(self):
+        os.mkdir(self.fragments.directory)
+        self.fragments.write('/p1', Export('/p1', {'h1': frozenset()}))
+        self.fragments.write('/p2', Export('/p2', {'h2': frozenset()}))
+        self.fragments.assemble()
+
+        # Only the fragment that changed is read again
+        self.fragments.write('/p2', Export('/p2', {'h3': frozenset()}))
+        with mock.patch('io.open', wraps=io.open) as io_open:
+            assembled = self.fragments.assemble()
+
+        opened = [c[0][0] for c in io_open.call_args_list]
+        self.assertIn(os.path.join(self.fragments.directory, '%2Fp2'),
+                      opened)
+        self.assertNotIn(os.path.join(self.fragments.directory, '%2Fp1'),
+                         opened)
+        self.assertEqual(
+            ExportTable([
+                Export('/p1', {'h1': frozenset()}),
+                Export('/p2', {'h3': frozenset()}),
+            ]),
+            ExportTable.deserialize(assembled.splitlines())
+        )
@@ -0,0 +1,105 @@
+# Copyright (c) 2015 Scality
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest2 as unittest
+
+import mock
+
+from scality_manila_utils.export import Export, ExportTable
+from scality_manila_utils.exceptions import DeserializationException
+from scality_manila_utils.journal import ExportJournal
+
+
+class TestExportJournal(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        exports_file = os.path.join(self.directory, 'exports.conf')
+        self.journal = ExportJournal.for_exports(exports_file)
+
+    def test_for_exports(self):
+        self.assertEqual(self.journal.path,
+                         os.path.join(self.directory, 'exports.conf.journal'))
+
+    def test_replay(self):
+        exports = ExportTable([
+            Export('/p1', {'10.0.0.1': frozenset(['rw'])}),
+            Export('/p2', {'10.0.0.2': frozenset(['rw'])}),
+        ])
+
+        # Replaying a missing journal leaves the exports untouched
+        self.assertEqual(0, self.journal.replay(exports))
+
+        with mock.patch('os.fsync') as fsync:
+            self.journal.add_client('/p1', '10.0.0.3', ['ro', 'sync'])
+            self.journal.remove_client('/p2', '10.0.0.2')
+            self.journal.add_client('/p3', 'db.local')
+            # A single fsync per record
+            self.assertEqual(3, fsync.call_count)
+
+        expected = ExportTable([
+            Export('/p1', {'10.0.0.1': frozenset(['rw']),
+                           '10.0.0.3': frozenset(['ro', 'sync'])}),
+            Export('/p3', {'db.local': frozenset()}),
+        ])
+        self.assertEqual(3, self.journal.replay(exports))
+        self.assertEqual(expected, exports)
+
+        # Records already in the exports can be replayed again
+        self.journal.replay(exports)
+        self.assertEqual(expected, exports)
+
+    def test_replay_updates_options(self):
+        exports = ExportTable([
+            Export('/p1', {'10.0.0.1': frozenset(['rw'])}),
+        ])
+        self.journal.remove_client('/p1', '10.0.0.1')
+        self.journal.add_client('/p1', '10.0.0.1', ['ro'])
+
+        self.journal.replay(exports)
+        self.assertEqual(
+            ExportTable([Export('/p1', {'10.0.0.1': frozenset(['ro'])})]),
+            exports
+        )
+
+    def test_replay_invalid(self):
+        with io.open(self.journal.path, 'wt') as f:
+            f.write(u'*\t0\t/p1\n')
+
+        with self.assertRaises(DeserializationException):
+            self.journal.replay(ExportTable([]))
+
+    def test_needs_compaction(self):
+        self.assertFalse(self.journal.needs_compaction(1024, 60))
+
+        self.journal.add_client('/p1', '10.0.0.1', ['rw'])
+        self.assertFalse(self.journal.needs_compaction(1024, 60))
+        self.assertTrue(self.journal.needs_compaction(10, 60))
+
+        with mock.patch('time.time', return_value=time.time() + 120):
+            self.assertTrue(self.journal.needs_compaction(1024, 60))
+
+    def test_discard(self):
+        self.journal.add_client('/p1', '10.0.0.1')
+        self.journal.discard()
+        self.assertFalse(os.path.exists(self.journal.path))
+
+        # Discarding twice is fine
+        self.journal.discard()
@@ -13,11 +13,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import errno
 import io
+import json
 import os
 import shutil
 import signal
 import tempfile
+import threading
+import time
 import unittest2 as unittest
 
 import mock
@@ -28,6 +32,9 @@ from scality_manila_utils.exceptions import (EnvironmentException,
                                              ExportException,
                                              ExportNotFoundException,
                                              ExportHasGrantsException,
+                                             ExportReloadException,
+                                             FingerprintMismatchException,
+                                             ClientExistsException,
                                              ClientNotFoundException)
 
 
@@ -55,6 +62,9 @@ class TestNFSHelper(unittest.TestCase):
     def tearDown(self):
         os.unlink(self.exports_file)
         shutil.rmtree(self.nfs_root)
+        lock_file = self.exports_file + '.lock'
+        if os.path.exists(lock_file):
+            os.unlink(lock_file)
 
     def test_verify_environment(self):
         with mock.patch('scality_manila_utils.utils.binary_check') as bc:
@@ -346,6 +356,393 @@ class TestNFSHelper(unittest.TestCase):
         with io.open(self.exports_file) as f:
             self.assertEqual(f.read(), expected_exports)
 
+    @mock.patch('scality_manila_utils.nfs_helper.verify_environment')
+    @mock.patch('scality_manila_utils.nfs_helper._reexport')
+    def test_grant_and_revoke_journal(self, reexport, verify_environment):
+        export_name = 'test'
+        export_point = os.path.join('/', export_name)
+        nfs_helper.add_export(self.root_export, export_name,
+                              exports_file=self.exports_file)
+        journal = nfs_helper.ExportJournal.for_exports(self.exports_file)
+        self.addCleanup(journal.discard)
+
+        nfs_helper.grant_access(self.root_export, self.exports_file,
+                                export_name, '10.0.0.1', ['rw'], journal=True)
+        nfs_helper.grant_access(self.root_export, self.exports_file,
+                                export_name, '10.0.0.2', None, journal=True)
+        nfs_helper.revoke_access(self.root_export, self.exports_file,
+                                 export_name, '10.0.0.1', journal=True)
+
+        # The exports file is left as is, changes only go to the journal
+        self.assertEqual(0, reexport.call_count)
+        self.assertEqual(os.path.getsize(self.exports_file), 0)
+        self.assertEqual(
+            nfs_helper._get_defined_exports(self.exports_file),
+            ExportTable([
+                Export(export_point, {'10.0.0.2': frozenset()}),
+            ])
+        )
+
+        # Past the size threshold, the journal is compacted
+        with mock.patch('scality_manila_utils.nfs_helper.JOURNAL_MAX_SIZE',
+                        0):
+            nfs_helper.grant_access(self.root_export, self.exports_file,
+                                    export_name, '10.0.0.3', None,
+                                    journal=True)
+        reexport.assert_called_once_with(
+            self.exports_file,
+            ExportTable([
+                Export(export_point, {'10.0.0.2': frozenset(),
+                                      '10.0.0.3': frozenset()}),
+            ])
+        )
+
+    @mock.patch('scality_manila_utils.nfs_helper.verify_environment')
+    @mock.patch('scality_manila_utils.nfs_helper._reexport')
+    def test_get_compacts_due_journal(self, reexport, verify_environment):
+        export_name = 'test'
+        export_point = os.path.join('/', export_name)
+        nfs_helper.add_export(self.root_export, export_name,
+                              exports_file=self.exports_file)
+        journal = nfs_helper.ExportJournal.for_exports(self.exports_file)
+        self.addCleanup(journal.discard)
+        nfs_helper.grant_access(self.root_export, self.exports_file,
+                                export_name, '10.0.0.1', ['rw'], journal=True)
+
+        # A recent journal is left for a later change
+        nfs_helper.get_export(self.root_export, self.exports_file,
+                              export_name)
+        self.assertEqual(0, reexport.call_count)
+
+        # Past the age threshold, reading compacts it
+        with mock.patch('scality_manila_utils.nfs_helper.JOURNAL_MAX_AGE',
+                        0):
+            clients = json.loads(nfs_helper.get_export(
+                self.root_export, self.exports_file, export_name))
+        self.assertEqual({'10.0.0.1': ['rw']}, clients)
+        reexport.assert_called_once_with(
+            self.exports_file,
+            ExportTable([
+                Export(export_point, {'10.0.0.1': frozenset(['rw'])}),
+            ])
+        )
+
+    @mock.patch('scality_manila_utils.nfs_helper.verify_environment')
+    @mock.patch('scality_manila_utils.nfs_helper._reexport')
+    def test_conditional_grant_and_revoke(self, reexport, verify_environment):
+        export_name = 'test'
+        nfs_helper.add_export(self.root_export, export_name,
+                              exports_file=self.exports_file)
+
+        get = json.loads(nfs_helper.get_export(
+            self.root_export, self.exports_file, export_name,
+            fingerprint=True
+        ))
+        self.assertEqual({}, get['clients'])
+
+        fingerprint = nfs_helper.grant_access(
+            self.root_export, self.exports_file, export_name, '10.0.0.1',
+            ['rw'], if_match=get['fingerprint']
+        )
+        self.assertNotEqual(get['fingerprint'], fingerprint)
+        self.assertEqual(1, reexport.call_count)
+
+        # A stale fingerprint is refused, and nothing gets written
+        granted = reexport.call_args[0][1]
+        with mock.patch('scality_manila_utils.nfs_helper._get_defined_exports',
+                        return_value=granted):
+            with self.assertRaises(FingerprintMismatchException):
+                nfs_helper.grant_access(
+                    self.root_export, self.exports_file, export_name,
+                    '10.0.0.2', ['rw'], if_match=get['fingerprint']
+                )
+            with self.assertRaises(FingerprintMismatchException):
+                nfs_helper.revoke_access(
+                    self.root_export, self.exports_file, export_name,
+                    '10.0.0.1', if_match=get['fingerprint']
+                )
+            self.assertEqual(1, reexport.call_count)
+
+            # Revoking the only client gets back to the initial fingerprint
+            revoked = nfs_helper.revoke_access(
+                self.root_export, self.exports_file, export_name,
+                '10.0.0.1', if_match=fingerprint
+            )
+        self.assertEqual(get['fingerprint'], revoked)
+
+    @mock.patch('scality_manila_utils.utils.find_pids', return_value=[100])
+    @mock.patch('os.kill')
+    @mock.patch('scality_manila_utils.nfs_helper.verify_environment')
+    def test_reload_exports(self, verify_environment, kill, find_pids):
+        journal = nfs_helper.ExportJournal.for_exports(self.exports_file)
+        journal.add_client('/test_export', '10.0.0.1', ['rw'])
+
+        nfs_helper.reload_exports(root_export=self.root_export,
+                                  exports_file=self.exports_file)
+
+        kill.assert_called_once_with(100, signal.SIGHUP)
+        self.assertFalse(os.path.exists(journal.path))
+        expected_exports = '/test_export                      10.0.0.1(rw)\n'
+        with io.open(self.exports_file) as f:
+            self.assertEqual(f.read(), expected_exports)
+
+    @mock.patch('scality_manila_utils.utils.find_pids', return_value=[100])
+    @mock.patch('os.kill')
+    @mock.patch('scality_manila_utils.nfs_helper.verify_environment')
+    def test_grant_and_revoke_fragments(self, verify_environment, kill,
+                                        find_pids):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        exports_file = os.path.join(directory, 'exports.conf')
+        with io.open(exports_file, 'wt') as f:
+            f.write(u'/legacy 10.0.0.9(rw)\n')
+        os.mkdir(os.path.join(directory, 'exports.d'))
+
+        for export_name in ('e1', 'e2'):
+            nfs_helper.add_export(self.root_export, export_name,
+                                  exports_file=exports_file)
+
+        nfs_helper.grant_access(self.root_export, exports_file, 'e1',
+                                '10.0.0.1', ['rw'])
+        nfs_helper.grant_access(self.root_export, exports_file, 'e2',
+                                '10.0.0.2', ['ro'])
+        nfs_helper.revoke_access(self.root_export, exports_file, 'e1',
+                                 '10.0.0.1')
+
+        # Existing exports are split on first use
+        fragment_names = [
+            name for name in os.listdir(os.path.join(directory, 'exports.d'))
+            if not name.startswith('.')
+        ]
+        self.assertEqual(sorted(fragment_names), ['%2Fe2', '%2Flegacy'])
+        self.assertEqual(
+            nfs_helper._get_defined_exports(exports_file),
+            ExportTable([
+                Export('/legacy', {'10.0.0.9': frozenset(['rw'])}),
+                Export('/e2', {'10.0.0.2': frozenset(['ro'])}),
+            ])
+        )
+
+        # A failed reload puts the fragment back
+        kill.side_effect = OSError(errno.EPERM, 'Operation not permitted')
+        with self.assertRaises(ExportReloadException):
+            nfs_helper.grant_access(self.root_export, exports_file, 'e2',
+                                    '10.0.0.3', None)
+        fragments = nfs_helper.ExportFragments.for_exports(exports_file)
+        self.assertEqual(Export('/e2', {'10.0.0.2': frozenset(['ro'])}),
+                         fragments.read('/e2'))
+
+    @mock.patch('scality_manila_utils.utils.find_pids', return_value=[100])
+    @mock.patch('os.kill')
+    @mock.patch('scality_manila_utils.nfs_helper.verify_environment')
+    def test_fragment_change_during_transaction(self, verify_environment,
+                                                kill, find_pids):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        exports_file = os.path.join(directory, 'exports.conf')
+        io.open(exports_file, 'wt').close()
+        os.mkdir(os.path.join(directory, 'exports.d'))
+        for export_name in ('a', 'b'):
+            nfs_helper.add_export(self.root_export, export_name,
+                                  exports_file=exports_file)
+        nfs_helper.grant_access(self.root_export, exports_file, 'a',
+                                '10.0.0.1', ['rw'])
+
+        # A grant through the fragments, while a transaction holds the
+        # exports it read
+        transaction = nfs_helper.ExportsTransaction(exports_file).begin()
+        transaction.add_client('/a', '10.0.0.2', ['rw'])
+        grant = threading.Thread(
+            target=nfs_helper.grant_access,
+            args=(self.root_export, exports_file, 'b', '10.0.0.9', ['rw'])
+        )
+        grant.start()
+        time.sleep(0.1)
+
+        # The fragment is changed without waiting for the exports lock
+        fragments = nfs_helper.ExportFragments.for_exports(exports_file)
+        self.assertEqual(Export('/b', {'10.0.0.9': frozenset(['rw'])}),
+                         fragments.read('/b'))
+        transaction.commit()
+        grant.join()
+
+        expected = ExportTable([
+            Export('/a', {'10.0.0.1': frozenset(['rw']),
+                          '10.0.0.2': frozenset(['rw'])}),
+            Export('/b', {'10.0.0.9': frozenset(['rw'])}),
+        ])
+        self.assertEqual(expected,
+                         nfs_helper._get_defined_exports(exports_file))
+        self.assertEqual(expected['/b'], fragments.read('/b'))
+
+        # Both changing the same export fails the transaction
+        transaction = nfs_helper.ExportsTransaction(exports_file).begin()
+        transaction.add_client('/a', '10.0.0.3', ['rw'])
+        grant = threading.Thread(
+            target=nfs_helper.grant_access,
+            args=(self.root_export, exports_file, 'a', '10.0.0.4', ['rw'])
+        )
+        grant.start()
+        time.sleep(0.1)
+        self.assertRaises(FingerprintMismatchException, transaction.commit)
+        grant.join()
+
+        self.assertEqual(
+            Export('/a', {'10.0.0.1': frozenset(['rw']),
+                          '10.0.0.2': frozenset(['rw']),
+                          '10.0.0.4': frozenset(['rw'])}),
+            nfs_helper._get_defined_exports(exports_file)['/a'])
+
+    @mock.patch('scality_manila_utils.utils.find_pids',
+                return_value=[100, 200])
+    @mock.patch('os.kill')
+    def test_reexport_rollback(self, kill, find_pids):
+        previous_exports = '/old_export                       10.0.0.2(ro)\n'
+        with io.open(self.exports_file, 'wt') as f:
+            f.write(previous_exports)
+        previous_inode = os.stat(self.exports_file).st_ino
+
+        # The second sfused can't be signaled
+        def kill_mock(pid, sig):
+            if pid == 200:
+                raise OSError(errno.EPERM, 'Operation not permitted')
+        kill.side_effect = kill_mock
+
+        with self.assertRaises(ExportReloadException):
+            nfs_helper._reexport(
+                self.exports_file,
+                ExportTable([
+                    Export(
+                        export_point='/test_export',
+                        clients={'10.0.0.1': frozenset(['rw'])},
+                    )
+                ])
+            )
+
+        # The previous file is renamed back in place, not rewritten
+        self.assertEqual(os.stat(self.exports_file).st_ino, previous_inode)
+        with io.open(self.exports_file) as f:
+            self.assertEqual(f.read(), previous_exports)
+        self.assertFalse(os.path.exists(self.exports_file + '.bak'))
+
+        # The sfused that got the new exports is asked to reload again
+        kill.assert_has_calls((
+            mock.call(100, signal.SIGHUP),
+            mock.call(200, signal.SIGHUP),
+            mock.call(100, signal.SIGHUP),
+        ))
+
+    @mock.patch('scality_manila_utils.utils.find_pids',
+                return_value=[100, 200])
+    @mock.patch('os.kill')
+    def test_reexport_exited_sfused(self, kill, find_pids):
+        # The second sfused is gone by the time it is signaled, it reads the
+        # new exports when restarted
+        def kill_mock(pid, sig):
+            if pid == 200:
+                raise OSError(errno.ESRCH, 'No such process')
+        kill.side_effect = kill_mock
+
+        exports = ExportTable([
+            Export(export_point='/test_export',
+                   clients={'10.0.0.1': frozenset(['rw'])})
+        ])
+        nfs_helper._reexport(self.exports_file, exports)
+
+        with io.open(self.exports_file) as f:
+            self.assertEqual(f.read(), exports.serialize())
+        self.assertFalse(os.path.exists(self.exports_file + '.bak'))
+        self.assertEqual(2, kill.call_count)
+
+    @mock.patch('scality_manila_utils.utils.find_pids', return_value=[100])
+    @mock.patch('os.kill')
+    def test_reexport_removes_backup(self, kill, find_pids):
+        with io.open(self.exports_file, 'wt') as f:
+            f.write(u'/old_export 10.0.0.2(ro)\n')
+
+        nfs_helper._reexport(self.exports_file, ExportTable([]))
+
+        kill.assert_called_once_with(100, signal.SIGHUP)
+        self.assertFalse(os.path.exists(self.exports_file + '.bak'))
+        with io.open(self.exports_file) as f:
+            self.assertEqual(f.read(), '\n')
+
+    @mock.patch('scality_manila_utils.nfs_helper._reexport')
+    def test_transaction(self, reexport):
+        exports = ExportTable([
+            Export(
+                export_point='/export1',
+                clients={'10.0.0.1': frozenset(['rw'])}
+            ),
+        ])
+
+        with mock.patch('scality_manila_utils.nfs_helper._get_defined_exports',
+                        return_value=exports):
+            transaction = nfs_helper.ExportsTransaction(self.exports_file)
+
+            # Operations are only allowed once the transaction has begun
+            with self.assertRaises(ExportException):
+                transaction.add_client('/export2', '10.0.0.2')
+
+            transaction.begin()
+            transaction.add_client('/export2', '10.0.0.2', ['ro'])
+            transaction.remove_client('/export1', '10.0.0.1')
+            with self.assertRaises(ClientExistsException):
+                transaction.add_client('/export2', '10.0.0.2')
+            self.assertEqual(0, reexport.call_count)
+
+            transaction.commit()
+
+        # All the operations are written and reloaded at once
+        reexport.assert_called_once_with(
+            self.exports_file,
+            ExportTable([
+                Export(
+                    export_point='/export2',
+                    clients={'10.0.0.2': frozenset(['ro'])}
+                ),
+            ])
+        )
+
+    @mock.patch('scality_manila_utils.nfs_helper._reexport')
+    def test_transaction_context(self, reexport):
+        with mock.patch('scality_manila_utils.nfs_helper._get_defined_exports',
+                        side_effect=lambda exports_file: ExportTable([])):
+            # Nothing to reload on an empty transaction
+            with nfs_helper.ExportsTransaction(self.exports_file):
+                pass
+            self.assertEqual(0, reexport.call_count)
+
+            # An error within the context aborts the transaction
+            with self.assertRaises(ClientNotFoundException):
+                with nfs_helper.ExportsTransaction(self.exports_file) as txn:
+                    txn.add_client('/export', '10.0.0.1')
+                    txn.remove_client('/export', '10.0.0.2')
+            self.assertEqual(0, reexport.call_count)
+
+            with nfs_helper.ExportsTransaction(self.exports_file) as txn:
+                txn.add_client('/export', '10.0.0.1')
+            reexport.assert_called_once_with(
+                self.exports_file,
+                ExportTable([
+                    Export(
+                        export_point='/export',
+                        clients={'10.0.0.1': frozenset()}
+                    ),
+                ])
+            )
+
+    def test_validate_exports(self):
+        with io.open(self.exports_file, 'wt') as f:
+            f.write(u'/p1 10.0.0.1(rw)\n/p1 10.0.0.2(rw,ro)\n')
+
+        report = json.loads(nfs_helper.validate_exports(self.exports_file))
+        self.assertFalse(report['valid'])
+        self.assertEqual(
+            ['duplicate_export', 'conflicting_options'],
+            [error['error'] for error in report['errors']]
+        )
+
     @mock.patch('scality_manila_utils.nfs_helper.verify_environment')
     def test_get_export(self, verify_environment):
         export = 'export'
@@ -14,20 +14,28 @@
 # limitations under the License.
 
 import errno
+import io
 import json
 import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest2 as unittest
 
 import mock
 
-from scality_manila_utils import smb_helper
+from scality_manila_utils import smb_helper, utils
 from scality_manila_utils.exceptions import (ClientExistsException,
                                              ClientNotFoundException,
+                                             CommandTimeoutException,
+                                             DeserializationException,
                                              EnvironmentException,
-                                             ExportAlreadyExists,
                                              ExportException,
                                              ExportNotFoundException,
-                                             ExportHasGrantsException)
+                                             ExportHasGrantsException,
+                                             FingerprintMismatchException)
+from test.fake import fake_net_environment
 
 
 class BaseTestSMBHelper(unittest.TestCase):
@@ -41,6 +49,21 @@ class BaseTestSMBHelper(unittest.TestCase):
         self.addCleanup(elevated_privileges_patcher.stop)
         self.elevated_privileges_mock = elevated_privileges_patcher.start()
 
+        # No registry database unless a test creates it
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.registry_tdb = os.path.join(directory, 'registry.tdb')
+        self.grants_dir = os.path.join(directory, 'grants')
+        for name, path in (('REGISTRY_TDB', self.registry_tdb),
+                           ('REGISTRY_CACHE_FILE',
+                            os.path.join(directory, 'registry.json')),
+                           ('SMB_GRANTS_DIR', self.grants_dir),
+                           ('SMB_LOCK_DIR', os.path.join(directory, 'locks'))):
+            patcher = mock.patch.object(smb_helper, name, path)
+            self.addCleanup(patcher.stop)
+            patcher.start()
+        self.addCleanup(smb_helper.set_collapse_hosts, False)
+
 
 class TestSMBHelper(BaseTestSMBHelper):
 
@@ -91,15 +114,16 @@ class TestSMBHelper(BaseTestSMBHelper):
 
             mock_open.assert_called_once_with('/etc/samba/smb.conf')
 
-    @mock.patch('scality_manila_utils.utils.execute')
-    def test_get_defined_exports(self, mock_execute):
+    @mock.patch('scality_manila_utils.utils.execute_lines')
+    def test_get_defined_exports(self, mock_execute_lines):
         output = (u'[share1]\n\tpath = share1\n\tguest ok = yes\n'
                   u'[share2]\n\tpath = share2\n\tguest ok = yes\n')
-        mock_execute.return_value = output, ""
+        mock_execute_lines.return_value = iter(output.splitlines())
 
         exports = smb_helper._get_defined_exports()
 
-        mock_execute.assert_called_once_with(['net', 'conf', 'list'], mock.ANY)
+        mock_execute_lines.assert_called_once_with(['net', 'conf', 'list'],
+                                                   mock.ANY)
 
         for share in ('share1', 'share2'):
             self.assertTrue(share in exports)
@@ -117,34 +141,159 @@ class TestSMBHelper(BaseTestSMBHelper):
 
         self.elevated_privileges_mock.assert_called_once_with()
 
+    @mock.patch('scality_manila_utils.utils.run_many')
+    def test_set_hosts_allow_many(self, mock_run_many):
+        mock_run_many.side_effect = lambda cmds: [
+            utils.CommandResult(cmds[0], 0, b'', b'', None),
+            utils.CommandResult(cmds[1], 255, b'', b'no such share', None),
+            utils.CommandResult(cmds[2], None, b'', b'',
+                                CommandTimeoutException('net timed out')),
+        ]
+
+        errors = smb_helper._set_hosts_allow_many([('share1', ['net1']),
+                                                   ('share2', ['net2']),
+                                                   ('share3', ['net3'])])
+
+        mock_run_many.assert_called_once_with([
+            ['net', 'conf', 'setparm', name, 'hosts allow', hosts]
+            for name, hosts in (('share1', 'net1'), ('share2', 'net2'),
+                                ('share3', 'net3'))])
+        self.assertEqual(['share2', 'share3'], sorted(errors))
+        self.assertIsInstance(errors['share2'], EnvironmentError)
+        self.assertIn('no such share', str(errors['share2']))
+        self.assertIsInstance(errors['share3'], CommandTimeoutException)
+        self.elevated_privileges_mock.assert_called_once_with()
+
+    @unittest.skipIf(smb_helper.ipaddress is None, 'requires ipaddress')
+    def test_collapse_hosts(self):
+        hosts = ['10.0.0.{0:d}'.format(i) for i in range(256)]
+        hosts.extend(['host.example.com', '192.168.0.1', '10.0.1.0/24',
+                      '::1', '10.0.0.7'])
+
+        self.assertEqual(['host.example.com', '10.0.0.0/23', '192.168.0.1',
+                          '::1'], smb_helper.collapse_hosts(hosts))
+        self.assertEqual([], smb_helper.collapse_hosts([]))
+
+    @unittest.skipIf(smb_helper.ipaddress is None, 'requires ipaddress')
+    @mock.patch('scality_manila_utils.utils.execute')
+    def test_set_hosts_allow_collapsed(self, mock_execute):
+        smb_helper.set_collapse_hosts(True)
+        hosts = ['127.0.0.1', '10.0.0.3', '10.0.0.2', '10.0.0.1', '10.0.0.0']
+        smb_helper._set_hosts_allow('share1', hosts)
+
+        cmd = ['net', 'conf', 'setparm', 'share1',
+               'hosts allow', '10.0.0.0/30 127.0.0.1']
+        mock_execute.assert_called_once_with(cmd, mock.ANY)
+
+        # The grants are only trusted along with the value they were
+        # written with
+        export = {'hosts allow': '10.0.0.0/30 127.0.0.1'}
+        self.assertEqual(hosts, smb_helper._get_grants('share1', export))
+        export = {'hosts allow': '127.0.0.1 10.0.0.0/30'}
+        self.assertEqual(['127.0.0.1', '10.0.0.0/30'],
+                         smb_helper._get_grants('share1', export))
+
+        # Writing them uncollapsed discards them
+        smb_helper.set_collapse_hosts(False)
+        smb_helper._set_hosts_allow('share1', hosts)
+        self.assertEqual([], os.listdir(self.grants_dir))
+
     def test_ensure_export_exists(self):
         export_name = 'share1'
-        exports = {export_name: None}
-        mock_get_exports = mock.Mock(return_value=exports)
+        export = {'path': '/share1'}
+        mock_get_export = mock.Mock(return_value=export)
 
         decorated_fn = mock.Mock(__name__='fake')
-        with mock.patch('scality_manila_utils.smb_helper._get_defined_exports',
-                        mock_get_exports):
+        with mock.patch('scality_manila_utils.smb_helper._get_defined_export',
+                        mock_get_export):
             wrapped = smb_helper.ensure_export_exists(decorated_fn)
             wrapped(export_name)
 
-        mock_get_exports.assert_called_once_with()
+        mock_get_export.assert_called_once_with(export_name)
         decorated_fn.assert_called_once_with(export_name=export_name,
-                                             exports=exports)
+                                             export=export)
 
     def test_ensure_export_exists_with_no_export(self):
-        exports = {'share1': None}
-        mock_get_exports = mock.Mock(return_value=exports)
+        mock_get_export = mock.Mock(return_value=None)
 
         decorated_fn = mock.Mock(__name__='fake')
-        with mock.patch('scality_manila_utils.smb_helper._get_defined_exports',
-                        mock_get_exports):
+        with mock.patch('scality_manila_utils.smb_helper._get_defined_export',
+                        mock_get_export):
             wrapped = smb_helper.ensure_export_exists(decorated_fn)
             self.assertRaises(ExportNotFoundException, wrapped, 'blah')
 
-        mock_get_exports.assert_called_once_with()
+        mock_get_export.assert_called_once_with('blah')
         self.assertEqual(0, decorated_fn.call_count)
 
+    @mock.patch('scality_manila_utils.utils.run')
+    @mock.patch('scality_manila_utils.utils.execute_lines')
+    def test_get_defined_export(self, mock_execute_lines, mock_run):
+        mock_run.return_value = (
+            0, b'[Share1]\n\tpath = /share1\n\thosts allow = net1\n', b'')
+
+        self.assertEqual({'path': '/share1', 'hosts allow': 'net1'},
+                         smb_helper._get_defined_export('share1'))
+        mock_run.assert_called_once_with(['net', 'conf', 'showshare',
+                                          'share1'])
+        self.assertEqual(0, mock_execute_lines.call_count)
+
+        # Only a failure to read the share involves listing the shares
+        mock_run.return_value = (255, b'', b'no such share')
+        mock_execute_lines.return_value = iter([u'share2'])
+        self.assertIsNone(smb_helper._get_defined_export('share1'))
+        mock_execute_lines.assert_called_once_with(
+            ['net', 'conf', 'listshares'], mock.ANY)
+
+        mock_execute_lines.return_value = iter([u'share1'])
+        self.assertRaises(EnvironmentError, smb_helper._get_defined_export,
+                          'share1')
+
+    @mock.patch('scality_manila_utils.utils.run')
+    @mock.patch('scality_manila_utils.utils.execute_lines')
+    def test_get_defined_export_from_snapshot(self, mock_execute_lines,
+                                              mock_run):
+        output = u'[share1]\n\tpath = /share1\n\thosts allow = net1\n'
+        mock_execute_lines.side_effect = lambda *args: iter(
+            output.splitlines())
+        mock_run.side_effect = lambda *args: (0, output.encode(), b'')
+        with io.open(self.registry_tdb, 'wb') as f:
+            f.write(b'registry')
+
+        # Without a snapshot, the share alone is read
+        for _ in range(2):
+            self.assertEqual({'path': '/share1', 'hosts allow': 'net1'},
+                             smb_helper._get_defined_export('share1'))
+        mock_run.assert_called_once_with(
+            ['net', 'conf', 'showshare', 'share1'])
+        self.assertEqual(0, mock_execute_lines.call_count)
+
+        # The registry is only dumped for another share, while it hasn't
+        # changed
+        for _ in range(2):
+            self.assertIsNone(smb_helper._get_defined_export('share2'))
+            self.assertEqual({'path': '/share1', 'hosts allow': 'net1'},
+                             smb_helper._get_defined_export('share1'))
+        mock_execute_lines.assert_called_once_with(['net', 'conf', 'list'],
+                                                   mock.ANY)
+        self.assertEqual(1, mock_run.call_count)
+
+        # A change of the registry database reads the share alone again
+        output = u'[share2]\n\tpath = /share2\n'
+        with io.open(self.registry_tdb, 'ab') as f:
+            f.write(b'change')
+        for _ in range(2):
+            self.assertEqual({'path': '/share2'},
+                             smb_helper._get_defined_export('share2'))
+        self.assertEqual(2, mock_run.call_count)
+        self.assertEqual(1, mock_execute_lines.call_count)
+
+        # As does a write from this tool
+        with mock.patch('scality_manila_utils.utils.execute'):
+            smb_helper._set_hosts_allow('share2', ['net2'])
+        smb_helper._get_defined_export('share2')
+        self.assertEqual(3, mock_run.call_count)
+        self.assertEqual(1, mock_execute_lines.call_count)
+
 
 class TestSMBHelperWithMockedVerifyEnv(BaseTestSMBHelper):
 
@@ -158,12 +307,14 @@ class TestSMBHelperWithMockedVerifyEnv(BaseTestSMBHelper):
         self.mock_verify_environment = verify_environment_patcher.start()
 
     def patch_defined_exports(self, defined_exports):
-        get_defined_export_patcher = mock.patch(
-            'scality_manila_utils.smb_helper._get_defined_exports',
-            return_value=defined_exports
-        )
-        self.addCleanup(get_defined_export_patcher.stop)
-        return get_defined_export_patcher.start()
+        # Shares are read the same way from the snapshot and the registry
+        mock_get_defined_export = mock.Mock(side_effect=defined_exports.get)
+        for name in ('_get_defined_export', '_show_share'):
+            patcher = mock.patch.object(smb_helper, name,
+                                        mock_get_defined_export)
+            self.addCleanup(patcher.stop)
+            patcher.start()
+        return mock_get_defined_export
 
     def test_get_export(self):
         exports = {'share1': {'hosts allow': '127.0.0.1 10.0.0.0/8'}}
@@ -177,7 +328,7 @@ class TestSMBHelperWithMockedVerifyEnv(BaseTestSMBHelper):
         expected = {"10.0.0.0/8": ["rw"], "127.0.0.1": ["rw"]}
         self.assertEqual(expected, json.loads(export))
 
-        mock_get_defined_exports.assert_called_once_with()
+        mock_get_defined_exports.assert_called_once_with('share1')
         self.mock_verify_environment.assert_called_once_with(self.root_export)
 
     def test_add_export_with_wrong_export_name(self):
@@ -187,33 +338,149 @@ class TestSMBHelperWithMockedVerifyEnv(BaseTestSMBHelper):
         self.assertRaises(ExportException, smb_helper.add_export,
                           export_name='sla/sh', root_export=self.root_export)
 
+        self.assertRaises(ExportException, smb_helper.add_export,
+                          export_name='[global]',
+                          root_export=self.root_export)
+
+    def test_import_share(self):
+        definitions = []
+
+        def check_call(cmd):
+            with io.open(cmd[3], 'rt') as f:
+                definitions.append(f.read())
+
+        with mock.patch('scality_manila_utils.utils.check_call',
+                        side_effect=check_call) as mock_check_call:
+            smb_helper._import_share('test', [('path', '/ring/fs/test'),
+                                              ('hosts allow', '127.0.0.1')])
+
+        mock_check_call.assert_called_once_with(
+            ['net', 'conf', 'import', mock.ANY, 'test'])
+        self.assertEqual(
+            [u'[test]\n\tpath = /ring/fs/test\n\thosts allow = 127.0.0.1\n'],
+            definitions
+        )
+        # The definition does not outlive the import
+        self.assertFalse(os.path.exists(mock_check_call.call_args[0][0][3]))
+
     @mock.patch('os.mkdir')
     @mock.patch('os.chmod')
-    @mock.patch('subprocess.check_call')
-    def test_add_export(self, mock_check_call, mock_chmod, mock_mkdir):
+    @mock.patch('scality_manila_utils.smb_helper._share_lock')
+    @mock.patch('scality_manila_utils.utils.check_call')
+    def test_add_export(self, mock_check_call, mock_share_lock, mock_chmod,
+                        mock_mkdir):
+        mock_show_share = self.patch_defined_exports({})
+
         smb_helper.add_export(export_name='test', root_export=self.root_export)
 
         export_point = os.path.join(self.root_export, 'test')
 
         mock_mkdir.assert_called_once_with(export_point)
         mock_chmod.assert_called_once_with(export_point, 0o0777)
-        self.assertEqual(6, mock_check_call.call_count)
+        mock_share_lock.assert_called_once_with('test')
+        mock_show_share.assert_called_once_with('test')
+        mock_check_call.assert_called_once_with(
+            ['net', 'conf', 'import', mock.ANY, 'test'])
         self.elevated_privileges_mock.assert_called_once_with()
         self.mock_verify_environment.assert_called_once_with(self.root_export)
 
+    def _defined_share(self, **parameters):
+        share = {
+            # As stored by Samba, `writeable` being kept as `read only`
+            'path': os.path.join(self.root_export, 'share1'),
+            'guest ok': 'Yes',
+            'browseable': 'Yes',
+            'create mask': '0755',
+            'hosts deny': '0.0.0.0/0',
+            'hosts allow': '127.0.0.1 10.0.0.1',
+            'read only': 'No',
+        }
+        share.update(parameters)
+        return dict((param, value) for param, value in share.items()
+                    if value is not None)
+
+    @mock.patch('os.mkdir', side_effect=OSError(errno.EEXIST, ''))
+    @mock.patch('scality_manila_utils.smb_helper._share_lock')
+    @mock.patch('scality_manila_utils.utils.check_call')
+    @mock.patch('scality_manila_utils.utils.execute')
+    def test_add_export_when_export_already_exists(self, mock_execute,
+                                                   mock_check_call,
+                                                   mock_share_lock,
+                                                   mock_mkdir):
+        exports = {'share1': self._defined_share()}
+        mock_get_defined_export = self.patch_defined_exports(exports)
+
+        # Nothing to do for a share defined as expected
+        smb_helper.add_export(export_name='share1',
+                              root_export=self.root_export)
+
+        mock_get_defined_export.assert_called_once_with('share1')
+        self.assertEqual(0, mock_execute.call_count)
+        self.assertEqual(0, mock_check_call.call_count)
+        self.mock_verify_environment.assert_called_once_with(self.root_export)
+
+        # Only the parameters that drifted are written, and the grants are
+        # kept
+        exports['share1'] = self._defined_share(**{'create mask': '0700',
+                                                   'read only': 'Yes'})
+        smb_helper.add_export(export_name='share1',
+                              root_export=self.root_export)
+
+        mock_execute.assert_has_calls([
+            mock.call(['net', 'conf', 'setparm', 'share1', 'create mask',
+                       '0755'], mock.ANY),
+            mock.call(['net', 'conf', 'setparm', 'share1', 'read only',
+                       'no'], mock.ANY),
+        ], any_order=True)
+        self.assertEqual(2, mock_execute.call_count)
+        self.assertEqual(0, mock_check_call.call_count)
+
+        # `hosts allow` is only written when missing
+        mock_execute.reset_mock()
+        exports['share1'] = self._defined_share(**{'hosts allow': None})
+        smb_helper.add_export(export_name='share1',
+                              root_export=self.root_export)
+
+        mock_execute.assert_called_once_with(
+            ['net', 'conf', 'setparm', 'share1', 'hosts allow', '127.0.0.1'],
+            mock.ANY)
+
     @mock.patch('os.mkdir')
-    def test_add_export_when_export_already_exists(self, mock_mkdir):
-        mock_mkdir.side_effect = OSError(errno.EEXIST, '')
+    @mock.patch('os.chmod')
+    @mock.patch('scality_manila_utils.smb_helper._share_lock')
+    @mock.patch('scality_manila_utils.utils.check_call')
+    @mock.patch('scality_manila_utils.utils.execute')
+    def test_add_export_when_directory_is_missing(self, mock_execute,
+                                                  mock_check_call,
+                                                  mock_share_lock,
+                                                  mock_chmod, mock_mkdir):
+        # The share is still defined, e.g. the directory was removed by hand
+        exports = {'share1': self._defined_share(**{'create mask': '0700'})}
+        self.patch_defined_exports(exports)
+
+        smb_helper.add_export(export_name='share1',
+                              root_export=self.root_export)
+
+        export_point = os.path.join(self.root_export, 'share1')
+        mock_mkdir.assert_called_once_with(export_point)
+        mock_execute.assert_called_once_with(
+            ['net', 'conf', 'setparm', 'share1', 'create mask', '0755'],
+            mock.ANY)
+        self.assertEqual(0, mock_check_call.call_count)
 
-        exports = {'share1': None}
-        mock_get_defined_exports = self.patch_defined_exports(exports)
+    @mock.patch('os.mkdir', side_effect=OSError(errno.EEXIST, ''))
+    @mock.patch('scality_manila_utils.smb_helper._share_lock')
+    @mock.patch('scality_manila_utils.utils.check_call')
+    def test_add_export_after_interrupted_add(self, mock_check_call,
+                                              mock_share_lock, mock_mkdir):
+        # The directory was created, but not the share
+        self.patch_defined_exports({})
 
-        self.assertRaises(ExportAlreadyExists, smb_helper.add_export,
-                          export_name='share1', root_export=self.root_export)
+        smb_helper.add_export(export_name='share1',
+                              root_export=self.root_export)
 
-        mock_get_defined_exports.assert_called_once_with()
-        self.mock_verify_environment.assert_called_once_with(self.root_export)
-        self.elevated_privileges_mock.assert_called_once_with()
+        mock_check_call.assert_called_once_with(
+            ['net', 'conf', 'import', mock.ANY, 'share1'])
 
     def test_wipe_export_when_export_has_grants(self):
         exports = {'share1': {'hosts allow': '127.0.0.1 10.0.0.0/8'}}
@@ -222,7 +489,26 @@ class TestSMBHelperWithMockedVerifyEnv(BaseTestSMBHelper):
         self.assertRaises(ExportHasGrantsException, smb_helper.wipe_export,
                           export_name='share1', root_export=self.root_export)
         self.mock_verify_environment.assert_called_once_with(self.root_export)
-        mock_get_defined_exports.assert_called_once_with()
+        mock_get_defined_exports.assert_called_once_with('share1')
+
+    @mock.patch('scality_manila_utils.utils.execute')
+    def test_wipe_export_reads_registry(self, mock_execute):
+        # A host granted since the snapshot was taken is not missed
+        mock_show_share = mock.Mock(return_value={
+            'hosts allow': '127.0.0.1 10.0.0.1',
+        })
+        with mock.patch.object(smb_helper, '_get_defined_export',
+                               return_value={'hosts allow': '127.0.0.1'}), \
+                mock.patch.object(smb_helper, '_show_share', mock_show_share):
+            self.assertRaises(ExportHasGrantsException,
+                              smb_helper.wipe_export, export_name='share1',
+                              root_export=self.root_export)
+        mock_show_share.assert_called_once_with('share1')
+        self.assertFalse(mock_execute.called)
+
+        self.patch_defined_exports({})
+        self.assertRaises(ExportNotFoundException, smb_helper.wipe_export,
+                          export_name='share1', root_export=self.root_export)
 
     @mock.patch('os.rename')
     @mock.patch('scality_manila_utils.utils.fsync_path')
@@ -249,8 +535,8 @@ class TestSMBHelperWithMockedVerifyEnv(BaseTestSMBHelper):
         mock_execute.assert_called_once_with(['net', 'conf', 'delshare',
                                               'share1'], mock.ANY)
 
-        mock_get_defined_exports.assert_called_once_with()
-        self.elevated_privileges_mock.assert_called_once_with()
+        mock_get_defined_exports.assert_called_once_with('share1')
+        self.elevated_privileges_mock.assert_called_with()
         self.mock_verify_environment.assert_called_once_with(self.root_export)
 
     def test_grant_access_when_host_already_allowed(self):
@@ -262,7 +548,7 @@ class TestSMBHelperWithMockedVerifyEnv(BaseTestSMBHelper):
                           root_export=self.root_export)
 
         self.mock_verify_environment.assert_called_once_with(self.root_export)
-        mock_get_defined_exports.assert_called_once_with()
+        mock_get_defined_exports.assert_called_once_with('share1')
 
     @mock.patch('scality_manila_utils.smb_helper._set_hosts_allow')
     def test_grant_access(self, mock_set_hosts_allow):
@@ -274,7 +560,218 @@ class TestSMBHelperWithMockedVerifyEnv(BaseTestSMBHelper):
 
         mock_set_hosts_allow.assert_called_once_with('share1', ['net1'])
         self.mock_verify_environment.assert_called_once_with(self.root_export)
-        mock_get_defined_exports.assert_called_once_with()
+        mock_get_defined_exports.assert_called_once_with('share1')
+
+    @mock.patch('scality_manila_utils.smb_helper._set_hosts_allow_many')
+    def test_batch_access(self, mock_set_hosts_allow):
+        mock_set_hosts_allow.return_value = {}
+        exports = {'share1': {'hosts allow': '127.0.0.1 net1'},
+                   'share2': {'hosts allow': '127.0.0.1'},
+                   'share3': {'hosts allow': '127.0.0.1'}}
+        mock_get_defined_export = self.patch_defined_exports(exports)
+        requests = [
+            ['share1', 'net2', 'grant'],
+            ['share1', 'net1', 'revoke'],
+            ['share1', 'net2', 'grant'],
+            ['share2', 'net1', 'revoke'],
+            ['share3', 'net1', 'grant'],
+            ['share3', 'net1', 'revoke'],
+            ['share4', 'net1', 'grant'],
+        ]
+
+        results = json.loads(smb_helper.batch_access(
+            root_export=self.root_export, requests=requests))
+
+        self.assertEqual([request[:3] for request in requests],
+                         [[result['export_name'], result['host'],
+                           result['action']] for result in results])
+        self.assertEqual(['ok', 'ok', None, None, 'ok', 'ok', None],
+                         [result.get('result') for result in results])
+        self.assertEqual([ClientExistsException.EXIT_CODE,
+                          ClientNotFoundException.EXIT_CODE,
+                          ExportNotFoundException.EXIT_CODE],
+                         [result['exit_code'] for result in results
+                          if 'error' in result])
+
+        # Each share is read once, and only the changed ones are written
+        self.assertEqual(4, mock_get_defined_export.call_count)
+        mock_set_hosts_allow.assert_called_once_with(
+            [('share1', ['127.0.0.1', 'net2'])])
+        self.mock_verify_environment.assert_called_once_with(self.root_export)
+
+    @mock.patch('scality_manila_utils.smb_helper._set_hosts_allow_many')
+    def test_batch_access_write_failure(self, mock_set_hosts_allow):
+        exports = {'share1': {'hosts allow': '127.0.0.1'},
+                   'share2': {'hosts allow': '127.0.0.1'}}
+        self.patch_defined_exports(exports)
+        mock_set_hosts_allow.return_value = {
+            'share1': EnvironmentError('failure'),
+        }
+
+        results = json.loads(smb_helper.batch_access(
+            root_export=self.root_export,
+            requests=[['share1', 'net1', 'grant'],
+                      ['share2', 'net1', 'grant']]))
+
+        self.assertEqual([(None, 'failure'), ('ok', None)],
+                         [(result.get('result'), result.get('error'))
+                          for result in results])
+        mock_set_hosts_allow.assert_called_once_with(
+            [('share1', ['127.0.0.1', 'net1']),
+             ('share2', ['127.0.0.1', 'net1'])])
+
+    @mock.patch('scality_manila_utils.smb_helper._set_hosts_allow_many')
+    def test_batch_access_read_failure(self, mock_set_hosts_allow):
+        mock_set_hosts_allow.return_value = {}
+        errors = {
+            'share1': CommandTimeoutException('net timed out'),
+            'share2': DeserializationException('invalid registry'),
+        }
+
+        def show_share(export_name):
+            if export_name in errors:
+                raise errors[export_name]
+            return {'hosts allow': '127.0.0.1'}
+
+        with mock.patch.object(smb_helper, '_show_share',
+                               side_effect=show_share):
+            results = json.loads(smb_helper.batch_access(
+                root_export=self.root_export,
+                requests=[['share1', 'net1', 'grant'],
+                          ['share2', 'net1', 'grant'],
+                          ['share3', 'net1', 'grant']]))
+
+        self.assertEqual([
+            ('net timed out', CommandTimeoutException.EXIT_CODE),
+            ('invalid registry', 1),
+            (None, None),
+        ], [(result.get('error'), result.get('exit_code'))
+            for result in results])
+        self.assertEqual('ok', results[2]['result'])
+        mock_set_hosts_allow.assert_called_once_with(
+            [('share3', ['127.0.0.1', 'net1'])])
+
+    @mock.patch('scality_manila_utils.smb_helper._set_hosts_allow_many')
+    def test_batch_access_invalid(self, mock_set_hosts_allow):
+        mock_get_defined_export = self.patch_defined_exports({})
+
+        for requests in ({}, [['share1', 'net1']],
+                         [['share1', 'net1', 'grant'], ['share1', 'net1']],
+                         [['share1', 'net1', 'allow']],
+                         [['share1', 'net1 net2', 'grant']],
+                         [['', 'net1', 'grant']],
+                         [['share1', 1, 'grant']]):
+            self.assertRaises(ExportException, smb_helper.batch_access,
+                              root_export=self.root_export,
+                              requests=requests)
+
+        # Nothing is read nor written for an invalid batch
+        self.assertEqual(0, mock_get_defined_export.call_count)
+        self.assertEqual(0, mock_set_hosts_allow.call_count)
+
+    @unittest.skipIf(smb_helper.ipaddress is None, 'requires ipaddress')
+    @mock.patch('scality_manila_utils.utils.execute')
+    def test_collapsed_grant_and_revoke(self, mock_execute):
+        exports = {'share1': {'hosts allow': '127.0.0.1'}}
+        self.patch_defined_exports(exports)
+
+        def setparm(cmd, msg):
+            exports[cmd[3]][cmd[4]] = cmd[5]
+        mock_execute.side_effect = setparm
+
+        smb_helper.set_collapse_hosts(True)
+        for host in ('10.0.0.1', '10.0.0.0', '10.0.0.2', '10.0.0.3'):
+            smb_helper.grant_access(export_name='share1', host=host,
+                                    root_export=self.root_export)
+        self.assertEqual('10.0.0.0/30 127.0.0.1',
+                         exports['share1']['hosts allow'])
+
+        # The original grants are answered, and revoked one by one
+        export = json.loads(smb_helper.get_export(
+            export_name='share1', root_export=self.root_export))
+        self.assertEqual(set(['127.0.0.1', '10.0.0.0', '10.0.0.1',
+                              '10.0.0.2', '10.0.0.3']), set(export))
+
+        smb_helper.revoke_access(export_name='share1', host='10.0.0.2',
+                                 root_export=self.root_export)
+        self.assertEqual('10.0.0.0/31 10.0.0.3 127.0.0.1',
+                         exports['share1']['hosts allow'])
+        self.assertRaises(ClientNotFoundException, smb_helper.revoke_access,
+                          export_name='share1', host='10.0.0.0/30',
+                          root_export=self.root_export)
+
+    @mock.patch('scality_manila_utils.utils.execute')
+    def test_concurrent_grants(self, mock_execute):
+        exports = {'share1': {'hosts allow': '127.0.0.1'}}
+
+        # Leave time for the writers to interleave between read and write
+        def show_share(export_name):
+            export = dict(exports[export_name])
+            time.sleep(0.001)
+            return export
+
+        def setparm(cmd, msg):
+            time.sleep(0.001)
+            exports[cmd[3]][cmd[4]] = cmd[5]
+
+        mock_execute.side_effect = setparm
+        patcher = mock.patch.object(smb_helper, '_show_share', show_share)
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+        hosts = ['10.0.0.{0:d}'.format(i) for i in range(50)]
+        errors = []
+
+        def grant(host):
+            try:
+                smb_helper.grant_access(export_name='share1', host=host,
+                                        root_export=self.root_export)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=grant, args=(host,))
+                   for host in hosts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([], errors)
+        self.assertEqual(sorted(['127.0.0.1'] + hosts),
+                         sorted(exports['share1']['hosts allow'].split()))
+        self.assertEqual(50, mock_execute.call_count)
+
+    @mock.patch('scality_manila_utils.smb_helper._set_hosts_allow')
+    def test_conditional_grant_and_revoke(self, mock_set_hosts_allow):
+        exports = {'share1': {'hosts allow': 'net2 net1'}}
+        self.patch_defined_exports(exports)
+
+        get = json.loads(smb_helper.get_export(export_name='share1',
+                                               fingerprint=True,
+                                               root_export=self.root_export))
+        self.assertEqual({'net1': ['rw'], 'net2': ['rw']}, get['clients'])
+
+        # The fingerprint does not depend on the order of the hosts
+        exports['share1']['hosts allow'] = 'net1 net2'
+        fingerprint = smb_helper.grant_access(export_name='share1',
+                                              host='net3',
+                                              if_match=get['fingerprint'],
+                                              root_export=self.root_export)
+        self.assertNotEqual(get['fingerprint'], fingerprint)
+        mock_set_hosts_allow.assert_called_once_with(
+            'share1', ['net1', 'net2', 'net3'])
+
+        exports['share1']['hosts allow'] = 'net1 net2 net3'
+        self.assertRaises(FingerprintMismatchException,
+                          smb_helper.revoke_access, export_name='share1',
+                          host='net3', if_match=get['fingerprint'],
+                          root_export=self.root_export)
+        self.assertEqual(1, mock_set_hosts_allow.call_count)
+
+        revoked = smb_helper.revoke_access(export_name='share1', host='net3',
+                                           if_match=fingerprint,
+                                           root_export=self.root_export)
+        self.assertEqual(get['fingerprint'], revoked)
 
     def test_revoke_access_when_client_not_found(self):
         exports = {'share1': {'hosts allow': ''}}
@@ -283,7 +780,7 @@ class TestSMBHelperWithMockedVerifyEnv(BaseTestSMBHelper):
         self.assertRaises(ClientNotFoundException, smb_helper.revoke_access,
                           export_name='share1', host='net1',
                           root_export=self.root_export)
-        mock_get_defined_exports.assert_called_once_with()
+        mock_get_defined_exports.assert_called_once_with('share1')
 
     @mock.patch('scality_manila_utils.smb_helper._set_hosts_allow')
     def test_revoke_access(self, mock_set_hosts_allow):
@@ -295,4 +792,96 @@ class TestSMBHelperWithMockedVerifyEnv(BaseTestSMBHelper):
 
         mock_set_hosts_allow.assert_called_once_with('share1', [])
         self.mock_verify_environment.assert_called_once_with(self.root_export)
-        mock_get_defined_exports.assert_called_once_with()
+        mock_get_defined_exports.assert_called_once_with('share1')
+
+
+class TestSMBHelperWithFakeNet(BaseTestSMBHelper):
+    """Run the helpers against the fake `net` and its registry."""
+
+    def setUp(self):
+        super(TestSMBHelperWithFakeNet, self).setUp()
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.root_export = os.path.join(directory, 'sofs')
+        os.mkdir(self.root_export)
+        registry = self.registry = os.path.join(directory, 'registry.json')
+
+        patchers = [
+            mock.patch.dict(os.environ, fake_net_environment(registry)),
+            mock.patch.object(utils, 'BINARY_CACHE_FILE',
+                              os.path.join(directory, 'binaries')),
+            mock.patch.dict(utils._binary_cache, clear=True),
+            mock.patch.object(smb_helper, 'verify_environment'),
+            # The snapshot follows the registry of the fake `net`
+            mock.patch.object(smb_helper, 'REGISTRY_TDB', registry),
+        ]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+            patcher.start()
+
+    def get_clients(self, export_name):
+        return json.loads(smb_helper.get_export(
+            export_name=export_name, root_export=self.root_export))
+
+    def test_share_lifecycle(self):
+        smb_helper.add_export(export_name='share1',
+                              root_export=self.root_export)
+        self.assertEqual({'127.0.0.1': ['rw']}, self.get_clients('share1'))
+        self.assertEqual(os.path.join(self.root_export, 'share1'),
+                         smb_helper._show_share('share1')['path'])
+
+        smb_helper.grant_access(export_name='share1', host='10.0.0.1',
+                                root_export=self.root_export)
+        self.assertRaises(ClientExistsException, smb_helper.grant_access,
+                          export_name='share1', host='10.0.0.1',
+                          root_export=self.root_export)
+        results = json.loads(smb_helper.batch_access(
+            root_export=self.root_export,
+            requests=[['share1', '10.0.0.2', 'grant'],
+                      ['share1', '10.0.0.1', 'revoke'],
+                      ['share2', '10.0.0.1', 'grant']]))
+        self.assertEqual(['ok', 'ok', None],
+                         [result.get('result') for result in results])
+        self.assertEqual({'127.0.0.1': ['rw'], '10.0.0.2': ['rw']},
+                         self.get_clients('share1'))
+
+        # Creating the share again keeps its grants
+        smb_helper.add_export(export_name='share1',
+                              root_export=self.root_export)
+        self.assertEqual({'127.0.0.1': ['rw'], '10.0.0.2': ['rw']},
+                         self.get_clients('share1'))
+
+        self.assertRaises(ExportHasGrantsException, smb_helper.wipe_export,
+                          export_name='share1', root_export=self.root_export)
+        smb_helper.revoke_access(export_name='share1', host='10.0.0.2',
+                                 root_export=self.root_export)
+        smb_helper.wipe_export(export_name='share1',
+                               root_export=self.root_export)
+
+        self.assertIsNone(smb_helper._get_defined_export('share1'))
+        self.assertIsNone(smb_helper._show_share('share1'))
+        self.assertRaises(ExportNotFoundException, smb_helper.get_export,
+                          export_name='share1', root_export=self.root_export)
+
+    def test_add_export_again(self):
+        smb_helper.add_export(export_name='share1',
+                              root_export=self.root_export)
+        share = smb_helper._show_share('share1')
+        self.assertEqual('no', share['read only'])
+        self.assertNotIn('writeable', share)
+
+        # The registry is replaced on every write, and a share defined as
+        # expected is left alone
+        inode = os.stat(self.registry).st_ino
+        smb_helper.add_export(export_name='share1',
+                              root_export=self.root_export)
+        self.assertEqual(inode, os.stat(self.registry).st_ino)
+
+        # Synonyms are stored as Samba does, whichever command sets them
+        utils.execute(['net', 'conf', 'setparm', 'share1', 'Write OK', 'no'],
+                      'setparm failed')
+        self.assertEqual('yes', smb_helper._show_share('share1')['read only'])
+        smb_helper.add_export(export_name='share1',
+                              root_export=self.root_export)
+        self.assertEqual('no', smb_helper._show_share('share1')['read only'])
@@ -0,0 +1,73 @@
+# Copyright (c) 2015 Scality
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest2 as unittest
+
+from scality_manila_utils import smbconf
+from scality_manila_utils.exceptions import DeserializationException
+
+
+class TestSmbConf(unittest.TestCase):
+    def test_parse(self):
+        lines = [
+            u'[global]',
+            u'\tworkgroup = WORKGROUP',
+            u'',
+            u'[share1]',
+            u'\tpath = /share1',
+            u'\tHosts Allow = 10.0.0.1 10.0.0.2',
+            u'\t# comment',
+            u'\tcomment = a = b',
+            u'[share2]',
+            u'\tpath = /share2',
+        ]
+
+        shares = smbconf.parse(lines)
+
+        self.assertEqual(shares, {
+            'global': {'workgroup': 'WORKGROUP'},
+            'share1': {'path': '/share1', 'hosts allow': '10.0.0.1 10.0.0.2',
+                       'comment': 'a = b'},
+            'share2': {'path': '/share2'},
+        })
+
+    def test_parse_defaults(self):
+        lines = [
+            u'[DEFAULT]',
+            u'\tguest ok = yes',
+            u'[share1]',
+            u'\tpath = /share1',
+            u'[share2]',
+            u'\tpath = /share2',
+            u'\tguest ok = no',
+        ]
+
+        shares = smbconf.parse(lines)
+
+        self.assertEqual(set(shares), set(['share1', 'share2']))
+        self.assertEqual(dict(shares['share1']),
+                         {'path': '/share1', 'guest ok': 'yes'})
+        self.assertEqual(dict(shares['share2']),
+                         {'path': '/share2', 'guest ok': 'no'})
+
+    def test_parse_empty(self):
+        self.assertEqual(smbconf.parse(iter([])), {})
+
+    def test_parse_invalid(self):
+        with self.assertRaises(DeserializationException):
+            smbconf.parse([u'\tpath = /share1'])
+
+        with self.assertRaises(DeserializationException):
+            smbconf.parse([u'[share1]', u'\tpath'])
@@ -20,15 +20,29 @@ import shutil
 import stat
 import subprocess
 import tempfile
+import time
 import unittest2 as unittest
 
 from scality_manila_utils import utils
-from scality_manila_utils.exceptions import EnvironmentException
+from scality_manila_utils.exceptions import (CommandTimeoutException,
+                                             EnvironmentException)
 
 
 class TestUtils(unittest.TestCase):
     def setUp(self):
         self.test_directories = []
+        self.addCleanup(utils.clear_process_cache)
+
+        # Keep the state files of the tests out of the way
+        state_dir = tempfile.mkdtemp()
+        self.test_directories.append(state_dir)
+        for name in ('PID_CACHE_FILE', 'BINARY_CACHE_FILE', 'ENV_CACHE_FILE',
+                     'MOUNT_CACHE_FILE'):
+            patcher = mock.patch('scality_manila_utils.utils.' + name,
+                                 os.path.join(state_dir, name.lower()))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(utils._binary_cache.clear)
 
     def tearDown(self):
         for directory in self.test_directories:
@@ -57,7 +71,8 @@ class TestUtils(unittest.TestCase):
         # Setup a directory to serve as /proc
         proc_path = tempfile.mkdtemp()
         self.test_directories.append(proc_path)
-        processes = ((10, 'p1'), (20, 'p2'), (30, 'p3'), (40, 'p4'))
+        processes = ((10, 'p1'), (20, 'p2'), (30, 'p3'), (40, 'p4'),
+                     (50, 'a-very-long-process-name'))
         for pid, process_name in processes:
             self._create_proc_entry(proc_path, pid, process_name)
 
@@ -66,30 +81,45 @@ class TestUtils(unittest.TestCase):
         for directory in non_processes:
             os.mkdir(os.path.join(proc_path, directory))
 
-        # Mocks for `os.listdir` and `os.path.join`
-        def listdir_mock(*args, **kwargs):
-            proc_listing = [str(pid) for pid, _ in processes]
-            proc_listing.extend(non_processes)
-            return proc_listing
+        with mock.patch('scality_manila_utils.utils.PROC_ROOT', proc_path):
+            for not_a_process in non_processes:
+                self.assertEqual(utils.find_pids(not_a_process), [])
 
-        def join_mock(procdir, pid, status):
-            return "/{proc:s}/{pid:s}/{status:s}".format(proc=proc_path,
-                                                         pid=pid,
-                                                         status=status)
+            for pid, process_name in processes:
+                self.assertEqual(utils.find_pids(process_name), [pid])
 
-        with mock.patch('os.listdir', side_effect=listdir_mock):
-            with mock.patch('os.path.join', side_effect=join_mock):
-                for not_a_process in non_processes:
-                    self.assertEqual(utils.find_pids(not_a_process), [])
-
-                for pid, process_name in processes:
-                    self.assertEqual(utils.find_pids(process_name), [pid])
+    def test_scan_processes(self):
+        proc_path = tempfile.mkdtemp()
+        self.test_directories.append(proc_path)
+        for pid, process_name in ((10, 'p1'), (20, 'p2'), (30, 'p1')):
+            self._create_proc_entry(proc_path, pid, process_name)
 
-    def _create_proc_entry(self, proc_path, pid, process_name):
+        with mock.patch('scality_manila_utils.utils.PROC_ROOT', proc_path):
+            with mock.patch('os.listdir', wraps=os.listdir) as listdir:
+                self.assertEqual(
+                    {'p1': [10, 30], 'p2': [20], 'p3': []},
+                    utils.scan_processes('p1', 'p2', 'p3')
+                )
+                # Processes already looked up are not searched again
+                self.assertEqual([20], utils.find_pids('p2'))
+                self.assertEqual([], utils.find_pids('p3'))
+                self.assertEqual(1, listdir.call_count)
+
+                utils.clear_process_cache()
+                self.assertEqual([10, 30], utils.find_pids('p1'))
+                self.assertEqual(2, listdir.call_count)
+
+    def _create_proc_entry(self, proc_path, pid, process_name,
+                           start_time=0):
         pid_path = os.path.join(proc_path, str(pid))
         os.mkdir(pid_path)
-        with io.open(os.path.join(pid_path, 'status'), 'wt') as f:
-            f.write(u'Name: {0:s}'.format(process_name))
+        name = process_name[:utils.TASK_COMM_LEN]
+        with io.open(os.path.join(pid_path, 'comm'), 'wt') as f:
+            f.write(u'{0:s}\n'.format(name))
+        # Fields 3 to 21 are not used
+        fields = ' '.join(['S'] + ['0'] * 18 + [str(start_time), '0'])
+        with io.open(os.path.join(pid_path, 'stat'), 'wt') as f:
+            f.write(u'{0:d} ({1:s}) {2:s}\n'.format(pid, name, fields))
 
     def test_binary_check(self):
         self.test_directories = [tempfile.mkdtemp(), tempfile.mkdtemp()]
@@ -103,22 +133,149 @@ class TestUtils(unittest.TestCase):
         # Put the expected binary in a test directory
         binary_path = os.path.join(self.test_directories[-1], binary_name)
         io.open(binary_path, 'wb').close()
+        # It has to be executable
+        with self.assertRaises(EnvironmentException):
+            utils.binary_check(binary_name, self.test_directories)
+        os.chmod(binary_path, 0o755)
         # Should be ok
         utils.binary_check(binary_name, self.test_directories)
 
-    @mock.patch('scality_manila_utils.utils.find_pids')
-    def test_process_check(self, find_pids):
-        find_pids.return_value = []
+    def test_which(self):
+        directories = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+        self.test_directories.extend(directories)
+        for directory in directories:
+            binary_path = os.path.join(directory, 'bin')
+            io.open(binary_path, 'wb').close()
+            os.chmod(binary_path, 0o755)
+
+        self.assertEqual(os.path.join(directories[0], 'bin'),
+                         utils.which('bin', directories))
+        self.assertIsNone(utils.which('nobin', directories))
+
+        # The binary found is only checked again, not searched for
+        with mock.patch('os.stat', wraps=os.stat) as mock_stat:
+            utils._binary_cache.clear()
+            utils.which('bin', directories)
+            mock_stat.assert_called_once_with(
+                os.path.join(directories[0], 'bin'))
+
+        # It is searched for again if it is gone
+        os.unlink(os.path.join(directories[0], 'bin'))
+        self.assertEqual(os.path.join(directories[1], 'bin'),
+                         utils.which('bin', directories))
+
+        binaries = {'ls': '/bin/ls'}
+        with mock.patch('scality_manila_utils.utils.which',
+                        side_effect=binaries.get):
+            self.assertEqual(['/bin/ls', '-l'],
+                             utils.resolve_command(['ls', '-l']))
+            self.assertEqual(['nobin', '-l'],
+                             utils.resolve_command(['nobin', '-l']))
+            self.assertEqual(['/usr/bin/ls'],
+                             utils.resolve_command(['/usr/bin/ls']))
+
+    def test_process_check(self):
+        proc_path = tempfile.mkdtemp()
+        self.test_directories.append(proc_path)
+        pidfile = os.path.join(proc_path, 'sfused.pid')
+        pid_cache = os.path.join(proc_path, 'pids')
         process_name = 'sfused'
 
+        patches = (
+            mock.patch('scality_manila_utils.utils.PROC_ROOT', proc_path),
+            mock.patch('scality_manila_utils.utils.PIDFILES',
+                       {process_name: (pidfile,)}),
+            mock.patch('scality_manila_utils.utils.PID_CACHE_FILE',
+                       pid_cache),
+            mock.patch('scality_manila_utils.utils.elevated_privileges'),
+            mock.patch('os.listdir', wraps=os.listdir),
+        )
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        listdir = os.listdir
+
         with self.assertRaises(EnvironmentException):
             utils.process_check(process_name)
+        self.assertEqual(1, listdir.call_count)
+
+        # The pidfile is stale, and its pid reused by another process
+        self._create_proc_entry(proc_path, 10, process_name, 1000)
+        self._create_proc_entry(proc_path, 20, 'other', 2000)
+        with io.open(pidfile, 'wt') as f:
+            f.write(u'20\n')
+        utils.clear_process_cache()
+        utils.process_check(process_name)
+        self.assertEqual(2, listdir.call_count)
 
-        find_pids.assert_called_once_with(process_name)
-        find_pids.reset_mock()
-        find_pids.return_value = [100]
+        # The pid found is checked first next time, without scanning
+        utils.clear_process_cache()
         utils.process_check(process_name)
-        find_pids.assert_called_once_with(process_name)
+        self.assertEqual(2, listdir.call_count)
+
+        # A restarted process is found through its pidfile
+        shutil.rmtree(os.path.join(proc_path, '10'))
+        self._create_proc_entry(proc_path, 30, process_name, 3000)
+        with io.open(pidfile, 'wt') as f:
+            f.write(u'30\n')
+        self.assertEqual(30, utils.find_running_pid(process_name))
+        self.assertEqual(2, listdir.call_count)
+
+    def test_process_identity(self):
+        proc_path = tempfile.mkdtemp()
+        self.test_directories.append(proc_path)
+        self._create_proc_entry(proc_path, 10, 'a) b (c', 1234)
+
+        with mock.patch('scality_manila_utils.utils.PROC_ROOT', proc_path):
+            self.assertEqual(('a) b (c', 1234), utils.process_identity(10))
+            self.assertIsNone(utils.process_identity(20))
+
+    @mock.patch('scality_manila_utils.utils.elevated_privileges')
+    def test_verify_once(self, elevated_privileges):
+        verify = mock.Mock()
+        dependencies = mock.Mock(return_value=['a', [1, 2]])
+
+        # Without a TTL, the environment is always verified
+        utils.verify_once('test', verify, dependencies)
+        utils.verify_once('test', verify, dependencies)
+        self.assertEqual(2, verify.call_count)
+        self.assertEqual(0, dependencies.call_count)
+
+        utils.configure_environment_checks(60)
+        self.addCleanup(utils.configure_environment_checks, 0)
+        verify.reset_mock()
+        utils.verify_once('test', verify, dependencies)
+        utils.verify_once('test', verify, dependencies)
+        self.assertEqual(1, verify.call_count)
+
+        # A failed verification is not saved
+        verify.side_effect = EnvironmentException
+        dependencies.return_value = ['b', [1, 2]]
+        for _ in range(2):
+            self.assertRaises(EnvironmentException, utils.verify_once,
+                              'test', verify, dependencies)
+        self.assertEqual(3, verify.call_count)
+
+        verify.side_effect = None
+        utils.verify_once('test', verify, dependencies)
+        utils.verify_once('test', verify, dependencies)
+        self.assertEqual(4, verify.call_count)
+
+        # Unknown dependencies, expiry and forced checks
+        dependencies.return_value = ['b', None]
+        utils.verify_once('test', verify, dependencies)
+        utils.verify_once('test', verify, dependencies)
+        self.assertEqual(6, verify.call_count)
+
+        dependencies.return_value = ['b', [1, 2]]
+        utils.verify_once('test', verify, dependencies)
+        with mock.patch('time.time', return_value=time.time() + 60):
+            utils.verify_once('test', verify, dependencies)
+        self.assertEqual(8, verify.call_count)
+
+        utils.configure_environment_checks(60, force=True)
+        utils.verify_once('test', verify, dependencies)
+        self.assertEqual(9, verify.call_count)
 
     def test_safe_write(self):
         testdir = tempfile.mkdtemp()
@@ -136,7 +293,46 @@ class TestUtils(unittest.TestCase):
         with io.open(test_file, 'rt') as f:
             self.assertEqual(f.read(), sometext)
 
-    @mock.patch('subprocess.check_call')
+    def test_commit_files(self):
+        directories = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+        self.test_directories.extend(directories)
+        files = [
+            (os.path.join(directories[0], 'a'), u'a'),
+            (os.path.join(directories[0], 'b'), u'b'),
+            (os.path.join(directories[1], 'c'), u'c'),
+        ]
+        self.addCleanup(utils.set_durability, 'strict')
+
+        # Flushes of each file, then of each directory
+        for level, fsyncs in (('strict', 6), ('batch', 5), ('relaxed', 0)):
+            utils.set_durability(level)
+            with mock.patch('os.fsync') as fsync:
+                utils.commit_files(files, 0o600)
+            self.assertEqual(fsyncs, fsync.call_count, level)
+
+            for path, text in files:
+                self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o600)
+                with io.open(path, 'rt') as f:
+                    self.assertEqual(text, f.read())
+
+        # Nothing is moved in place if a file can't be written
+        utils.set_durability('batch')
+        with mock.patch('os.chmod', side_effect=[None, OSError]):
+            self.assertRaises(OSError, utils.commit_files,
+                              [(path, u'new') for path, _ in files])
+        for path, text in files:
+            with io.open(path, 'rt') as f:
+                self.assertEqual(text, f.read())
+        self.assertEqual(['a', 'b'], sorted(os.listdir(directories[0])))
+
+        # Permissions may be given per file
+        utils.commit_files([files[0], files[1] + (0o640,)])
+        self.assertEqual([0o644, 0o640], [
+            stat.S_IMODE(os.stat(path).st_mode) for path, _ in files[:2]])
+
+        self.assertRaises(ValueError, utils.set_durability, 'none')
+
+    @mock.patch('scality_manila_utils.utils.check_call')
     def test_nfs_mount(self, check_call):
         export_path = '127.0.0.1:/'
         with utils.nfs_mount(export_path) as root:
@@ -163,6 +359,17 @@ class TestUtils(unittest.TestCase):
             self.assertFalse(os.path.exists(root))
             check_call.assert_called_once_with(['umount', root])
 
+        # The mount point is removed when mounting fails or times out
+        for error in (subprocess.CalledProcessError(32, 'mount'),
+                      CommandTimeoutException('mount timed out')):
+            check_call.reset_mock()
+            check_call.side_effect = error
+            with self.assertRaises(type(error)):
+                with utils.nfs_mount(export_path):
+                    self.fail('Mounted despite the failure')
+            mount_point = check_call.call_args[0][0][2]
+            self.assertFalse(os.path.exists(mount_point))
+
     def test_fsync_path(self):
         fd = 10
         path = '/'
@@ -177,59 +384,178 @@ class TestUtils(unittest.TestCase):
                     fsync.assert_called_once_with(fd)
                     osclose.assert_called_once_with(fd)
 
-    @mock.patch('os.seteuid', mock.Mock())
-    @mock.patch('os.setegid', mock.Mock())
     def test_is_stored_on_sofs(self):
-        header = (
-            'Filesystem     1024-blocks    Used Available Capacity Mounted on'
-        )
-        fuse_line = '/dev/fuse          4088408       0   4088408       0% /r'
-        bad_line = '/dev/sda1         20608636 1119716  18619320       6% /'
-
-        on_sofs = header + '\n' + fuse_line
-        with mock.patch('subprocess.check_output', return_value=on_sofs,
-                        autospec=True) as df:
-            path = '/r/some/share'
-            self.assertTrue(utils.is_stored_on_sofs(path))
-            df.assert_called_once_with(['df', '-P', path])
-
-        no_sofs = header + '\n' + bad_line
-        with mock.patch('subprocess.check_output', return_value=no_sofs,
-                        autospec=True) as df:
-            path = '/var/log'
-            self.assertFalse(utils.is_stored_on_sofs(path))
-            df.assert_called_once_with(['df', '-P', path])
-
-        side_effect = subprocess.CalledProcessError(None, None, None)
-        with mock.patch('subprocess.check_output',
-                        autospec=True, side_effect=side_effect) as df:
-            self.assertRaises(subprocess.CalledProcessError,
-                              utils.is_stored_on_sofs, path)
-            df.assert_called_once_with(['df', '-P', path])
-
-    @mock.patch('subprocess.Popen', autospec=True, spec_set=True)
-    def test_execute_when_cmd_failed(self, mock_popen):
-        type(mock_popen.return_value).returncode = mock.PropertyMock(
-            return_value=1)
-        mock_popen.return_value.communicate.return_value = (b'out', b'err')
-
-        cmd = ['cmd', 'arg1']
+        testdir = tempfile.mkdtemp()
+        self.test_directories.append(testdir)
+        mountinfo_path = os.path.join(testdir, 'mountinfo')
+        st_dev = os.stat(testdir).st_dev
+        device = '{0:d}:{1:d}'.format(os.major(st_dev), os.minor(st_dev))
+
+        def write_mountinfo(lines):
+            with io.open(mountinfo_path, 'wt') as f:
+                f.write(u''.join(line + u'\n' for line in lines))
+
+        # The most specific mount of the device is used, and the mount
+        # point may contain escaped characters
+        mount_point = testdir.replace(' ', '\\040')
+        write_mountinfo([
+            u'1 0 {0:s} / / rw - ext4 /dev/sda1 rw'.format(device),
+            u'2 1 {0:s} / {1:s} rw shared:1 - fuse /dev/fuse rw'.format(
+                device, mount_point),
+            u'3 1 0:99 / {0:s}/other rw - ext4 /dev/sdb1 rw'.format(
+                mount_point),
+        ])
+        utils._mount_cache.clear()
+        self.addCleanup(utils._mount_cache.clear)
+        with mock.patch('scality_manila_utils.utils.MOUNTINFO',
+                        mountinfo_path):
+            self.assertTrue(utils.is_stored_on_sofs(testdir))
+            with mock.patch('scality_manila_utils.utils._parse_mountinfo',
+                            side_effect=utils._parse_mountinfo) as parse:
+                # Unchanged mounts are not parsed again, including by the
+                # next commands
+                self.assertTrue(utils.is_stored_on_sofs(testdir))
+                utils._mount_cache.clear()
+                self.assertTrue(utils.is_stored_on_sofs(testdir))
+                self.assertEqual(0, parse.call_count)
+
+                write_mountinfo([
+                    u'1 0 {0:s} / / rw - ext4 /dev/sda1 rw'.format(device),
+                ])
+                self.assertFalse(utils.is_stored_on_sofs(testdir))
+                self.assertEqual(1, parse.call_count)
+
+    def test_execute_when_cmd_failed(self):
+        cmd = ['sh', '-c', 'echo out; echo err >&2; exit 1']
         try:
             utils.execute(cmd, "error: {stdout}, {stderr}")
         except EnvironmentError as exc:
-            self.assertEqual('error: out, err', exc.args[0])
+            self.assertEqual('error: out\n, err\n', exc.args[0])
         else:
             self.fail("Should have raised an EnvironmentError")
 
-        mock_popen.assert_called_once_with(cmd, stdout=-1, stderr=-1)
-
-    @mock.patch('subprocess.Popen', autospec=True, spec_set=True)
-    def test_execute_when_cmd_succeeded(self, mock_popen):
-        type(mock_popen.return_value).returncode = mock.PropertyMock(
-            return_value=0)
-        mock_popen.return_value.communicate.return_value = (b'out', b'err')
-
-        cmd = ['cmd', 'arg1']
-        self.assertEqual((u'out', u'err'), utils.execute(cmd, ""))
+        self.assertRaises(subprocess.CalledProcessError, utils.check_call,
+                          cmd)
+
+    def test_execute_when_cmd_succeeded(self):
+        cmd = ['sh', '-c', 'echo out; echo err >&2']
+        self.assertEqual((u'out\n', u'err\n'), utils.execute(cmd, ""))
+        utils.check_call(cmd)
+
+    def test_spawn(self):
+        for use_posix_spawn in set([False, utils.USE_POSIX_SPAWN]):
+            with mock.patch('scality_manila_utils.utils.USE_POSIX_SPAWN',
+                            use_posix_spawn):
+                self.assertEqual(
+                    (3, b'out\n', b''),
+                    utils.run(['sh', '-c', 'echo out; exit 3'])
+                )
+                self.assertEqual(
+                    -9, utils.run(['sh', '-c', 'kill -9 $$'])[0]
+                )
+                # The command runs in its own session
+                returncode, stdout, _ = utils.run(
+                    ['sh', '-c', 'cut -d" " -f6 /proc/$$/stat'])
+                self.assertNotEqual(os.getsid(0), int(stdout))
+                self.assertRaises(OSError, utils.run,
+                                  ['/no/such/binary'])
+
+    def test_execute_timeout(self):
+        testdir = tempfile.mkdtemp()
+        self.test_directories.append(testdir)
+        pid_path = os.path.join(testdir, 'pid')
+
+        # The whole process group is killed, not only the command
+        cmd = ['sh', '-c', 'sleep 30 & echo $! > {0:s}; wait'.format(
+            pid_path)]
+        start = time.time()
+        with self.assertRaises(CommandTimeoutException):
+            utils.execute(cmd, "", timeout=0.5)
+        self.assertLess(time.time() - start, 5)
+
+        with io.open(pid_path, 'rt') as f:
+            pid = int(f.read())
+        identity = utils.process_identity(pid)
+        if identity is not None:
+            # Not reaped yet
+            with io.open('/proc/{0:d}/stat'.format(pid), 'rt') as f:
+                self.assertEqual('Z', f.read().rsplit(')', 1)[1].split()[0])
+
+        # The deadline of the command applies to every call
+        utils.set_deadline(0)
+        self.addCleanup(utils.set_deadline, None)
+        self.assertRaises(CommandTimeoutException, utils.execute,
+                          ['true'], "")
+
+    def test_execute_lines(self):
+        cmd = ['sh', '-c', 'printf "a\\n\\nb\\303\\251\\nc"; echo err >&2']
+        self.assertEqual([u'a', u'', u'b\xe9', u'c'],
+                         list(utils.execute_lines(cmd, "")))
+
+        cmd = ['sh', '-c', 'echo out; echo err >&2; exit 1']
+        lines = utils.execute_lines(cmd, "error: {stdout}, {stderr}")
+        self.assertEqual(u'out', next(lines))
+        try:
+            next(lines)
+        except EnvironmentError as exc:
+            self.assertEqual('error: , err\n', exc.args[0])
+        else:
+            self.fail("Should have raised an EnvironmentError")
 
-        mock_popen.assert_called_once_with(cmd, stdout=-1, stderr=-1)
+        # Lines are not limited in number, only in length
+        cmd = ['seq', '1000']
+        with mock.patch('scality_manila_utils.utils.COMMAND_MAX_OUTPUT',
+                        16):
+            self.assertEqual(1000, len(list(utils.execute_lines(cmd, ""))))
+            cmd = ['sh', '-c', 'yes | tr -d "\\n"']
+            self.assertRaises(EnvironmentError, list,
+                              utils.execute_lines(cmd, ""))
+
+    def test_execute_lines_stopped(self):
+        # The command is killed when its output is no longer read
+        with mock.patch('scality_manila_utils.utils._kill_process_group',
+                        wraps=utils._kill_process_group) as kill:
+            lines = utils.execute_lines(['yes'], "")
+            self.assertEqual(u'y', next(lines))
+            lines.close()
+            self.assertEqual(1, kill.call_count)
+            process = kill.call_args[0][0]
+            self.assertIsNotNone(process.returncode)
+
+    def test_run_many(self):
+        cmds = [['sh', '-c', 'sleep 0.3; echo {0:d}'.format(i)]
+                for i in range(8)]
+        start = time.time()
+        results = utils.run_many(cmds, concurrency=8)
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(
+            [(cmd, 0, '{0:d}\n'.format(i).encode(), b'', None)
+             for i, cmd in enumerate(cmds)],
+            results
+        )
+        self.assertTrue(all(result.succeeded for result in results))
+
+        # Concurrency is limited
+        start = time.time()
+        utils.run_many(cmds[:4], concurrency=2)
+        self.assertGreaterEqual(time.time() - start, 0.6)
+
+        # Failures are reported along with the other results
+        cmds = [['sh', '-c', 'echo err >&2; exit 2'], ['sleep', '30'],
+                ['/no/such/binary'], ['true']]
+        start = time.time()
+        results = utils.run_many(cmds, timeout=0.5)
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(2, results[0].returncode)
+        self.assertEqual(b'err\n', results[0].stderr)
+        self.assertIsInstance(results[1].error, CommandTimeoutException)
+        self.assertIsInstance(results[2].error, OSError)
+        self.assertEqual([False, False, False, True],
+                         [result.succeeded for result in results])
+
+    def test_execute_output_limit(self):
+        cmd = ['sh', '-c', 'yes | head -c 4096']
+        with mock.patch('scality_manila_utils.utils.COMMAND_MAX_OUTPUT',
+                        1024):
+            self.assertRaises(EnvironmentError, utils.execute, cmd, "")
+        self.assertEqual(4096, len(utils.execute(cmd, "")[0]))